@@ -108,9 +108,10 @@ def main():
         while curr_frame < n_frames:
             env.world.tick()
             env.increment_congestion_statistics()
-            recorder.process_transforms(env.vehicle_list, env.transforms)
-            recorder.process_velocities(env.vehicle_list, env.velocities)
-            recorder.process_images(env.sensor_list, env.images)
+            recorder.process_transforms(env.vehicle_list)
+            recorder.process_velocities(env.vehicle_list)
+            recorder.process_images(env.sensor_list)
+            recorder.end_tick()
             curr_frame += 1
 
     except KeyboardInterrupt:
@@ -119,9 +120,7 @@ def main():
         metadata_json = env.create_metadata()
         env.set_original_settings()
         env.clear_actors()
-        recorder.create_datasets(env.transforms, env.velocities, env.images, env.vehicle_list,
-                                 env.sensor_list, metadata_json)
-        recorder.stop_recording()
+        recorder.stop_recording(metadata_json)
 
 if __name__ == '__main__':
     main()
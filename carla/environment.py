@@ -18,9 +18,6 @@ class CarlaEnv:
         self.ai_controller_list = []
         self.pedestrian_list = []
         self.intersections = []
-        self.images = {}
-        self.transforms = {}
-        self.velocities = {}
         self.travelled_frames = {}
         self.destination_indices = {}
         self.reached_destination = {}
@@ -135,8 +132,6 @@ class CarlaEnv:
         vehicle = self.world.spawn_actor(vehicle_bp, spawn_point)
         self.vehicle_list.append(vehicle)
         vehicle_id = f'vehicle_{len(self.vehicle_list)}'
-        self.transforms[vehicle_id] = []
-        self.velocities[vehicle_id] = []
         self.vehicle_dimensions[vehicle_id] = self.process_dimensions(vehicle.bounding_box)
         self.travelled_frames[vehicle_id] = 0
         self.reached_destination[vehicle_id] = False
@@ -195,8 +190,6 @@ class CarlaEnv:
                 continue
             self.vehicle_list.append(vehicle)
             vehicle_id = f'vehicle_{len(self.vehicle_list)}'
-            self.transforms[vehicle_id] = []
-            self.velocities[vehicle_id] = []
             self.vehicle_dimensions[vehicle_id] = self.process_dimensions(vehicle.bounding_box)
             self.travelled_frames[vehicle_id] = 0
             self.reached_destination[vehicle_id] = False
@@ -216,8 +209,6 @@ class CarlaEnv:
         transform = self.create_transform(location_tuple, rotation_tuple)
         camera = self.world.spawn_actor(self.camera_bp, transform, attach_to=vehicle)
         self.sensor_list.append(camera)
-        camera_id = f'camera_{len(self.sensor_list)}'
-        self.images[camera_id] = []
         return camera
 
     def set_autopilot(self) -> None:
@@ -8,13 +8,18 @@ from PIL import Image
 class Recorder:
     """
     Class for processing data from the CARLA simulation. Specify the camera resolution
-    and the name of the resulting HDF5 file.
+    and the name of the resulting HDF5 file. The data is streamed into resizable, chunked
+    datasets: each tick is buffered and the buffers are appended to the file every
+    `flush_interval` ticks, so the memory use does not grow with the recording length.
     """
-    def __init__(self, img_width: int, img_height: int, filename: str):
+    def __init__(self, img_width: int, img_height: int, filename: str, flush_interval: int=30):
         self.img_width = img_width
         self.img_height = img_height
+        self.flush_interval = flush_interval
         self.sensor_queue = Queue()
-        self.labels = []
+        self.n_ticks = 0
+        # dataset path -> rows not yet written to the file
+        self.buffers = {}
         self.h5file = h5py.File(f'runs/{filename}.hdf5', 'w')
         self.sensors_group = self.h5file.create_group('sensors')
         self.state_group = self.h5file.create_group('state')
@@ -24,43 +29,82 @@ class Recorder:
         """Add data from the sensor to a queue."""
         self.sensor_queue.put((sensor_data, sensor_name))
 
-    def process_images(self, sensor_list: list, images: dict) -> None:
-        """Process images from all sensors into `images` dictionary."""
+    def buffer(self, path: str, row: object) -> None:
+        """Add a row to the buffer of the dataset at `path`."""
+        self.buffers.setdefault(path, []).append(row)
+
+    def create_dataset(self, path: str, dtype: object, shape: tuple=()) -> h5py.Dataset:
+        """Create a resizable dataset with one chunk per flush."""
+        return self.h5file.create_dataset(path, shape=(0, *shape), maxshape=(None, *shape),
+                                          chunks=(self.flush_interval, *shape), dtype=dtype)
+
+    def flush(self) -> None:
+        """Append the buffered rows to their datasets and write them to the disk."""
+        for path, rows in self.buffers.items():
+            if not rows:
+                continue
+            if path not in self.h5file:
+                if path.startswith('sensors/'):
+                    self.create_dataset(path, h5py.vlen_dtype(np.uint8))
+                elif path == 'labels':
+                    self.create_dataset(path, h5py.string_dtype())
+                else:
+                    self.create_dataset(path, 'f8', (len(rows[0]),))
+            dataset = self.h5file[path]
+            dataset.resize(len(dataset) + len(rows), axis=0)
+            if dataset.dtype.kind == 'O':
+                # Variable length rows, numpy would turn JPEGs of equal length into a 2D array.
+                values = np.empty(len(rows), dtype=object)
+                for i, row in enumerate(rows):
+                    values[i] = row
+                dataset[-len(rows):] = values
+            else:
+                dataset[-len(rows):] = rows
+            rows.clear()
+        self.h5file.flush()
+
+    def end_tick(self) -> None:
+        """End the recording of a tick. The buffers are flushed every `flush_interval` ticks."""
+        self.n_ticks += 1
+        if self.n_ticks % self.flush_interval == 0:
+            self.flush()
+
+    def process_images(self, sensor_list: list) -> None:
+        """Process images from all sensors into the buffers of the cameras."""
         try:
             for _ in range(len(sensor_list)):
                 data = self.sensor_queue.get(True, 1.0)
                 sensor_name = data[1]
                 image = self.process_img(data[0])
-                images[sensor_name].append(image)
+                self.buffer(f'sensors/{sensor_name}', image)
         except Empty:
             print('Some of the sensor information is missed')
 
     def process_img(self, image: object) -> np.ndarray:
-        """Transform `image` object to binary format and convert it to numpy ndarray."""
+        """Transform `image` object to JPEG and return its bytes as an uint8 ndarray."""
         img_data = np.array(image.raw_data)
         reshaped_data = img_data.reshape((self.img_height, self.img_width, 4))[:, :, :3]
         rgb_img = reshaped_data[:, :, ::-1]
         img = Image.fromarray(rgb_img)
         buf = io.BytesIO()
         img.save(buf, format='JPEG')
-        byte_img = buf.getvalue()
-        return np.asarray(byte_img)
+        return np.frombuffer(buf.getvalue(), dtype=np.uint8)
 
-    def process_transforms(self, vehicle_list: list, transforms: list) -> None:
-        """Process the transforms of all the spawned vehicles into `transforms` list."""
+    def process_transforms(self, vehicle_list: list) -> None:
+        """Process the transforms of all the spawned vehicles into the state buffers."""
         for i, vehicle in enumerate(vehicle_list):
             vehicle_id = f'vehicle_{i+1}'
             transform = vehicle.get_transform()
             state_tuple = (transform.location.x, transform.location.y, transform.rotation.yaw)
-            transforms[vehicle_id].append(state_tuple)
+            self.buffer(f'state/{vehicle_id}', state_tuple)
 
-    def process_velocities(self, vehicle_list: list, velocities: list) -> None:
-        """Process the velocities of all the spawned vehicles into `velocities` list."""
+    def process_velocities(self, vehicle_list: list) -> None:
+        """Process the velocities of all the spawned vehicles into the velocity buffers."""
         for i, vehicle in enumerate(vehicle_list):
             vehicle_id = f'vehicle_{i+1}'
             velocity = vehicle.get_velocity()
             velocity_tuple = (velocity.x, velocity.y)
-            velocities[vehicle_id].append(velocity_tuple)
+            self.buffer(f'velocity/{vehicle_id}', velocity_tuple)
 
     def process_labels(self, avg_velocity: float, ratio: float, speed_limit: float=30.0) -> None:
         """
@@ -69,22 +113,10 @@ class Recorder:
         """
         label = 'congested' if avg_velocity / speed_limit < ratio else 'not_congested'
         print(f'Avg velocity: {round(avg_velocity, 2)} km/h, label: {label}')
-        self.labels.append(label)
+        self.buffer('labels', label)
 
-    def create_datasets(self, transforms: dict, velocities: dict, images: dict, vehicle_list: list,
-                        sensor_list: list, metadata: dict, training: bool=False) -> None:
-        """Save vehicle transforms, vehicle velocities, images and metadata into HDF5."""
+    def stop_recording(self, metadata: str) -> None:
+        """Flush the remaining buffers, save the metadata and close the HDF5 file."""
+        self.flush()
         self.h5file.create_dataset('metadata', data=metadata)
-        if training:
-            self.h5file.create_dataset('labels', data=self.labels)
-        for i in range(len(vehicle_list)):
-            vehicle_id = f'vehicle_{i+1}'
-            self.state_group.create_dataset(vehicle_id, data=transforms[vehicle_id])
-            self.velocity_group.create_dataset(vehicle_id, data=velocities[vehicle_id])
-        for i in range(len(sensor_list)):
-            camera_id = f'camera_{i+1}'
-            self.sensors_group.create_dataset(camera_id, data=images[camera_id])
-
-    def stop_recording(self) -> None:
-        """Stop the recording and close the HDF5 file."""
         self.h5file.close()
@@ -52,7 +52,8 @@ def main():
         while curr_frame < n_frames:
             env.world.tick()
             recorder.process_labels(env.get_avg_velocity(intersection), ratio=0.5)
-            recorder.process_images(env.sensor_list, env.images)
+            recorder.process_images(env.sensor_list)
+            recorder.end_tick()
             curr_frame += 1
 
     except KeyboardInterrupt:
@@ -61,9 +62,7 @@ def main():
         metadata_json = env.create_metadata()
         env.set_original_settings()
         env.clear_actors()
-        recorder.create_datasets(env.transforms, env.velocities, env.images, env.vehicle_list,
-                                 env.sensor_list, metadata_json, training=True)
-        recorder.stop_recording()
+        recorder.stop_recording(metadata_json)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,151 @@
+"""
+Batched classification of the RSU camera frames of a HDF5 run. Frames are streamed
+from the file in chunks, decoded in a pool of worker processes and classified in
+batches, while the workers already decode the next chunk. Optionally only a subset
+of the frames is classified, see temporal.py.
+"""
+import io
+import os
+import json
+import math
+from multiprocessing import Pool
+import h5py
+import numpy as np
+import torch
+from PIL import Image
+from model import CongestionDetector, create_resize_transform, IMG_MEAN, IMG_STD
+from temporal import sample_probabilities, hold_probabilities, apply_hysteresis
+
+RESIZE_TRANSFORM = create_resize_transform()
+
+
+def decode_frame(frame: bytes) -> np.ndarray:
+    """
+    Decode a JPEG frame and resize and crop it with the model transform. Returns an
+    uint8 array of shape (224, 224, 3), normalization is done per batch.
+    """
+    img = Image.open(io.BytesIO(frame)).convert('RGB')
+    return np.asarray(RESIZE_TRANSFORM(img))
+
+
+def to_batch(images: list) -> torch.Tensor:
+    """Convert decoded images to a normalized tensor of shape (N, 3, 224, 224)."""
+    batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(IMG_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMG_STD).view(1, 3, 1, 1)
+    return batch.sub_(mean).div_(std)
+
+
+def get_intersection_cameras(metadata: dict) -> dict:
+    """
+    Map each intersection to the RSU cameras closest to it. RSUs are the sensors
+    without a parent vehicle, which have a location in the metadata.
+    """
+    intersections = metadata['intersections']
+    cameras = {intersection['id']: [] for intersection in intersections}
+    for sensor in metadata['sensors']:
+        if sensor.get('parent_id') is not None or 'location' not in sensor:
+            continue
+        location = sensor['location']
+        closest = min(intersections, key=lambda intersection: math.hypot(
+            intersection['location']['x'] - location['x'],
+            intersection['location']['y'] - location['y']))
+        cameras[closest['id']].append(sensor['id'])
+    return cameras
+
+
+class BatchClassifier:
+    """
+    Classifies all frames of cameras of a run with the CongestionDetector.
+    """
+    def __init__(self, detector: CongestionDetector, batch_size: int=64,
+                 n_workers: int=os.cpu_count()):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+
+    def classify_camera(self, h5file: h5py.File, camera_id: str, pool: Pool,
+                        frame_indexes: np.ndarray=None) -> np.ndarray:
+        """
+        Return the class probabilities of the frames of the camera, shape (n_frames, 2).
+        By default all frames are classified, otherwise the sorted `frame_indexes`.
+        """
+        frames = h5file[f'sensors/{camera_id}']
+        if frame_indexes is None:
+            frame_indexes = np.arange(len(frames))
+        chunks = [frame_indexes[start:start + self.batch_size]
+                  for start in range(0, len(frame_indexes), self.batch_size)]
+        probabilities = []
+        pending = None
+        for chunk in chunks:
+            decoding = pool.map_async(decode_frame, list(frames[chunk]))
+            if pending is not None:
+                probabilities.append(self.detector.predict_batch(to_batch(pending.get())))
+            pending = decoding
+        if pending is not None:
+            probabilities.append(self.detector.predict_batch(to_batch(pending.get())))
+        if not probabilities:
+            return np.zeros((0, self.detector.n_classes))
+        return np.concatenate(probabilities)
+
+    def classify_run(self, path: str, interval: int=1, margin: float=0.0,
+                     hysteresis: float=0.0, compare: bool=False) -> dict:
+        """
+        Classify the RSU cameras of each intersection of a run. Returns for each intersection
+        the share of classified camera frames predicted as congested, the share of timesteps
+        in congested state and the ground truth share.
+
+        With `interval` above 1 only every `interval`th timestep is classified, more densely
+        near the decision boundary if `margin` is above 0. The congested probability of a
+        timestep is the mean of the cameras, and `hysteresis` is the band around 0.5 for
+        changing the state. If `compare` is True, all frames are classified once to report
+        the agreement of the states with the full rate classification.
+        """
+        congested_index = self.detector.classes.index('congested')
+        results = {}
+        with h5py.File(path, 'r') as h5file, Pool(self.n_workers) as pool:
+            metadata = json.loads(h5file['metadata'][()])
+            ground_truth = metadata.get('congestion_statistics', {})
+            n_frames = metadata['n_frames']
+            for intersection_id, camera_ids in get_intersection_cameras(metadata).items():
+                if not camera_ids:
+                    continue
+                n_camera_frames = min(len(h5file[f'sensors/{camera_id}'])
+                                      for camera_id in camera_ids)
+
+                def classify(frame_indexes):
+                    # Probabilities of each camera, shape (cameras, frames).
+                    return np.stack([
+                        self.classify_camera(h5file, camera_id, pool, frame_indexes)
+                        [:, congested_index] for camera_id in camera_ids])
+
+                full_rate = classify(np.arange(n_camera_frames)) if compare else None
+                sampled = classify if full_rate is None else lambda indexes: full_rate[:, indexes]
+                camera_probabilities = []
+
+                def classify_mean(frame_indexes):
+                    probabilities = sampled(frame_indexes)
+                    camera_probabilities.append(probabilities)
+                    return probabilities.mean(axis=0)
+
+                frames, probabilities = sample_probabilities(
+                    classify_mean, n_camera_frames, interval, margin)
+                states = apply_hysteresis(
+                    hold_probabilities(frames, probabilities, n_camera_frames), hysteresis)
+                camera_probabilities = np.concatenate(camera_probabilities, axis=1)
+                congested_frames = int(np.sum(camera_probabilities >= 0.5))
+                total_frames = camera_probabilities.size
+
+                results[intersection_id] = {
+                    'cameras': camera_ids,
+                    'frames': total_frames,
+                    'congested_frames': congested_frames,
+                    'predicted_percentage': 100 * congested_frames / max(total_frames, 1),
+                    'state_percentage': 100 * float(np.mean(states)),
+                    'compute_saved': 1 - total_frames / (n_camera_frames * len(camera_ids)),
+                    'ground_truth_percentage': 100 * ground_truth.get(intersection_id, 0) / n_frames
+                }
+                if full_rate is not None:
+                    full_states = full_rate.mean(axis=0) >= 0.5
+                    results[intersection_id]['agreement'] = float(np.mean(states == full_states))
+        return results
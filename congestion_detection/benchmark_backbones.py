@@ -0,0 +1,116 @@
+"""
+Script for comparing the backbones of the CongestionDetector on the CPU. Reports the model
+size, the images per second at batch size 1 (a single RSU frame) and at a larger batch size,
+and the test accuracy if the backbone has been trained (see train.py).
+"""
+import io
+import os
+import sys
+import json
+import time
+import getopt
+import torch
+from torch.utils.data import DataLoader
+from model import CongestionDetector, BACKBONES, get_weights_path
+from dataset import load_split
+
+
+def get_model_size(detector: CongestionDetector) -> tuple:
+    """Return the amount of parameters and the size of the saved weights in megabytes."""
+    n_parameters = sum(param.numel() for param in detector.model.parameters())
+    buffer = io.BytesIO()
+    torch.save(detector.model.state_dict(), buffer)
+    return n_parameters, buffer.tell() / 1e6
+
+
+def measure_throughput(detector: CongestionDetector, batch_size: int, iterations: int) -> float:
+    """Return the images per second of the full model for random input batches."""
+    inputs = torch.randn(batch_size, 3, 224, 224)
+    detector.predict_batch(inputs) # Warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        detector.predict_batch(inputs)
+    return batch_size * iterations / (time.perf_counter() - start)
+
+
+def benchmark_backbone(backbone: str, batch_size: int, iterations: int,
+                       splits_path: str) -> dict:
+    detector = CongestionDetector(backbone=backbone)
+    n_parameters, size_mb = get_model_size(detector)
+    result = {
+        'backbone': backbone,
+        'parameters': n_parameters,
+        'size_mb': size_mb,
+        'images_per_second_batch_1': measure_throughput(detector, 1, iterations),
+        f'images_per_second_batch_{batch_size}': measure_throughput(
+            detector, batch_size, max(1, iterations // batch_size)),
+        'test_accuracy': None
+    }
+    weights_path = get_weights_path(backbone)
+    if os.path.exists(weights_path) and os.path.exists(splits_path):
+        detector.load_weights(weights_path)
+        test_data = load_split(splits_path, 'test', transform=detector.img_transform)
+        result['test_accuracy'] = detector.evaluate(DataLoader(test_data, batch_size=32))
+    return result
+
+
+def print_help():
+    help_text = "Compare the CongestionDetector backbones on the CPU.\n" \
+        "Usage: python benchmark_backbones.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        f"\t--backbones <list> - Comma separated backbones, default {','.join(BACKBONES)}\n" \
+        "\t--batch_size <int> - Larger batch size measured in addition to 1, default 32\n" \
+        "\t--iterations <int> - Amount of measured batch size 1 predictions, default 50\n" \
+        "\t--threads <int> - Amount of CPU threads used by torch, default all\n" \
+        "\t--splits <string> - Splits of make_dataset.py for the test accuracy, " \
+        "default data/splits.json\n" \
+        "\t--output <string> - Also save the results as JSON to the path\n" \
+        "\n\tExample: python benchmark_backbones.py --backbones alexnet,mobilenet_v3_small --threads 2"
+    print(help_text)
+
+
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["backbones=", "batch_size=", "iterations=",
+                                                   "threads=", "splits=", "output="])
+    RUN = True
+    BACKBONE_NAMES = list(BACKBONES)
+    BATCH_SIZE = 32
+    ITERATIONS = 50
+    SPLITS_PATH = 'data/splits.json'
+    OUTPUT_PATH = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            RUN = False
+        if opt == "--backbones":
+            BACKBONE_NAMES = arg.split(',')
+        if opt == "--batch_size":
+            BATCH_SIZE = int(arg)
+        if opt == "--iterations":
+            ITERATIONS = int(arg)
+        if opt == "--threads":
+            torch.set_num_threads(int(arg))
+        if opt == "--splits":
+            SPLITS_PATH = arg
+        if opt == "--output":
+            OUTPUT_PATH = arg
+
+    if RUN:
+        results = []
+        for backbone in BACKBONE_NAMES:
+            print(f'Benchmarking {backbone}')
+            results.append(benchmark_backbone(backbone, BATCH_SIZE, ITERATIONS, SPLITS_PATH))
+
+        print(f"\n{'backbone':<20}{'params (M)':>12}{'size (MB)':>12}{'img/s bs1':>12}"
+              f"{f'img/s bs{BATCH_SIZE}':>14}{'test acc':>10}")
+        for result in results:
+            accuracy = result['test_accuracy']
+            accuracy = '-' if accuracy is None else f'{accuracy:.3f}'
+            print(f"{result['backbone']:<20}{result['parameters'] / 1e6:>12.1f}"
+                  f"{result['size_mb']:>12.1f}{result['images_per_second_batch_1']:>12.1f}"
+                  f"{result[f'images_per_second_batch_{BATCH_SIZE}']:>14.1f}{accuracy:>10}")
+
+        if OUTPUT_PATH is not None:
+            with open(OUTPUT_PATH, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            print(f'Saved the results to {OUTPUT_PATH}')
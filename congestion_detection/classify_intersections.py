@@ -1,58 +1,90 @@
 """Script for classifying the simulated scenarios using the CongestionDetector model"""
-import io
-import json
-import h5py
-from model import CongestionDetector
-from PIL import Image
+import os
+import sys
+import time
+import getopt
+from model import CongestionDetector, BACKBONES, get_weights_path
+from batch_classifier import BatchClassifier
 
-detector = CongestionDetector()
-detector.load_weights('models/model.pt')
 
-data = h5py.File('../carla/runs/intersection_20_vehicles.hdf5', 'r')
+def print_help():
+    help_text = "Classify the RSU camera frames of a run as congested or not, for each intersection.\n" \
+        "Usage: python classify_intersections.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        "\t--run <string> - Path of the HDF5 run, default ../carla/runs/intersection_20_vehicles.hdf5\n" \
+        f"\t--backbone <string> - One of {', '.join(BACKBONES)}, default alexnet\n" \
+        "\t--weights <string> - Path of the model weights, default depends on the backbone\n" \
+        "\t--batch_size <int> - Amount of frames classified at once, default 64\n" \
+        "\t--workers <int> - Amount of processes decoding frames, default all cores\n" \
+        "\t--gpu - Run the model on the GPU\n" \
+        "\t--interval <int> - Classify only every <int>th timestep, default 1\n" \
+        "\t--margin <float> - Classify more often near probabilities within <float> of 0.5\n" \
+        "\t--hysteresis <float> - Band around 0.5 the probability has to cross to change\n" \
+        "\t\tthe congestion state of a timestep, default 0\n" \
+        "\t--compare - Also classify all frames and report the agreement of the states\n" \
+        "\n\tExample: python classify_intersections.py --run ../carla/runs/intersection_20_vehicles.hdf5" \
+        " --interval 15 --margin 0.2 --hysteresis 0.1 --compare"
+    print(help_text)
 
-metadata = json.loads(data['metadata'][()])
-ground_truth = metadata['congestion_statistics']
 
-intersection_1 = 0
-intersection_2 = 0
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["run=", "backbone=", "weights=",
+                                                   "batch_size=", "workers=", "gpu", "interval=",
+                                                   "margin=", "hysteresis=", "compare"])
+    RUN = True
+    RUN_PATH = '../carla/runs/intersection_20_vehicles.hdf5'
+    BACKBONE = 'alexnet'
+    WEIGHTS_PATH = None
+    BATCH_SIZE = 64
+    N_WORKERS = os.cpu_count()
+    USE_GPU = False
+    INTERVAL = 1
+    MARGIN = 0.0
+    HYSTERESIS = 0.0
+    COMPARE = False
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            RUN = False
+        if opt == "--run":
+            RUN_PATH = arg
+        if opt == "--backbone":
+            BACKBONE = arg
+        if opt == "--weights":
+            WEIGHTS_PATH = arg
+        if opt == "--batch_size":
+            BATCH_SIZE = int(arg)
+        if opt == "--workers":
+            N_WORKERS = int(arg)
+        if opt == "--gpu":
+            USE_GPU = True
+        if opt == "--interval":
+            INTERVAL = int(arg)
+        if opt == "--margin":
+            MARGIN = float(arg)
+        if opt == "--hysteresis":
+            HYSTERESIS = float(arg)
+        if opt == "--compare":
+            COMPARE = True
 
-# Ground truth
-for intersection in ground_truth:
-    percentage = 100 * ground_truth[intersection] / 1000
-    print(f'{intersection} was congested {percentage}% of the time')
+    if RUN:
+        detector = CongestionDetector(use_gpu=USE_GPU, backbone=BACKBONE)
+        detector.load_weights(WEIGHTS_PATH or get_weights_path(BACKBONE))
+        classifier = BatchClassifier(detector, batch_size=BATCH_SIZE, n_workers=N_WORKERS)
 
-# Intersection 1
-for frame in data['sensors/camera_21']:
-    img = Image.open(io.BytesIO(frame))
-    prediction_probabilities = detector.predict(img)
-    prediction = max(prediction_probabilities, key=prediction_probabilities.get)
-    if prediction == 'congested':
-        intersection_1 += 1
-
-for frame in data['sensors/camera_22']:
-    img = Image.open(io.BytesIO(frame))
-    prediction_probabilities = detector.predict(img)
-    prediction = max(prediction_probabilities, key=prediction_probabilities.get)
-    if prediction == 'congested':
-        intersection_1 += 1
-
-intersection_1_percentage = 100 * intersection_1 / 2000
-print(f'intersection_1 was predicted to be congested {intersection_1_percentage}% of the time')
-
-# Intersection 2
-for frame in data['sensors/camera_23']:
-    img = Image.open(io.BytesIO(frame))
-    prediction_probabilities = detector.predict(img)
-    prediction = max(prediction_probabilities, key=prediction_probabilities.get)
-    if prediction == 'congested':
-        intersection_2 += 1
-
-for frame in data['sensors/camera_24']:
-    img = Image.open(io.BytesIO(frame))
-    prediction_probabilities = detector.predict(img)
-    prediction = max(prediction_probabilities, key=prediction_probabilities.get)
-    if prediction == 'congested':
-        intersection_2 += 1
-
-intersection_2_percentage = 100 * intersection_2 / 2000
-print(f'intersection_2 was predicted to be congested {intersection_2_percentage}% of the time')
+        start = time.time()
+        results = classifier.classify_run(RUN_PATH, interval=INTERVAL, margin=MARGIN,
+                                          hysteresis=HYSTERESIS, compare=COMPARE)
+        for intersection_id, result in results.items():
+            print(f"{intersection_id} was congested {result['ground_truth_percentage']}% "
+                  f"of the time")
+            print(f"{intersection_id} was predicted to be congested "
+                  f"{result['predicted_percentage']}% of the time "
+                  f"({len(result['cameras'])} cameras, {result['frames']} frames)")
+            print(f"{intersection_id} was in congested state {result['state_percentage']:.1f}% "
+                  f"of the timesteps, {100 * result['compute_saved']:.1f}% of the frames "
+                  f"were not classified")
+            if 'agreement' in result:
+                print(f"{intersection_id} states agree with the full rate classification "
+                      f"{100 * result['agreement']:.1f}% of the timesteps")
+        print(f'Classified in {time.time() - start:.1f} seconds')
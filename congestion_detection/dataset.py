@@ -0,0 +1,119 @@
+"""
+Dataset for training the CongestionDetector directly from the HDF5 runs. A sample is a
+reference to a camera frame of a run, the frames are decoded only when they are loaded.
+The balanced train, validation and test splits are stored as index lists in a JSON file.
+"""
+import io
+import os
+import json
+import random
+import h5py
+from torch.utils.data import Dataset
+from PIL import Image
+
+CLASSES = ['congested', 'not_congested']
+
+
+def build_samples(paths: list) -> list:
+    """
+    List the frames of all cameras of the runs as (file index, camera id, frame index,
+    class index). The label of a frame is the label of its timestep.
+    """
+    samples = []
+    for file_index, path in enumerate(paths):
+        with h5py.File(path, 'r') as h5file:
+            labels = [CLASSES.index(label.decode('utf-8')) for label in h5file['labels']]
+            for sensor in h5file['sensors']:
+                n_frames = min(len(h5file[f'sensors/{sensor}']), len(labels))
+                samples += [(file_index, sensor, k, labels[k]) for k in range(n_frames)]
+    return samples
+
+
+def balance_samples(samples: list, rng: random.Random) -> list:
+    """Undersample the classes to the size of the smallest class."""
+    by_class = [[sample for sample in samples if sample[3] == label]
+                for label in range(len(CLASSES))]
+    n_samples = min(len(class_samples) for class_samples in by_class)
+    balanced = []
+    for class_samples in by_class:
+        balanced += rng.sample(class_samples, n_samples)
+    return balanced
+
+
+def split_samples(samples: list, ratio: tuple=(0.8, 0.1, 0.1), seed: int=1337) -> dict:
+    """
+    Split the samples into balanced training, validation and test sets
+    using the given ratio, the same way as splitfolders did for the image folders.
+    """
+    rng = random.Random(seed)
+    samples = balance_samples(samples, rng)
+    splits = {'train': [], 'val': [], 'test': []}
+    for label in range(len(CLASSES)):
+        class_samples = [sample for sample in samples if sample[3] == label]
+        rng.shuffle(class_samples)
+        n_train = int(ratio[0] * len(class_samples))
+        n_val = int(ratio[1] * len(class_samples))
+        splits['train'] += class_samples[:n_train]
+        splits['val'] += class_samples[n_train:n_train + n_val]
+        splits['test'] += class_samples[n_train + n_val:]
+    return splits
+
+
+def save_splits(filename: str, paths: list, splits: dict) -> None:
+    """Save the run paths and the sample index lists of each split."""
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump({'files': [os.path.abspath(path) for path in paths],
+                   'classes': CLASSES, **splits}, file)
+
+
+def load_split(filename: str, split: str, transform=None) -> 'HDF5FrameDataset':
+    """Load a split saved by `save_splits`."""
+    with open(filename, encoding='utf-8') as file:
+        data = json.load(file)
+    return HDF5FrameDataset(data['files'], data[split], transform)
+
+
+class HDF5FrameDataset(Dataset):
+    """
+    Camera frames and labels of one or more HDF5 runs. The files are opened lazily,
+    so each DataLoader worker process opens its own handles.
+    """
+    def __init__(self, paths: list, samples: list, transform=None):
+        self.paths = paths
+        self.samples = samples
+        self.transform = transform
+        self.targets = [sample[3] for sample in samples]
+        self.h5files = None
+        self.pid = None
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def get_file(self, file_index: int) -> h5py.File:
+        # Handles can not be shared with forked worker processes.
+        if self.h5files is None or self.pid != os.getpid():
+            self.h5files = [None] * len(self.paths)
+            self.pid = os.getpid()
+        if self.h5files[file_index] is None:
+            self.h5files[file_index] = h5py.File(self.paths[file_index], 'r')
+        return self.h5files[file_index]
+
+    def read_image(self, index: int) -> Image:
+        file_index, sensor, frame_index, _ = self.samples[index]
+        frame = self.get_file(file_index)[f'sensors/{sensor}'][frame_index]
+        return Image.open(io.BytesIO(frame)).convert('RGB')
+
+    def __getitem__(self, index: int) -> tuple:
+        img = self.read_image(index)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.samples[index][3]
+
+    def __getstate__(self) -> dict:
+        # Open file handles are not copied to worker processes.
+        state = self.__dict__.copy()
+        state['h5files'] = None
+        return state
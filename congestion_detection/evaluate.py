@@ -1,8 +1,8 @@
 """Script for evaluating the CongestionDetector model."""
-import os
 from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
-from model import CongestionDetector
+from torchvision import transforms
+from model import CongestionDetector, get_weights_path
+from dataset import load_split
 
 img_transform = transforms.Compose([
         transforms.Resize(size=256),
@@ -12,14 +12,15 @@ img_transform = transforms.Compose([
                              [0.229, 0.224, 0.225])
     ])
 
-PATH = 'data'
+SPLITS_PATH = 'data/splits.json'
+# One of model.BACKBONES
+BACKBONE = 'alexnet'
+N_WORKERS = 4
 
-test_directory = os.path.join(PATH, 'test')
+test_data = load_split(SPLITS_PATH, 'test', transform=img_transform)
+test_dataloader = DataLoader(test_data, batch_size=32, shuffle=True, num_workers=N_WORKERS)
 
-test_data = datasets.ImageFolder(root=test_directory, transform=img_transform)
-test_dataloader = DataLoader(test_data, batch_size=32, shuffle=True)
-
-detector = CongestionDetector()
-detector.load_weights('models/model.pt')
+detector = CongestionDetector(backbone=BACKBONE)
+detector.load_weights(get_weights_path(BACKBONE))
 
 detector.evaluate(test_dataloader=test_dataloader)
@@ -0,0 +1,176 @@
+"""
+Export the trained CongestionDetector for inference on the edge devices, and load the exported
+models. The formats are TorchScript, ONNX (run with onnxruntime) and TorchScript with the
+linear layers quantized to int8. The exported models include the weights, so only PyTorch
+(or onnxruntime) is needed to run them, and they use the same preprocessing as the model.
+
+As a script, exports the model and checks that its predictions on the test split match the
+eager model, and compares the startup time and the latency per image.
+"""
+import os
+import sys
+import time
+import getopt
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+from PIL import Image
+from model import CongestionDetector, BACKBONES, get_weights_path, create_img_transform
+from dataset import load_split
+
+FORMATS = ['torchscript', 'onnx', 'int8']
+
+
+def get_export_path(backbone: str, export_format: str) -> str:
+    """Path of the exported model next to the weights, e.g. models/model_int8.pt"""
+    root, _ = os.path.splitext(get_weights_path(backbone))
+    if export_format == 'onnx':
+        return f'{root}.onnx'
+    return f'{root}_{export_format}.pt'
+
+
+def export_model(detector: CongestionDetector, export_format: str, path: str) -> None:
+    """Export the model of the detector to the path in one of `FORMATS`."""
+    model = detector.model.cpu().eval()
+    example = torch.zeros(1, 3, 224, 224)
+    if export_format == 'onnx':
+        torch.onnx.export(model, example, path, input_names=['images'],
+                          output_names=['log_probabilities'], opset_version=13,
+                          dynamic_axes={'images': {0: 'batch'},
+                                        'log_probabilities': {0: 'batch'}})
+        return
+    if export_format == 'int8':
+        # Dynamic quantization of the linear layers, which hold most of the weights.
+        model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(scripted, path)
+
+
+class ExportedDetector:
+    """
+    Runs an exported model with the same preprocessing and outputs as CongestionDetector.
+    The model is put to evaluation mode once when it is loaded.
+    """
+    def __init__(self, path: str):
+        self.classes = ['congested', 'not_congested']
+        self.img_transform = create_img_transform()
+        self.session = None
+        if path.endswith('.onnx'):
+            import onnxruntime # Only needed for ONNX models
+            self.session = onnxruntime.InferenceSession(path,
+                                                        providers=['CPUExecutionProvider'])
+        else:
+            self.model = torch.jit.load(path, map_location='cpu').eval()
+
+    def predict(self, img: Image) -> dict:
+        """Returns a dictionary with the class probabilities."""
+        img_tensor = self.img_transform(img).view(1, 3, 224, 224)
+        return dict(zip(self.classes, self.predict_batch(img_tensor)[0]))
+
+    def predict_batch(self, img_tensors: torch.Tensor) -> np.ndarray:
+        """Returns an array of shape (N, n_classes) with the class probabilities."""
+        if self.session is not None:
+            output = self.session.run(None, {'images': img_tensors.numpy()})[0]
+            return np.exp(output)
+        with torch.inference_mode():
+            return torch.exp(self.model(img_tensors)).numpy()
+
+
+def check_parity(detector: CongestionDetector, exported: ExportedDetector,
+                 splits_path: str) -> dict:
+    """Compare the predictions of the exported model to the eager model on the test split."""
+    test_data = load_split(splits_path, 'test', transform=detector.img_transform)
+    agreement = 0
+    max_difference = 0.0
+    for inputs, _ in DataLoader(test_data, batch_size=32):
+        expected = detector.predict_batch(inputs)
+        actual = exported.predict_batch(inputs)
+        agreement += int(np.sum(expected.argmax(axis=1) == actual.argmax(axis=1)))
+        max_difference = max(max_difference, float(np.max(np.abs(expected - actual))))
+    return {'images': len(test_data), 'agreement': agreement / max(len(test_data), 1),
+            'max_probability_difference': max_difference}
+
+
+def measure_latency(predict_batch, iterations: int=20) -> float:
+    """Mean milliseconds per prediction of a single image."""
+    inputs = torch.randn(1, 3, 224, 224)
+    predict_batch(inputs) # Warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        predict_batch(inputs)
+    return 1000 * (time.perf_counter() - start) / iterations
+
+
+def print_help():
+    help_text = "Export the trained CongestionDetector and check it against the eager model.\n" \
+        "Usage: python export.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        f"\t--format <string> - One of {', '.join(FORMATS)}, default torchscript\n" \
+        f"\t--backbone <string> - One of {', '.join(BACKBONES)}, default alexnet\n" \
+        "\t--weights <string> - Path of the model weights, default depends on the backbone\n" \
+        "\t--output <string> - Path of the exported model, default next to the weights\n" \
+        "\t--splits <string> - Splits of make_dataset.py for the parity check, " \
+        "default data/splits.json\n" \
+        "\t--no_check - Only export, skip the parity and latency check\n" \
+        "\n\tExample: python export.py --format int8"
+    print(help_text)
+
+
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["format=", "backbone=", "weights=",
+                                                   "output=", "splits=", "no_check"])
+    RUN = True
+    EXPORT_FORMAT = 'torchscript'
+    BACKBONE = 'alexnet'
+    WEIGHTS_PATH = None
+    OUTPUT_PATH = None
+    SPLITS_PATH = 'data/splits.json'
+    CHECK = True
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            RUN = False
+        if opt == "--format":
+            EXPORT_FORMAT = arg
+        if opt == "--backbone":
+            BACKBONE = arg
+        if opt == "--weights":
+            WEIGHTS_PATH = arg
+        if opt == "--output":
+            OUTPUT_PATH = arg
+        if opt == "--splits":
+            SPLITS_PATH = arg
+        if opt == "--no_check":
+            CHECK = False
+
+    if RUN:
+        if EXPORT_FORMAT not in FORMATS:
+            print(f"Unknown format {EXPORT_FORMAT}. See -h for help")
+            sys.exit(2)
+        OUTPUT_PATH = OUTPUT_PATH or get_export_path(BACKBONE, EXPORT_FORMAT)
+
+        start = time.perf_counter()
+        detector = CongestionDetector(backbone=BACKBONE)
+        detector.load_weights(WEIGHTS_PATH or get_weights_path(BACKBONE))
+        eager_startup = time.perf_counter() - start
+
+        export_model(detector, EXPORT_FORMAT, OUTPUT_PATH)
+        print(f'Exported the model to {OUTPUT_PATH} '
+              f'({os.path.getsize(OUTPUT_PATH) / 1e6:.1f} MB)')
+
+        if CHECK:
+            start = time.perf_counter()
+            exported = ExportedDetector(OUTPUT_PATH)
+            exported_startup = time.perf_counter() - start
+            print(f'Startup: eager {eager_startup:.2f} s, exported {exported_startup:.2f} s')
+            print(f'Latency per image: eager {measure_latency(detector.predict_batch):.1f} ms, '
+                  f'exported {measure_latency(exported.predict_batch):.1f} ms')
+            if os.path.exists(SPLITS_PATH):
+                parity = check_parity(detector, exported, SPLITS_PATH)
+                print(f"Parity on {parity['images']} test images: "
+                      f"{100 * parity['agreement']:.1f}% same predictions, "
+                      f"max probability difference {parity['max_probability_difference']:.4f}")
+            else:
+                print(f'No test split {SPLITS_PATH}, parity not checked')
@@ -0,0 +1,98 @@
+"""
+Cache of the frozen backbone features of the CongestionDetector. Only the head of the model
+is trained, so the backbone is run once for each image and transform, and the features are
+stored in a memory-mapped array. Training epochs then only run the head on the features.
+"""
+import os
+import json
+import random
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from model import CongestionDetector
+
+
+def hash_weights(module: torch.nn.Module) -> str:
+    """Hash of the parameters and buffers of a module."""
+    digest = hashlib.sha1()
+    for name, tensor in module.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_cache_key(detector: CongestionDetector, dataset: Dataset, variant_transforms: list) -> str:
+    """
+    Identify the samples, the transforms and the backbone the cache was created with. The
+    backbone is identified by its weights, so e.g. updated pre-trained weights invalidate it.
+    """
+    key = {
+        'model': type(detector.model).__name__,
+        'weights': hash_weights(detector.backbone),
+        'samples': repr(getattr(dataset, 'samples', len(dataset))),
+        'transforms': [repr(transform) for transform in variant_transforms]
+    }
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def cache_features(detector: CongestionDetector, dataset: Dataset, filename: str,
+                   variant_transforms: list, batch_size: int=64,
+                   num_workers: int=4) -> 'FeatureDataset':
+    """
+    Compute the backbone features of every sample of the dataset once for each of the
+    transforms, and store them to `filename` with shape (variants, samples, features).
+    The first transform should be deterministic, the others can be augmentations, each of
+    which is then sampled once. An existing cache of the same data is reused.
+    """
+    info_filename = f'{filename}.json'
+    key = get_cache_key(detector, dataset, variant_transforms)
+    if os.path.exists(filename) and os.path.exists(info_filename):
+        with open(info_filename, encoding='utf-8') as file:
+            if json.load(file)['key'] == key:
+                print(f'Using cached features {filename}')
+                return FeatureDataset(np.load(filename, mmap_mode='r'), dataset.targets)
+
+    n_features = detector.extract_features(torch.zeros(1, 3, 224, 224)).shape[1]
+    shape = (len(variant_transforms), len(dataset), n_features)
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    features = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32, shape=shape)
+
+    original_transform = dataset.transform
+    for variant, transform in enumerate(variant_transforms):
+        dataset.transform = transform
+        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False,
+                                num_workers=num_workers)
+        start = 0
+        for inputs, _ in dataloader:
+            features[variant, start:start + len(inputs)] = detector.extract_features(inputs).numpy()
+            start += len(inputs)
+            print(f'Caching features of variant {variant+1}/{len(variant_transforms)}: '
+                  f'{start}/{len(dataset)}', end='\r')
+        print()
+    dataset.transform = original_transform
+    features.flush()
+
+    with open(info_filename, 'w', encoding='utf-8') as file:
+        json.dump({'key': key, 'shape': shape}, file)
+    return FeatureDataset(np.load(filename, mmap_mode='r'), dataset.targets)
+
+
+class FeatureDataset(Dataset):
+    """
+    Cached features and labels. Each access returns the features of a random variant
+    of the sample if `random_variant` is True, otherwise of the first one.
+    """
+    def __init__(self, features: np.ndarray, targets: list, random_variant: bool=True):
+        self.features = features
+        self.targets = targets
+        self.random_variant = random_variant
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> tuple:
+        variant = random.randrange(len(self.features)) if self.random_variant else 0
+        return torch.from_numpy(np.array(self.features[variant, index])), self.targets[index]
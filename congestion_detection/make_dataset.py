@@ -1,60 +1,33 @@
 """
-Script for converting one or more HDF5 files to image dataset. The dataset is split into
+Script for converting one or more HDF5 files to an image dataset. The dataset is split into
 training, validation and test sets using 80:10:10 ratio. Undersampling is used to balance
-the class distribution.
+the class distribution. The frames are not exported, the splits are saved as lists of frame
+indexes into the HDF5 files (data/splits.json), which are read by `dataset.HDF5FrameDataset`.
 """
-import os
-import shutil
-import io
-from random import sample
-import h5py
-import splitfolders
-from PIL import Image
+import sys
+from collections import Counter
+from dataset import CLASSES, build_samples, split_samples, save_splits
 
-os.makedirs('classes')
-os.makedirs('classes/congested')
-os.makedirs('classes/not_congested')
+SPLITS_PATH = 'data/splits.json'
 
-dataset_1 = h5py.File('../carla/runs/intersection_1_100_vehicles.hdf5', 'r')
-dataset_2 = h5py.File('../carla/runs/intersection_2_100_vehicles.hdf5', 'r')
+# HDF5 files can also be given as arguments.
+paths = sys.argv[1:] or ['../carla/runs/intersection_1_100_vehicles.hdf5',
+                         '../carla/runs/intersection_2_100_vehicles.hdf5']
 
-datasets = [dataset_1, dataset_2]
-
-n_samples = {
-    'congested': 0,
-    'not_congested': 0
-}
-
-for i, dataset in enumerate(datasets):
-    labels = dataset['labels']
-    sensors = dataset['sensors']
-    for j, sensor in enumerate(sensors):
-        for k, frame in enumerate(dataset[f'sensors/{sensor}']):
-            print('Processing images from dataset: ' + str(i+1) + '/' + str(len(datasets)) +
-                  ', sensor: ' + str(j+1) + '/' + str(len(sensors)) + ', timestep: ' + str(k+1) +
-                  '/' + str(len(labels)))
-            img = Image.open(io.BytesIO(frame))
-            label = labels[k].decode('utf-8')
-            path = f'classes/{label}'
-            img.save(f'{path}/dataset_{i+1}_{sensor}_frame_{k+1}.png')
-            n_samples[label] += 1
+print(f'Indexing frames from {len(paths)} datasets')
+samples = build_samples(paths)
 
+n_samples = Counter(CLASSES[sample[3]] for sample in samples)
 max_label = max(n_samples, key=n_samples.get)
 min_label = min(n_samples, key=n_samples.get)
 class_diff = n_samples[max_label] - n_samples[min_label]
 
 print(f'There are {class_diff} more images in class {max_label}')
 
-print('Undersampling...')
-
-path = f'classes/{max_label}'
-files = os.listdir(path)
-
-for file in sample(files, class_diff):
-    os.remove(f'{path}/{file}')
-
-print('Splitting data into train, validation and test sets')
-
-splitfolders.ratio('classes', 'data')
+print('Undersampling and splitting data into train, validation and test sets')
 
-shutil.rmtree('classes')
+splits = split_samples(samples)
+save_splits(SPLITS_PATH, paths, splits)
+for split in splits:
+    print(f'{split}: {len(splits[split])} images')
+print(f'Saved the splits to {SPLITS_PATH}')
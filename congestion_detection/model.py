@@ -1,36 +1,124 @@
 """Script containing a class for creating the congestion detection model."""
 import copy
 import time
+import numpy as np
 import torch
 from torch import nn
 from torch.utils.data import DataLoader
-from torchvision.models import alexnet, AlexNet_Weights
+from torchvision.models import (alexnet, AlexNet_Weights, mobilenet_v3_small,
+                                MobileNet_V3_Small_Weights, shufflenet_v2_x1_0,
+                                ShuffleNet_V2_X1_0_Weights, resnet18, ResNet18_Weights)
 from torchvision import transforms
 from PIL import Image
 
+IMG_MEAN = [0.485, 0.456, 0.406]
+IMG_STD = [0.229, 0.224, 0.225]
+
+
+def create_resize_transform() -> transforms.Compose:
+    """Resizing and cropping of the images to the input size of the model."""
+    return transforms.Compose([
+        transforms.Resize(size=256),
+        transforms.CenterCrop(size=224)
+    ])
+
+
+def create_img_transform() -> transforms.Compose:
+    """Preprocessing of the images for prediction."""
+    return transforms.Compose([
+        create_resize_transform(),
+        transforms.ToTensor(),
+        transforms.Normalize(IMG_MEAN, IMG_STD)
+    ])
+
+
+def freeze(model: nn.Module) -> nn.Module:
+    for param in model.parameters():
+        param.requires_grad = False
+    return model
+
+
+def create_alexnet(n_classes: int) -> tuple:
+    model = freeze(alexnet(weights=AlexNet_Weights.DEFAULT))
+    model.classifier[6] = nn.Linear(4096, n_classes)
+    model.classifier.add_module('7', nn.LogSoftmax(dim=1))
+    backbone = nn.Sequential(model.features, model.avgpool, nn.Flatten(1))
+    return model, backbone, model.classifier
+
+
+def create_mobilenet_v3_small(n_classes: int) -> tuple:
+    model = freeze(mobilenet_v3_small(weights=MobileNet_V3_Small_Weights.DEFAULT))
+    model.classifier[3] = nn.Linear(1024, n_classes)
+    model.classifier.add_module('4', nn.LogSoftmax(dim=1))
+    backbone = nn.Sequential(model.features, model.avgpool, nn.Flatten(1))
+    return model, backbone, model.classifier
+
+
+def create_shufflenet(n_classes: int) -> tuple:
+    model = freeze(shufflenet_v2_x1_0(weights=ShuffleNet_V2_X1_0_Weights.DEFAULT))
+    model.fc = nn.Sequential(nn.Linear(1024, n_classes), nn.LogSoftmax(dim=1))
+    # The model averages the last feature map with x.mean([2, 3]) before fc.
+    backbone = nn.Sequential(model.conv1, model.maxpool, model.stage2, model.stage3,
+                             model.stage4, model.conv5, nn.AdaptiveAvgPool2d(1), nn.Flatten(1))
+    return model, backbone, model.fc
+
+
+def create_resnet18(n_classes: int) -> tuple:
+    model = freeze(resnet18(weights=ResNet18_Weights.DEFAULT))
+    model.fc = nn.Sequential(nn.Linear(512, n_classes), nn.LogSoftmax(dim=1))
+    backbone = nn.Sequential(*list(model.children())[:-1], nn.Flatten(1))
+    return model, backbone, model.fc
+
+
+# Pre-trained models that can be used. Each returns the model, and its frozen backbone and
+# the head with the trainable layer, which share the weights with the model. The backbones
+# have no dropout and are kept in evaluation mode, so their output only depends on the input
+# image and can be cached. `head(backbone(x))` equals `model(x)`.
+BACKBONES = {
+    'alexnet': create_alexnet,
+    'mobilenet_v3_small': create_mobilenet_v3_small,
+    'shufflenet': create_shufflenet,
+    'resnet18': create_resnet18
+}
+
+
+def get_weights_path(backbone: str) -> str:
+    """Path of the saved weights of a backbone. AlexNet keeps the original path."""
+    if backbone == 'alexnet':
+        return 'models/model.pt'
+    return f'models/model_{backbone}.pt'
+
+
 class CongestionDetector:
     """
-    Class that represents the pre-trained AlexNet model that is fine-tuned to detect if
-    an image of traffic (taken by RSU) is congested or not.
+    Class that represents a pre-trained model (AlexNet by default, see `BACKBONES`) that is
+    fine-tuned to detect if an image of traffic (taken by RSU) is congested or not.
     """
-    def __init__(self, use_gpu: bool=False):
+    def __init__(self, use_gpu: bool=False, backbone: str='alexnet'):
         self.n_classes = 2
         self.classes = ['congested', 'not_congested']
         self.device = torch.device('cuda:0' if use_gpu else 'cpu')
-        self.model = alexnet(weights=AlexNet_Weights.DEFAULT)
-        for param in self.model.parameters():
-            param.requires_grad = False
-        self.model.classifier[6] = nn.Linear(4096, self.n_classes)
-        self.model.classifier.add_module('7', nn.LogSoftmax(dim=1))
+        self.backbone_name = backbone
+        self.model, self.backbone, self.head = BACKBONES[backbone](self.n_classes)
         if use_gpu:
             self.model.cuda()
+        self.img_transform = create_img_transform()
+
+    def extract_features(self, img_tensors: torch.Tensor) -> torch.Tensor:
+        """Run the frozen backbone for a batch of transformed images."""
+        with torch.inference_mode():
+            self.backbone.eval()
+            return self.backbone(img_tensors.to(self.device)).cpu()
 
     def train(self, criterion: nn.Module, optimizer: nn.Module, n_epochs: int,
-              train_dataloader: DataLoader, val_dataloader: DataLoader) -> None:
+              train_dataloader: DataLoader, val_dataloader: DataLoader,
+              cached_features: bool=False) -> None:
         """
         Train the binary classifier. Early stopping is used to save the model with
-        the highest validation accuracy.
+        the highest validation accuracy. If `cached_features` is True, the dataloaders
+        return backbone features (see feature_cache.py) and only the head is run.
         """
+        model = self.head if cached_features else self.model
         start = time.time()
         train_data_size = len(train_dataloader.dataset)
         val_data_size = len(val_dataloader.dataset)
@@ -40,6 +128,8 @@ class CongestionDetector:
             epoch_start = time.time()
             print(f'Epoch: {epoch+1}/{n_epochs}')
             self.model.train()
+            # Batch normalization statistics of the frozen backbone must not change.
+            self.backbone.eval()
             train_loss = 0
             train_accuracy = 0
             val_loss = 0
@@ -48,7 +138,7 @@ class CongestionDetector:
                 inputs = inputs.to(self.device)
                 labels = labels.to(self.device)
                 optimizer.zero_grad()
-                outputs = self.model(inputs)
+                outputs = model(inputs)
                 loss = criterion(outputs, labels)
                 loss.backward()
                 optimizer.step()
@@ -62,7 +152,7 @@ class CongestionDetector:
                 for inputs, labels in val_dataloader:
                     inputs = inputs.to(self.device)
                     labels = labels.to(self.device)
-                    outputs = self.model(inputs)
+                    outputs = model(inputs)
                     loss = criterion(outputs, labels)
                     val_loss += accuracy.item() * inputs.size(0)
                     _, preds = torch.max(outputs.data, 1)
@@ -87,25 +177,22 @@ class CongestionDetector:
 
     def predict(self, img: Image) -> dict:
         """Make predictions using the model. Returns a dictionary with the class probabilities."""
-        img_transform = transforms.Compose([
-            transforms.Resize(size=256),
-            transforms.CenterCrop(size=224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406],
-                                [0.229, 0.224, 0.225])
-        ])
-        img_tensor = img_transform(img).view(1, 3, 224, 224).to(self.device)
-        with torch.no_grad():
+        img_tensor = self.img_transform(img).view(1, 3, 224, 224)
+        probabilities = self.predict_batch(img_tensor)[0]
+        return dict(zip(self.classes, probabilities))
+
+    def predict_batch(self, img_tensors: torch.Tensor) -> np.ndarray:
+        """
+        Make predictions for a batch of transformed images with shape (N, 3, 224, 224).
+        Returns an array of shape (N, n_classes) with the class probabilities.
+        """
+        with torch.inference_mode():
             self.model.eval()
-            output = self.model(img_tensor)
-            exp_output = torch.exp(output)
-            prediction = {}
-            prediction['congested'] = exp_output.cpu().numpy()[0][0]
-            prediction['not_congested'] = exp_output.cpu().numpy()[0][1]
-            return prediction
-
-    def evaluate(self, test_dataloader: DataLoader) -> None:
-        """Evaluate the model using a separate test set."""
+            output = self.model(img_tensors.to(self.device))
+            return torch.exp(output).cpu().numpy()
+
+    def evaluate(self, test_dataloader: DataLoader) -> float:
+        """Evaluate the model using a separate test set. Returns the test accuracy."""
         test_data_size = len(test_dataloader.dataset)
         test_accuracy = 0
         with torch.no_grad():
@@ -119,6 +206,7 @@ class CongestionDetector:
                 accuracy = torch.mean(correct_counts.type(torch.FloatTensor))
                 test_accuracy += accuracy.item() * inputs.size(0)
         print(f'Test accuracy: {test_accuracy / test_data_size}')
+        return test_accuracy / test_data_size
 
     def save_weights(self, filename: str) -> None:
         """Save model weights."""
@@ -126,4 +214,4 @@ class CongestionDetector:
 
     def load_weights(self, filename: str) -> None:
         """Load model weights."""
-        self.model.load_state_dict(torch.load(filename))
+        self.model.load_state_dict(torch.load(filename, map_location=self.device))
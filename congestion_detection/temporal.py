@@ -0,0 +1,64 @@
+"""
+Temporal subsampling of the congestion classification. The congestion state changes over
+seconds while the cameras record 30 frames per second, so only every Nth frame is classified.
+Between two classified frames that are close to the decision boundary, or that disagree, the
+frames are classified more densely. The probability of the last classified frame is held until
+the next one, and hysteresis turns the probabilities into a stable state for each timestep.
+"""
+from typing import Callable
+import numpy as np
+
+
+def sample_probabilities(classify: Callable[[np.ndarray], np.ndarray], n_frames: int,
+                         interval: int, margin: float=0.0, refine_interval: int=None) -> tuple:
+    """
+    Classify every `interval`th frame with `classify`, which returns the congested probability
+    of the given frame indexes. If `margin` is above 0, the gaps next to frames whose probability
+    is within `margin` of 0.5, or between frames of different classes, are classified again every
+    `refine_interval` frames (default a quarter of `interval`).
+    Returns the sorted classified frame indexes and their probabilities.
+    """
+    frames = np.arange(0, n_frames, max(interval, 1))
+    probabilities = classify(frames)
+    if margin <= 0 or interval <= 1:
+        return frames, probabilities
+
+    refine_interval = refine_interval or max(1, interval // 4)
+    uncertain = np.abs(probabilities - 0.5) < margin
+    congested = probabilities >= 0.5
+    refined = []
+    for i, start in enumerate(frames):
+        end = frames[i + 1] if i + 1 < len(frames) else n_frames
+        changed = i + 1 < len(frames) and congested[i] != congested[i + 1]
+        if uncertain[i] or (i + 1 < len(frames) and uncertain[i + 1]) or changed:
+            refined.extend(range(start + refine_interval, end, refine_interval))
+    if not refined:
+        return frames, probabilities
+
+    refined = np.array(refined)
+    all_frames = np.concatenate([frames, refined])
+    all_probabilities = np.concatenate([probabilities, classify(refined)])
+    order = np.argsort(all_frames)
+    return all_frames[order], all_probabilities[order]
+
+
+def hold_probabilities(frames: np.ndarray, probabilities: np.ndarray, n_frames: int) -> np.ndarray:
+    """Probability of each timestep, the last classified frame is held until the next one."""
+    latest = np.searchsorted(frames, np.arange(n_frames), side='right') - 1
+    return probabilities[np.maximum(latest, 0)]
+
+
+def apply_hysteresis(probabilities: np.ndarray, band: float=0.0) -> np.ndarray:
+    """
+    Congestion state of each timestep. The state becomes congested when the probability
+    rises to 0.5 + `band` and returns to not congested when it falls to 0.5 - `band`.
+    """
+    states = np.zeros(len(probabilities), dtype=bool)
+    state = len(probabilities) > 0 and probabilities[0] >= 0.5
+    for i, probability in enumerate(probabilities):
+        if not state and probability >= 0.5 + band:
+            state = True
+        elif state and probability < 0.5 - band:
+            state = False
+        states[i] = state
+    return states
@@ -1,12 +1,16 @@
 """Script for training the CongestionDetector model."""
-import os
 from torch import nn
 from torch import optim
 from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
-from model import CongestionDetector
+from torchvision import transforms
+from model import CongestionDetector, get_weights_path
+from dataset import load_split
+from feature_cache import cache_features
 
-detector = CongestionDetector(use_gpu=True)
+# One of model.BACKBONES
+BACKBONE = 'alexnet'
+
+detector = CongestionDetector(use_gpu=True, backbone=BACKBONE)
 
 criterion = nn.NLLLoss()
 optimizer = optim.Adam(detector.model.parameters())
@@ -30,20 +34,34 @@ img_transforms = {
     ])
 }
 
-PATH = 'data'
-
-train_directory = os.path.join(PATH, 'train')
-val_directory = os.path.join(PATH, 'val')
+SPLITS_PATH = 'data/splits.json'
+N_WORKERS = 4
+# Train only the head on backbone features computed once, stored under data/features.
+USE_FEATURE_CACHE = True
+# Amount of augmented variants of each training image cached in addition to the original.
+N_AUGMENTED_VARIANTS = 2
 
 data = {
-    'train': datasets.ImageFolder(root=train_directory, transform=img_transforms['train']),
-    'val': datasets.ImageFolder(root=val_directory, transform=img_transforms['val'])
+    'train': load_split(SPLITS_PATH, 'train', transform=img_transforms['train']),
+    'val': load_split(SPLITS_PATH, 'val', transform=img_transforms['val'])
 }
 
-train_dataloader = DataLoader(data['train'], batch_size=32, shuffle=True)
-val_dataloader = DataLoader(data['val'], batch_size=32, shuffle=True)
+if USE_FEATURE_CACHE:
+    train_variants = [img_transforms['val']] + [img_transforms['train']] * N_AUGMENTED_VARIANTS
+    data['train'] = cache_features(detector, data['train'], f'data/features/{BACKBONE}_train.npy',
+                                   train_variants, num_workers=N_WORKERS)
+    data['val'] = cache_features(detector, data['val'], f'data/features/{BACKBONE}_val.npy',
+                                 [img_transforms['val']], num_workers=N_WORKERS)
+    train_dataloader = DataLoader(data['train'], batch_size=32, shuffle=True)
+    val_dataloader = DataLoader(data['val'], batch_size=32, shuffle=True)
+else:
+    train_dataloader = DataLoader(data['train'], batch_size=32, shuffle=True,
+                                  num_workers=N_WORKERS, persistent_workers=True)
+    val_dataloader = DataLoader(data['val'], batch_size=32, shuffle=True,
+                                num_workers=N_WORKERS, persistent_workers=True)
 
 detector.train(criterion=criterion, optimizer=optimizer, n_epochs=10,
-               train_dataloader=train_dataloader, val_dataloader=val_dataloader)
+               train_dataloader=train_dataloader, val_dataloader=val_dataloader,
+               cached_features=USE_FEATURE_CACHE)
 
-detector.save_weights('models/model.pt')
+detector.save_weights(get_weights_path(BACKBONE))
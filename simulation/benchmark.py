@@ -0,0 +1,193 @@
+"""
+Scaling benchmark for the DES pipeline using synthetic runs generated by
+utils/synthetic.py. Each scale is benchmarked for the DataLoader, the
+nodes (model and output summarizing), the processor and the visualization.
+The throughput curves are saved under results/benchmarks/.
+"""
+import os
+import sys
+import json
+import time
+import getopt
+import matplotlib
+matplotlib.use("Agg") # The visualization benchmark must not open windows.
+import matplotlib.pyplot as plt
+from data import DataLoader
+from main import run_simulation
+from profiler import Profiler
+from visualize import render_visualization
+from utils.synthetic import generate_run
+
+
+benchmark_folder = "results/benchmarks"
+
+
+def benchmark_dataloader(environment: str) -> dict:
+    """
+    Read every frame and state of every entity once.
+    """
+    dataloader = DataLoader(environment)
+    entity_ids = dataloader.get_entity_ids()
+    sim_length = dataloader.get_simulation_length()
+    profiler = Profiler()
+    for step in range(sim_length):
+        for entity_id in entity_ids:
+            with profiler.measure("dataloader.read_entity_state"):
+                dataloader.read_entity_state(entity_id, step)
+            with profiler.measure("dataloader.read_images"):
+                dataloader.read_images(entity_id, step)
+    report = profiler.report()
+    frames = sim_length * len(entity_ids)
+    seconds = sum(report[stage]['total_ms'] for stage in report) / 1000
+    return {"frames_per_second": frames / seconds,
+            "read_images_p95_ms": report["dataloader.read_images"]['p95_ms']}
+
+
+def stage_seconds(report: dict, prefix: str) -> float:
+    return sum(data['total_ms'] for stage, data in report.items()
+               if stage.startswith(prefix)) / 1000
+
+
+def benchmark_simulation(model_name: str, environment: str) -> tuple:
+    """
+    Run the full DES and split the cost between the nodes and the processor
+    using the profiler report. Returns the results and the run folder name.
+    """
+    profiler = Profiler()
+    start = time.perf_counter()
+    run_name = run_simulation(model_name, environment, use_rsu=True,
+                              verbose=False, profiler=profiler)
+    total_seconds = time.perf_counter() - start
+    report = profiler.report()
+    sim_length = DataLoader(environment).get_simulation_length()
+    node_seconds = stage_seconds(report, "model.") + stage_seconds(report, "node.")
+    frames = report["model.forward"]['count']
+    processor_seconds = stage_seconds(report, "processor.")
+    results = {
+        "total_seconds": total_seconds,
+        "ticks_per_second": sim_length / total_seconds,
+        "node_frames_per_second": frames / node_seconds,
+        "model_forward_p95_ms": report["model.forward"]['p95_ms'],
+        "processor_ticks_per_second": sim_length / processor_seconds,
+        "processor_process_all_p95_ms": report["processor.process_all"]['p95_ms']
+    }
+    return results, run_name
+
+
+def benchmark_visualization(run_name: str, environment: str) -> dict:
+    """
+    Render every timestep of a run to png files.
+    """
+    figures_folder = os.path.join(benchmark_folder, "figures")
+    start = time.perf_counter()
+    render_visualization(run_name, environment, interactive=False,
+                         figures_folder=figures_folder)
+    seconds = time.perf_counter() - start
+    sim_length = DataLoader(environment).get_simulation_length()
+    return {"frames_per_second": sim_length / seconds}
+
+
+def plot_curves(results: list, path: str):
+    """
+    Plot throughput as a function of the camera count for each component.
+    """
+    cameras = [result['cameras'] for result in results]
+    curves = {
+        "DataLoader frames/s": [r['dataloader']['frames_per_second'] for r in results],
+        "Node frames/s": [r['simulation']['node_frames_per_second'] for r in results],
+        "Processor ticks/s": [r['simulation']['processor_ticks_per_second'] for r in results],
+        "Simulation ticks/s": [r['simulation']['ticks_per_second'] for r in results],
+        "Visualization frames/s": [r['visualization']['frames_per_second'] for r in results]
+    }
+    fig, ax = plt.subplots()
+    for label, values in curves.items():
+        ax.plot(cameras, values, marker='o', label=label)
+    ax.set_title("DES throughput with synthetic runs")
+    ax.set_xlabel("Cameras")
+    ax.set_ylabel("Throughput")
+    ax.set_yscale("log")
+    ax.legend()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+def run_benchmarks(scales: list, model_name: str, n_frames: int, n_rsus: int,
+                   resolution: tuple, density: float) -> list:
+    results = []
+    for n_vehicles in scales:
+        environment = f"synthetic_{n_vehicles}_vehicles_{n_rsus}_rsus_{n_frames}_frames_" \
+                      f"{resolution[0]}x{resolution[1]}_density_{density}.hdf5"
+        # Generated files are reused between benchmark runs.
+        if not os.path.exists(os.path.join("runs", environment)):
+            print(f"Generating {environment}")
+            generate_run(environment, n_vehicles=n_vehicles, n_rsus=n_rsus,
+                         n_frames=n_frames, img_width=resolution[0],
+                         img_height=resolution[1], detections_per_frame=density)
+
+        print(f"\nBenchmarking {n_vehicles} vehicles and {n_rsus} RSUs")
+        result = {"vehicles": n_vehicles, "cameras": n_vehicles + n_rsus,
+                  "frames": n_frames}
+        result['dataloader'] = benchmark_dataloader(environment)
+        result['simulation'], run_name = benchmark_simulation(model_name, environment)
+        result['visualization'] = benchmark_visualization(run_name, environment)
+        print(json.dumps(result, indent=1))
+        results.append(result)
+    return results
+
+
+def print_help(model_options):
+    help_text = "Benchmark the DES with synthetic runs of increasing size.\n" \
+        "Usage: python benchmark.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        "\t--scales <list> - Vehicle counts separated by comma.\n" \
+        "\t--model <model> - YOLOv5 model used by the nodes. " \
+        f"Options: {model_options}\n" \
+        "\t--frames <int> - Simulation steps for each scale.\n" \
+        "\t--rsus <int> - Amount of RSU cameras.\n" \
+        "\t--resolution <width>x<height> - Camera resolution.\n" \
+        "\t--density <float> - Mean amount of objects drawn per frame.\n" \
+        "\n\tExample: python benchmark.py --scales 5,10,20,40 --model nano --frames 50"
+    print(help_text)
+
+
+if __name__ == "__main__":
+    MODEL_OPTIONS = ["nano", "small", "medium", "large", "xlarge"]
+
+    SCALES = [5, 10, 20, 40]
+    MODEL = "nano"
+    FRAMES = 50
+    RSUS = 4
+    RESOLUTION = (640, 640)
+    DENSITY = 4.0
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["scales=", "model=", "frames=",
+                                                   "rsus=", "resolution=", "density="])
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help(MODEL_OPTIONS)
+            sys.exit(0)
+        if opt == "--scales":
+            SCALES = [int(scale) for scale in arg.split(',')]
+        if opt == "--model":
+            MODEL = arg
+        if opt == "--frames":
+            FRAMES = int(arg)
+        if opt == "--rsus":
+            RSUS = int(arg)
+        if opt == "--resolution":
+            RESOLUTION = tuple(int(value) for value in arg.split('x'))
+        if opt == "--density":
+            DENSITY = float(arg)
+
+    if MODEL not in MODEL_OPTIONS:
+        print("MODEL argument is wrong. See -h for help.")
+        sys.exit(2)
+
+    benchmark_results = run_benchmarks(SCALES, MODEL, FRAMES, RSUS, RESOLUTION, DENSITY)
+
+    if not os.path.exists(benchmark_folder):
+        os.makedirs(benchmark_folder)
+    name = f"benchmark-{MODEL}-{int(time.time())}"
+    with open(os.path.join(benchmark_folder, f"{name}.json"), 'w', encoding="utf-8") as file:
+        json.dump(benchmark_results, file, indent=1)
+    plot_curves(benchmark_results, os.path.join(benchmark_folder, f"{name}.png"))
+    print(f"\nSaved benchmark results to {benchmark_folder}/{name}.json")
@@ -0,0 +1,111 @@
+"""
+Class for using the CongestionDetector of the folder congestion_detection
+in the simulation. RSU cameras can classify the congestion of their
+intersection directly from the image instead of detecting objects with yolo.
+"""
+import os
+import time
+import importlib.util
+from typing import List
+import numpy as np
+import torch
+from PIL import Image
+from data import DataLoader
+from profiler import Profiler
+from scheduler import Scheduler
+
+CONGESTION_DETECTION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "congestion_detection")
+
+
+def load_congestion_detection_model():
+    """
+    Import congestion_detection/model.py. It is loaded by path, as the
+    simulation has its own model.py for yolo.
+    """
+    spec = importlib.util.spec_from_file_location(
+        "congestion_detection_model", os.path.join(CONGESTION_DETECTION_PATH, "model.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CongestionModel:
+    """
+    Classifies the camera images of a group of nodes (the RSUs) in a single batch.
+    The first node asking for a prediction at a simulation step runs the batch
+    for all nodes of the group, the other nodes get the cached result.
+    """
+    def __init__(self, dataloader: DataLoader, node_ids: List[str], profiler: Profiler,
+                 backbone: str = 'alexnet', weights_path: str = None,
+                 scheduler: Scheduler = None):
+        congestion_detection = load_congestion_detection_model()
+        self.detector = congestion_detection.CongestionDetector(backbone=backbone)
+        if weights_path is None:
+            weights_path = os.path.join(CONGESTION_DETECTION_PATH,
+                                        congestion_detection.get_weights_path(backbone))
+        self.detector.load_weights(weights_path)
+        self.congested_index = self.detector.classes.index('congested')
+        self.dataloader = dataloader
+        self.node_ids = node_ids
+        self.profiler = profiler
+        self.scheduler = scheduler
+        self.simulation_step = None
+        self.probabilities = {}
+        self.n_batches = 0
+        self.n_images = 0
+        self.seconds = 0.0
+        print(f"Initialized congestion model {backbone} for {len(node_ids)} nodes")
+
+    def get_active_node_ids(self, simulation_step: int) -> List[str]:
+        """
+        Nodes of the group running inference at the step, see Scheduler.
+        """
+        if self.scheduler is None:
+            return self.node_ids
+        return [node_id for node_id in self.node_ids
+                if self.scheduler.is_scheduled(node_id, simulation_step)]
+
+    def forward_batch(self, simulation_step: int) -> dict:
+        """
+        Returns the congested probability of the image of each active node at the step.
+        """
+        node_ids = self.get_active_node_ids(simulation_step)
+        images = []
+        for node_id in node_ids:
+            with self.profiler.measure("dataloader.read_images", node_id):
+                image = self.dataloader.read_images(node_id, simulation_step)
+            images.append(Image.fromarray(image))
+        start = time.perf_counter()
+        img_tensors = torch.stack([self.detector.img_transform(img) for img in images])
+        probabilities = self.detector.predict_batch(img_tensors)[:, self.congested_index]
+        duration = time.perf_counter() - start
+        # Each node of the batch is charged an equal share of the inference, as in ModelGroup.
+        for node_id in node_ids:
+            self.profiler.record("congestion_model.forward", duration / len(node_ids), node_id)
+        self.n_batches += 1
+        self.n_images += len(images)
+        self.seconds += duration
+        return dict(zip(node_ids, np.asarray(probabilities, dtype=float)))
+
+    def forward(self, node_id: str, simulation_step: int) -> float:
+        """
+        Returns the congested probability of the image of the node at the step.
+        """
+        if simulation_step != self.simulation_step:
+            self.probabilities = self.forward_batch(simulation_step)
+            self.simulation_step = simulation_step
+        return self.probabilities[node_id]
+
+    def get_cost(self) -> dict:
+        """
+        Summary of the inference cost, same as ModelGroup.get_cost.
+        """
+        return {
+            "model": self.detector.backbone_name,
+            "nodes": len(self.node_ids),
+            "batches": self.n_batches,
+            "images": self.n_images,
+            "total_s": self.seconds,
+            "ms_per_image": 1000 * self.seconds / max(self.n_images, 1)
+        }
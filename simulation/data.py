@@ -6,6 +6,7 @@ import os
 import io
 import json
 import math
+from collections import OrderedDict
 from typing import List, Tuple
 import h5py
 from numpy import ndarray, asarray
@@ -17,8 +18,25 @@ class DataLoader():
     """
     Abstraction class for reading data from the hdf5 files.
     """
-    def __init__(self, file='intersection_5_vehicles.hdf5'):
+    def __init__(self, file='intersection_5_vehicles.hdf5', thumbnail_cache_size=1024):
         self.h5file = h5py.File(os.path.join("runs/", file), 'r')
+        self.metadata = None
+        # (agent name, simulation step, width) -> thumbnail, least recently used first.
+        self.thumbnails = OrderedDict()
+        self.thumbnail_cache_size = thumbnail_cache_size
+
+    def get_metadata(self) -> dict:
+        """
+        Read the metadata json. It is parsed only once, as it includes
+        all waypoints of the map and is needed at every simulation step.
+        """
+        if self.metadata is None:
+            data = self.h5file.get("metadata", 'r')
+            # .value is old syntax. [()] does same now.
+            data = data[()].decode("UTF-8")
+            # Convert bytes to a dictionary
+            self.metadata = json.loads(data)
+        return self.metadata
 
     def get_entity_ids(self) -> list[str]:
         """
@@ -32,11 +50,7 @@ class DataLoader():
         Read intersection metadata to get the 
         locations of intersections
         """
-        data = self.h5file.get("metadata", 'r')
-        # .value is old syntax. [()] does same now.
-        data = data[()].decode("UTF-8")
-        # Convert bytes to a dictionary
-        data = json.loads(data)
+        data = self.get_metadata()
         return data.get("intersections", 'r')
 
     def get_simulation_length(self) -> int:
@@ -53,6 +67,29 @@ class DataLoader():
         img_data = asarray(img)
         return img_data
 
+    def read_thumbnail(self, agent_name: str, simulation_step: int, width: int) -> ndarray:
+        """
+        Returns entity camera photo at simulation step downscaled to the width.
+        JPEG frames are decoded directly at a reduced scale (draft mode) and
+        the thumbnails are cached, as the same frames are viewed repeatedly.
+        """
+        key = (agent_name, simulation_step, width)
+        thumbnail = self.thumbnails.get(key)
+        if thumbnail is not None:
+            self.thumbnails.move_to_end(key)
+            return thumbnail
+
+        frames = self.h5file.get(f'sensors/{agent_name}', 'r')
+        img = Image.open(io.BytesIO(frames[simulation_step]))
+        height = round(img.height * width / img.width)
+        img.draft('RGB', (width, height))
+        thumbnail = asarray(img.convert('RGB').resize((width, height), Image.BILINEAR))
+
+        self.thumbnails[key] = thumbnail
+        if len(self.thumbnails) > self.thumbnail_cache_size:
+            self.thumbnails.popitem(last=False)
+        return thumbnail
+
     def get_image_dimensions(self):
         metadata = self.get_metadata_summary()
         return metadata['img_width'], metadata['img_height']
@@ -61,11 +98,7 @@ class DataLoader():
         """
         Summary for visualization of scene metadata
         """
-        data = self.h5file.get("metadata", 'r')
-        # .value is old syntax. [()] does same now.
-        data = data[()].decode("UTF-8")
-        # Convert bytes to a dictionary
-        data = json.loads(data)
+        data = self.get_metadata()
         metadata_summary = {
             "timestamp": data['timestamp'],
             "map_name": data['map'],
@@ -87,10 +120,7 @@ class DataLoader():
         """
         Returns all map markers for visualization purposes.
         """
-        data = self.h5file.get("metadata", 'r')
-        # .value is old syntax. [()] does same now.
-        data = data[()].decode("UTF-8")
-        data = json.loads(data)
+        data = self.get_metadata()
         return data['waypoints']
 
 
@@ -103,10 +133,8 @@ class DataLoader():
         
         data = self.h5file.get(f'state/{entity_vehicle}')
         if data is None: # If no state, the entity is a RSU
-            data = self.h5file.get("metadata", 'r')
-            data = data[()].decode("UTF-8")
-            data = json.loads(data)
-            
+            data = self.get_metadata()
+
             # Find the RSU under metadata/sensors. A RSU does not have a parent and has a location.
             for entity_data in data.get('sensors'):
                 if "location" in entity_data and entity_data['id'] == entity:
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 import json
 
 
@@ -37,3 +38,10 @@ class OutputSummary:
     velocity: float
     detections: list[DetectionData] # Cars detected by yolo
     timestep: int
+    # Congested probability of the closest intersection, if the node
+    # classifies its image with the CongestionDetector instead of yolo.
+    congestion: Optional[float] = None
+
+    def to_json(self):
+        return json.dumps(self, default=lambda o: o.__dict__,
+            sort_keys=True, indent=1)
@@ -4,10 +4,16 @@ import sys
 import getopt
 import time
 import simpy
-from node import Node
-from processor import Processor
+from node import Node, CongestionNode
+from processor import Processor, StatusMerger
+from regions import RegionCoordinator
 from data import DataLoader
-from model import Model
+from model import Model, ModelGroup
+from congestion_model import CongestionModel
+from profiler import Profiler
+from scheduler import Scheduler
+from roi import DEFAULT_ROIS, parse_roi
+from network import Network, DEFAULT_LINKS, parse_link
 
 
 def print_progress(env, max_steps):
@@ -17,12 +23,21 @@ def print_progress(env, max_steps):
         yield env.timeout(1)
 
 
-def write_data(run_name: str, processed_data: dict):
+def write_data(run_name: str, processed_data: dict, profiler: Profiler,
+               reports: dict = None):
     # Write collected data to multiple output files
     folder = f"results/{run_name}/"
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+    # Stage timings, used for finding what to optimize.
+    profiler.write(folder + "profile.json")
+    # Other reports, such as the cost of the models (models.json), the update
+    # rates of scheduled nodes (schedule.json) and network latencies (network.json).
+    for name, report in (reports or {}).items():
+        with open(folder + f"{name}.json", 'w', encoding="utf-8") as file:
+            json.dump(report, file, indent=1)
+
     # First write simulation results
     path_results = folder + "results.json"
     with open(path_results, 'w', encoding="utf-8") as file:
@@ -39,25 +54,100 @@ def write_data(run_name: str, processed_data: dict):
         #print(type(data))
         json.dump(data, file)
 
+
+def get_model_assignment(agent_ids: list, rsu_ids: list, model_name: str,
+                         rsu_model: str, camera_models: dict) -> dict:
+    """
+    Returns the model of each node. Vehicles use model_name and RSUs rsu_model.
+    camera_models maps camera ids to a model, overriding the model of single
+    cameras. The model "yolo" means the same model as the vehicles.
+    """
+    assignment = {}
+    for node_id in agent_ids:
+        model = rsu_model if node_id in rsu_ids else model_name
+        model = camera_models.get(node_id, model)
+        assignment[node_id] = model_name if model == "yolo" else model
+    return assignment
+
+
+def get_processor_assignment(agent_ids: list, rsu_ids: list, n_processors: int,
+                             method: str = "round_robin") -> dict:
+    """
+    Returns the index of the processor of each node. With "round_robin" the nodes
+    are spread evenly. With "type" the RSUs use the first processor and the
+    vehicles the others.
+    """
+    if method == "type" and n_processors > 1:
+        vehicle_ids = [node_id for node_id in agent_ids if node_id not in rsu_ids]
+        assignment = {node_id: 0 for node_id in rsu_ids}
+        assignment.update({node_id: 1 + i % (n_processors - 1)
+                           for i, node_id in enumerate(vehicle_ids)})
+        return assignment
+    return {node_id: i % n_processors for i, node_id in enumerate(agent_ids)}
+
+
+def print_processor_reports(processor_reports: dict):
+    print(f"{'processor':<14}{'nodes':>7}{'util %':>8}{'mean queue':>12}"
+          f"{'max queue':>11}{'p95 stale ms':>14}")
+    for processor_id, report in processor_reports.items():
+        n_nodes = '-' if report['nodes'] is None else len(report['nodes'])
+        utilization = 100 * (report['utilization'] or 0)
+        staleness = report['staleness']['p95_ms'] if 'staleness' in report else 0
+        print(f"{processor_id:<14}{n_nodes:>7}{utilization:>8.1f}"
+              f"{report['mean_queue_length']:>12.2f}{report['max_queue_length']:>11}"
+              f"{staleness:>14.1f}")
+
+
+def print_model_costs(model_costs: dict):
+    print(f"{'model':<10}{'nodes':>7}{'images':>9}{'total s':>10}{'ms/image':>10}")
+    for name, cost in model_costs.items():
+        print(f"{name:<10}{cost['nodes']:>7}{cost['images']:>9}"
+              f"{cost['total_s']:>10.2f}{cost['ms_per_image']:>10.1f}")
+
+
 def run_simulation(
-        model_name: str, environment: str, use_rsu: bool, verbose: bool):
+        model_name: str, environment: str, use_rsu: bool, verbose: bool,
+        profiler: Profiler = None, rsu_model: str = "yolo",
+        congestion_backbone: str = "alexnet", congestion_weights: str = None,
+        camera_models: dict = None, budget_frames: int = None,
+        budget_ms: float = None, rois: dict = None, network_links: dict = None,
+        deadline: float = 0.9, n_processors: int = 1, processor_assignment: str = "round_robin",
+        processor_cores: int = None, processor_speed: float = None, n_regions: int = None,
+        region_workers: int = 0) -> str:
     """
     Simpy simulation for agents to combine data from sensors to create
     an overview of the situation by sharing data. The agents are represented
     as network nodes, while the processor represents a centralized processing unit
     that creates the overview. Simulation ticks correspond to ticks, at which data
-    was collected from the Carla simulator.
+    was collected from the Carla simulator. Returns the name of the results folder.
+    Vehicles use the yolo model model_name. RSUs use the model rsu_model, which is
+    either "yolo" (same as vehicles), a yolo model name or "cnn" to classify the
+    congestion of their intersection with the CongestionDetector (congestion_backbone,
+    congestion_weights). camera_models overrides the model of single cameras.
+    Nodes with the same model share it and are detected in a single batch.
+    With budget_frames or budget_ms, a scheduler limits the frames or estimated
+    inference milliseconds per tick, and skipped nodes reuse their previous output.
+    rois maps the camera types "vehicle" and "rsu" to the region of interest
+    of their images given to yolo, see roi.py. With network_links, the nodes send
+    their output over a simulated network with the link settings of each node type
+    (see network.py), and the processor fuses what has arrived deadline ticks after
+    the start of the tick. The nodes are assigned to n_processors processors with
+    processor_assignment. With processor_cores or processor_speed, the processors
+    are modelled as servers with cores and a service time measured on this machine
+    and scaled with the speed, so processing takes simulated time and ticks queue.
+    With n_regions, the processing is instead sharded into regions of intersections,
+    each with its own processor, running in region_workers processes (see regions.py).
     """
     env = simpy.Environment()
     dataloader = DataLoader(environment)
-    yolo_model = Model(model_name)
+    if profiler is None:
+        profiler = Profiler()
 
     sim_length = dataloader.get_simulation_length()
     agent_ids = dataloader.get_entity_ids()
-    # Use a dictionary entry for all agents and the value will be the latest output.
-    # This will be a temporary communication pipe
-    # Later this could use actual simpy store as done in
-    # https://simpy.readthedocs.io/en/latest/examples/process_communication.html
+    # Use a dictionary entry for all agents and the value will be the latest output
+    # received by the processor. Nodes write to it directly, or with network_links
+    # the simulated network (simpy stores) delivers the outputs to it.
     data_pipe = {}
     # yolo_images is dict with key agent value detections for each timestep
     result_storage_pipe = {
@@ -68,14 +158,74 @@ def run_simulation(
         'yolo_images': []
     }
 
+    rsu_ids = [node_id for node_id in agent_ids
+               if dataloader.read_entity_state(node_id, 0).is_rsu]
+    assignment = get_model_assignment(agent_ids, rsu_ids, model_name, rsu_model,
+                                      camera_models or {})
+    network = None
+    if network_links is not None:
+        fps = dataloader.get_metadata_summary()['fps']
+        network = Network(env, data_pipe, fps, network_links)
+
+    scheduler = None
+    if budget_frames is not None or budget_ms is not None:
+        scheduler = Scheduler(dataloader, agent_ids, budget_frames, budget_ms)
+
+    rois = rois or {}
+    node_rois = {node_id: rois.get("rsu" if node_id in rsu_ids else "vehicle")
+                 for node_id in agent_ids}
+
+    # One model group for each model, so the nodes using it share the batch.
+    model_groups = {}
+    for name in dict.fromkeys(assignment.values()):
+        node_ids = [node_id for node_id in agent_ids if assignment[node_id] == name]
+        if name == "cnn":
+            model_groups[name] = CongestionModel(dataloader, node_ids, profiler,
+                                                 congestion_backbone, congestion_weights,
+                                                 scheduler)
+        else:
+            model_groups[name] = ModelGroup(name, Model(name), dataloader, node_ids,
+                                            profiler, scheduler, node_rois)
+    if scheduler is not None:
+        scheduler.node_models = {node_id: model_groups[assignment[node_id]]
+                                 for node_id in agent_ids}
+
     # Create nodes and add to simulation as processes
     for node_id in agent_ids:
-        node = Node(env, node_id, dataloader, yolo_model, data_pipe, result_storage_pipe)
+        model_group = model_groups[assignment[node_id]]
+        if assignment[node_id] == "cnn":
+            node = CongestionNode(env, node_id, dataloader, model_group, data_pipe,
+                                  result_storage_pipe, profiler, scheduler, network)
+        else:
+            node = Node(env, node_id, dataloader, model_group, data_pipe,
+                        result_storage_pipe, profiler, scheduler, network)
         env.process( node.run() )
 
-    # Create the 'central processor' process.
-    processor = Processor(env, data_pipe, result_storage_pipe, dataloader)
-    env.process( processor.run() )
+    # Create the 'central processor' processes.
+    if processor_speed is not None and processor_cores is None:
+        processor_cores = 1
+    node_processors = get_processor_assignment(agent_ids, rsu_ids, n_processors,
+                                               processor_assignment)
+    processors = []
+    coordinator = None
+    if n_regions is not None:
+        coordinator = RegionCoordinator(env, data_pipe, result_storage_pipe, dataloader,
+                                        profiler, environment, n_regions, region_workers,
+                                        deadline if network is not None else 0)
+        env.process( coordinator.run() )
+        n_processors = 0
+    # With several processors, their statuses are merged to one per intersection.
+    merger = StatusMerger(result_storage_pipe, n_processors) if n_processors > 1 else None
+    for i in range(n_processors):
+        node_ids = None
+        if n_processors > 1:
+            node_ids = [node_id for node_id in agent_ids if node_processors[node_id] == i]
+        processor = Processor(env, data_pipe, result_storage_pipe, dataloader, profiler,
+                              deadline if network is not None else 0, f"processor_{i}",
+                              node_ids, processor_cores, processor_speed or 1.0,
+                              merger=merger)
+        env.process( processor.run() )
+        processors.append(processor)
 
     if verbose:
         env.process( print_progress(env, sim_length))
@@ -86,12 +236,38 @@ def run_simulation(
     final_time = time.time() - start_time
     loop_time = final_time / sim_length
     
+    if coordinator is not None:
+        coordinator.close()
+    
     print("") # <- as previous prints may not have had line endings
     print(f"Simulation lasted {final_time:.1f} seconds.")
     print(f"Simulation for each timestep took approximitely {loop_time:.3f} seconds.")
+    reports = {"models": {name: group.get_cost() for name, group in model_groups.items()}}
+    if scheduler is not None:
+        reports["schedule"] = scheduler.report()
+    if network is not None:
+        reports["network"] = network.report()
+    if coordinator is not None:
+        reports["regions"] = coordinator.report()
+    if processor_cores is not None or n_processors > 1:
+        reports["processors"] = {processor.processor_id: processor.report()
+                                 for processor in processors}
+    if verbose:
+        profiler.print_summary()
+        print_model_costs(reports["models"])
+        if scheduler is not None:
+            scheduler.print_summary()
+        if network is not None:
+            network.print_summary()
+        if "processors" in reports:
+            print_processor_reports(reports["processors"])
+        if coordinator is not None:
+            coordinator.print_summary()
     # Write processed results for visualization
-    run_name = f"{model_name}-{environment}-rsu_used_{USE_RSU}-{int(time.time())}"
-    write_data(run_name, result_storage_pipe)
+    rsu_name = f"rsu_used_{use_rsu}" if rsu_model == "yolo" else f"rsu_{rsu_model}"
+    run_name = f"{model_name}-{environment}-{rsu_name}-{int(time.time())}"
+    write_data(run_name, result_storage_pipe, profiler, reports)
+    return run_name
 
 
 def print_help(model_options):
@@ -104,6 +280,37 @@ def print_help(model_options):
         "\t--model <model> - Can be either single model name or " \
         "a list of models separated by comma.\n" \
         f"\tOptions: {model_options}\n" \
+        "\t--rsu_model <string> - Model of the RSUs. yolo (default) uses the same model as\n" \
+        "\t\tthe vehicles, or one of the options above. With cnn the RSUs classify the\n" \
+        "\t\tcongestion of their intersection with the CongestionDetector instead of yolo.\n" \
+        "\t--camera_models <list> - Models of single cameras, e.g. camera_21=xlarge,camera_3=nano\n" \
+        "\t--budget_frames <int> - Maximum amount of camera frames inferred each tick.\n" \
+        "\t\tNodes close to intersections, fast and not recently updated are preferred.\n" \
+        "\t--budget_ms <float> - Maximum estimated inference milliseconds each tick\n" \
+        "\t--roi - Detect only the region of interest of the images, by default\n" \
+        f"\t\t{DEFAULT_ROIS} (top, bottom, left, right)\n" \
+        "\t--vehicle_roi <top,bottom[,left,right]> - Region of interest of vehicle cameras\n" \
+        "\t\tas fractions of the image, e.g. 0.3,0.85\n" \
+        "\t--rsu_roi <top,bottom[,left,right]> - Region of interest of RSU cameras\n" \
+        "\t--network - Send the node outputs over a simulated network, by default\n" \
+        f"\t\t{DEFAULT_LINKS}\n" \
+        "\t--vehicle_link <settings> - Network link of vehicles, e.g. latency_ms=30,loss=0.05\n" \
+        "\t--rsu_link <settings> - Network link of RSUs, e.g. bandwidth_mbps=1\n" \
+        "\t--deadline <float> - Fraction of a tick after which the processor fuses the\n" \
+        "\t\toutputs that have arrived over the network, default 0.9\n" \
+        "\t--processors <int> - Amount of processors, default 1\n" \
+        "\t--processor_assignment <string> - round_robin (default) or type (RSUs to the\n" \
+        "\t\tfirst processor, vehicles to the others)\n" \
+        "\t--processor_cores <int> - Model the processors as servers with <int> cores,\n" \
+        "\t\twhere processing a tick takes time and the ticks queue\n" \
+        "\t--processor_speed <float> - Speed of the servers relative to this machine\n" \
+        "\t--regions <int> - Shard the processing into regions of intersections, each\n" \
+        "\t\twith its own processor, instead of using the options above\n" \
+        "\t--region_workers <int> - Amount of processes processing the regions, default 0\n" \
+        "\t\t(in the simulation process)\n" \
+        "\t--congestion_backbone <string> - Backbone of the CongestionDetector, default alexnet\n" \
+        "\t--congestion_weights <string> - Path of the CongestionDetector weights,\n" \
+        "\t\tdefault the weights of the backbone under congestion_detection/models\n" \
         "\t--environment <env> - Name of the CARLA data file to be used.\n" \
         "\n\tExample: python main.py -no_rsu --model nano,medium " \
         "\ --environment intersection_5_vehicles.hdf5"
@@ -119,8 +326,31 @@ if __name__ == "__main__":
     USE_RSU = True
     VERBOSE = True
     CARLA_ENVIRONMENT = "intersection_5_vehicles.hdf5"
+    RSU_MODEL = "yolo"
+    CONGESTION_BACKBONE = "alexnet"
+    CONGESTION_WEIGHTS = None
+    CAMERA_MODELS = {}
+    BUDGET_FRAMES = None
+    BUDGET_MS = None
+    ROIS = {}
+    NETWORK_LINKS = None
+    DEADLINE = 0.9
+    N_PROCESSORS = 1
+    PROCESSOR_ASSIGNMENT = "round_robin"
+    PROCESSOR_CORES = None
+    PROCESSOR_SPEED = None
+    N_REGIONS = None
+    REGION_WORKERS = 0
     opts, args = getopt.getopt(sys.argv[1:], "h", ["model=", "environment=",
-                                                   "no_rsu", "no_verbose"])
+                                                   "no_rsu", "no_verbose", "rsu_model=",
+                                                   "congestion_backbone=",
+                                                   "congestion_weights=", "camera_models=",
+                                                   "budget_frames=", "budget_ms=", "roi",
+                                                   "vehicle_roi=", "rsu_roi=", "network",
+                                                   "vehicle_link=", "rsu_link=", "deadline=",
+                                                   "processors=", "processor_assignment=",
+                                                   "processor_cores=", "processor_speed=",
+                                                   "regions=", "region_workers="])
     for opt, arg in opts:
         if opt == "-h":
             print_help(MODEL_OPTIONS)
@@ -134,6 +364,44 @@ if __name__ == "__main__":
             MODEL = arg.split(',')
         if opt == "--environment":
             CARLA_ENVIRONMENT = arg
+        if opt == "--rsu_model":
+            RSU_MODEL = arg
+        if opt == "--congestion_backbone":
+            CONGESTION_BACKBONE = arg
+        if opt == "--congestion_weights":
+            CONGESTION_WEIGHTS = arg
+        if opt == "--camera_models":
+            CAMERA_MODELS = dict(item.split('=') for item in arg.split(','))
+        if opt == "--budget_frames":
+            BUDGET_FRAMES = int(arg)
+        if opt == "--budget_ms":
+            BUDGET_MS = float(arg)
+        if opt == "--roi":
+            ROIS = {**DEFAULT_ROIS, **ROIS}
+        if opt == "--vehicle_roi":
+            ROIS["vehicle"] = parse_roi(arg)
+        if opt == "--rsu_roi":
+            ROIS["rsu"] = parse_roi(arg)
+        if opt == "--network":
+            NETWORK_LINKS = NETWORK_LINKS or {}
+        if opt == "--vehicle_link":
+            NETWORK_LINKS = {**(NETWORK_LINKS or {}), "vehicle": parse_link(arg)}
+        if opt == "--rsu_link":
+            NETWORK_LINKS = {**(NETWORK_LINKS or {}), "rsu": parse_link(arg)}
+        if opt == "--deadline":
+            DEADLINE = float(arg)
+        if opt == "--processors":
+            N_PROCESSORS = int(arg)
+        if opt == "--processor_assignment":
+            PROCESSOR_ASSIGNMENT = arg
+        if opt == "--processor_cores":
+            PROCESSOR_CORES = int(arg)
+        if opt == "--processor_speed":
+            PROCESSOR_SPEED = float(arg)
+        if opt == "--regions":
+            N_REGIONS = int(arg)
+        if opt == "--region_workers":
+            REGION_WORKERS = int(arg)
 
     # If model is a list, run each model in different simulation.
     if not RUN:
@@ -141,7 +409,10 @@ if __name__ == "__main__":
 
     # Ensure model is a list (even if only using a single model) 
     # and that all items are strings, which are in MODEL_OPTIONS.
-    if isinstance(MODEL, list) and all(
+    node_models = [RSU_MODEL] + list(CAMERA_MODELS.values())
+    if not all(item in MODEL_OPTIONS + ["yolo", "cnn"] for item in node_models):
+        print("RSU or camera model argument is wrong. See -h for help.")
+    elif isinstance(MODEL, list) and all(
         isinstance(item, str) and item in MODEL_OPTIONS for item in MODEL):
         print(f"Running model(s): {MODEL}")
         for model in MODEL:
@@ -150,8 +421,17 @@ if __name__ == "__main__":
                     f"- model: {model}\n" \
                     f"- environment: {CARLA_ENVIRONMENT}\n" \
                     f"- USE_RSU: {USE_RSU}\n" \
+                    f"- RSU model: {RSU_MODEL}\n" \
                     f"- verbose: {VERBOSE}\n")
-            run_simulation(model, CARLA_ENVIRONMENT, USE_RSU, VERBOSE)
+            run_simulation(model, CARLA_ENVIRONMENT, USE_RSU, VERBOSE,
+                           rsu_model=RSU_MODEL, congestion_backbone=CONGESTION_BACKBONE,
+                           congestion_weights=CONGESTION_WEIGHTS,
+                           camera_models=CAMERA_MODELS, budget_frames=BUDGET_FRAMES,
+                           budget_ms=BUDGET_MS, rois=ROIS, network_links=NETWORK_LINKS,
+                           deadline=DEADLINE, n_processors=N_PROCESSORS,
+                           processor_assignment=PROCESSOR_ASSIGNMENT,
+                           processor_cores=PROCESSOR_CORES, processor_speed=PROCESSOR_SPEED,
+                           n_regions=N_REGIONS, region_workers=REGION_WORKERS)
     else:
         print("MODEL argument is wrong. See -h for help.")
     print("\nDone")
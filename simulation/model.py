@@ -2,8 +2,15 @@
 Class for using pretrained pytorch yolov5
 https://pytorch.org/hub/ultralytics_yolov5/
 """
+import time
+from typing import List, Tuple
 import numpy as np
 import torch
+from pandas import DataFrame
+from data import DataLoader
+from profiler import Profiler
+from scheduler import Scheduler
+from roi import crop_image, offset_detections
 
 # Relevant documentation: https://github.com/ultralytics/yolov5/issues/36
 # Such as running on cpu/cuda with model.cpu() / model.cuda()
@@ -26,3 +33,95 @@ class Model:
 
     def forward(self, image: np.ndarray) -> object:
         return self.model(image)
+
+    def forward_batch(self, images: List[np.ndarray]) -> List[DataFrame]:
+        """
+        Detect objects in several images with a single call. Returns for each
+        image the detections with columns xmin, ymin, xmax, ymax, confidence,
+        class and name.
+        """
+        return self.model(images).pandas().xyxy
+
+
+class ModelGroup:
+    """
+    Group of nodes sharing a yolo model. The first node asking for detections at
+    a simulation step reads the images of all nodes in the group and detects them
+    in a single batch, the other nodes get the cached result. The cost of the
+    batches is tracked to compare the models of different groups.
+    Only the region of interest (see roi.py) of the image of a node in rois is detected.
+    """
+    def __init__(self, name: str, model: Model, dataloader: DataLoader,
+                 node_ids: List[str], profiler: Profiler, scheduler: Scheduler = None,
+                 rois: dict = None):
+        self.name = name
+        self.model = model
+        self.dataloader = dataloader
+        self.node_ids = node_ids
+        self.profiler = profiler
+        self.scheduler = scheduler
+        self.rois = rois or {}
+        self.simulation_step = None
+        self.results = {}
+        self.n_batches = 0
+        self.n_images = 0
+        self.seconds = 0.0
+
+    def get_active_node_ids(self, simulation_step: int) -> List[str]:
+        """
+        Nodes of the group running inference at the step, see Scheduler.
+        """
+        if self.scheduler is None:
+            return self.node_ids
+        return [node_id for node_id in self.node_ids
+                if self.scheduler.is_scheduled(node_id, simulation_step)]
+
+    def forward_batch(self, simulation_step: int) -> dict:
+        """
+        Returns the detections and image shape of each active node at the step.
+        """
+        node_ids = self.get_active_node_ids(simulation_step)
+        images = []
+        crops = []
+        for node_id in node_ids:
+            with self.profiler.measure("dataloader.read_images", node_id):
+                images.append(self.dataloader.read_images(node_id, simulation_step))
+            crops.append(crop_image(images[-1], self.rois.get(node_id)))
+        start = time.perf_counter()
+        detections = self.model.forward_batch([crop for crop, _, _ in crops])
+        duration = time.perf_counter() - start
+        # Move the detections of the crops to the coordinates of the full images.
+        detections = [offset_detections(detections[i], x_offset, y_offset)
+                      for i, (_, x_offset, y_offset) in enumerate(crops)]
+        self.profiler.record(f"model_group.{self.name}", duration)
+        # Each node of the batch is charged an equal share of the inference.
+        for node_id in node_ids:
+            self.profiler.record("model.forward", duration / len(node_ids), node_id)
+        self.n_batches += 1
+        self.n_images += len(images)
+        self.seconds += duration
+        return {node_id: (detections[i], images[i].shape)
+                for i, node_id in enumerate(node_ids)}
+
+    def forward(self, node_id: str, simulation_step: int) -> Tuple[DataFrame, tuple]:
+        """
+        Returns the detections and image shape of the node at the step.
+        The batch is run for the first node asking at the step.
+        """
+        if simulation_step != self.simulation_step:
+            self.results = self.forward_batch(simulation_step)
+            self.simulation_step = simulation_step
+        return self.results[node_id]
+
+    def get_cost(self) -> dict:
+        """
+        Summary of the inference cost of the group.
+        """
+        return {
+            "model": self.name,
+            "nodes": len(self.node_ids),
+            "batches": self.n_batches,
+            "images": self.n_images,
+            "total_s": self.seconds,
+            "ms_per_image": 1000 * self.seconds / max(self.n_images, 1)
+        }
@@ -0,0 +1,163 @@
+"""
+Simulated V2X network between the nodes and the processor. Instead of writing
+their output directly to the data pipe, nodes send it over a link, which has a
+bandwidth, a latency and packet loss. The processor fuses the latest output of
+each node that has arrived by the time it processes the tick.
+"""
+import json
+from collections import defaultdict
+import numpy as np
+import simpy
+from data_models.output_summary import OutputSummary
+from profiler import Profiler
+
+# Link settings of each node type. Latency is latency_ms plus a random part
+# from the distribution (exponential, normal or constant) with scale jitter_ms.
+# Vehicles use a cellular link, RSUs a wired connection.
+DEFAULT_LINKS = {
+    "vehicle": {"latency_ms": 20, "jitter_ms": 10, "distribution": "exponential",
+                "bandwidth_mbps": 10, "loss": 0.01},
+    "rsu": {"latency_ms": 2, "jitter_ms": 1, "distribution": "exponential",
+            "bandwidth_mbps": 100, "loss": 0.0}
+}
+
+
+def parse_link(text: str) -> dict:
+    """
+    Parse link settings from "key=value,key=value", e.g. "latency_ms=30,loss=0.05".
+    """
+    link = {}
+    for item in text.split(','):
+        key, value = item.split('=')
+        link[key] = value if key == "distribution" else float(value)
+    return link
+
+
+class Link():
+    """
+    Link of a single node. Messages are transmitted one at a time in the order
+    they were sent, so a large message delays the following ones.
+    """
+    def __init__(self, env: simpy.Environment, network: object, settings: dict):
+        self.env = env
+        self.network = network
+        self.settings = settings
+        self.queue = simpy.Store(env)
+        env.process(self.run())
+
+    def get_latency(self) -> float:
+        """
+        Random propagation latency in ticks.
+        """
+        jitter = self.settings['jitter_ms']
+        distribution = self.settings['distribution']
+        if distribution == "exponential":
+            random_part = self.network.rng.exponential(jitter) if jitter > 0 else 0.0
+        elif distribution == "normal":
+            random_part = max(self.network.rng.normal(0, jitter), -self.settings['latency_ms'])
+        else:
+            random_part = 0.0
+        return self.network.ms_to_ticks(self.settings['latency_ms'] + random_part)
+
+    def run(self):
+        while True:
+            output, size = yield self.queue.get()
+            # Transmission time of the message with the bandwidth of the link.
+            seconds = size * 8 / (self.settings['bandwidth_mbps'] * 1e6)
+            yield self.env.timeout(self.network.ms_to_ticks(seconds * 1000))
+            self.env.process(self.network.deliver(output, self.get_latency()))
+
+
+class Network():
+    """
+    Network of links from the nodes to the processor, which delivers the
+    output of the nodes to the data pipe. Tracks the end-to-end latency
+    from capturing the camera image to the arrival at the processor.
+    """
+    def __init__(self, env: simpy.Environment, data_pipe: dict, fps: float,
+                 links: dict = None, seed: int = 0):
+        self.env = env
+        self.data_pipe = data_pipe
+        self.fps = fps
+        links = links or {}
+        self.link_settings = {node_type: {**settings, **links.get(node_type, {})}
+                              for node_type, settings in DEFAULT_LINKS.items()}
+        self.rng = np.random.default_rng(seed)
+        self.links = {}
+        # node type -> list of latencies in seconds
+        self.latencies = defaultdict(list)
+        self.sent = defaultdict(int)
+        self.lost = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    def ms_to_ticks(self, milliseconds: float) -> float:
+        return milliseconds / 1000 * self.fps
+
+    @staticmethod
+    def get_node_type(output: OutputSummary) -> str:
+        return "rsu" if output.is_rsu else "vehicle"
+
+    @staticmethod
+    def get_message_size(output: OutputSummary) -> int:
+        """
+        Size in bytes of the output serialized as compact json. OutputSummary.to_json
+        is indented for files, which would overstate the size of the message.
+        """
+        message = json.dumps(output, default=lambda o: o.__dict__, separators=(",", ":"))
+        return len(message.encode("UTF-8"))
+
+    def send(self, output: OutputSummary):
+        """
+        Send the output of a node to the processor.
+        """
+        node_type = self.get_node_type(output)
+        if output.node_id not in self.links:
+            self.links[output.node_id] = Link(self.env, self, self.link_settings[node_type])
+        size = self.get_message_size(output)
+        self.sent[node_type] += 1
+        self.bytes[node_type] += size
+        if self.rng.random() < self.link_settings[node_type]['loss']:
+            self.lost[node_type] += 1
+            return
+        self.links[output.node_id].queue.put((output, size))
+
+    def deliver(self, output: OutputSummary, latency: float):
+        yield self.env.timeout(latency)
+        latency = (self.env.now - output.timestep) / self.fps
+        self.latencies[self.get_node_type(output)].append(latency)
+        # Messages may arrive out of order, an older output does not replace a newer one.
+        previous = self.data_pipe.get(output.node_id)
+        if previous is None or previous.timestep <= output.timestep:
+            self.data_pipe[output.node_id] = output
+
+    def report(self) -> dict:
+        """
+        Amount of sent and lost messages, the sent bytes and the end-to-end
+        latency distribution (milliseconds) of each node type.
+        """
+        report = {}
+        for node_type, settings in self.link_settings.items():
+            latencies = self.latencies[node_type]
+            report[node_type] = {
+                "link": settings,
+                "sent": self.sent[node_type],
+                "lost": self.lost[node_type],
+                "delivered": len(latencies),
+                "bytes_per_message": self.bytes[node_type] / max(self.sent[node_type], 1)
+            }
+            if latencies:
+                report[node_type]["latency"] = Profiler.summarize(latencies)
+                report[node_type]["histogram"] = Profiler.histogram(latencies)
+        return report
+
+    def print_summary(self):
+        report = self.report()
+        print(f"{'node type':<10}{'sent':>7}{'lost':>6}{'bytes':>8}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for node_type, data in report.items():
+            if data['delivered'] == 0:
+                continue
+            latency = data['latency']
+            print(f"{node_type:<10}{data['sent']:>7}{data['lost']:>6}"
+                  f"{data['bytes_per_message']:>8.0f}{latency['p50_ms']:>9.1f}"
+                  f"{latency['p95_ms']:>9.1f}{latency['p99_ms']:>9.1f}")
@@ -1,10 +1,13 @@
 from typing import List
-from typing import Tuple
-from model import Model
+from pandas import DataFrame
+from model import ModelGroup
+from congestion_model import CongestionModel
 from data_models.output_summary import OutputSummary, DetectionData
 from data_models.agent_state import EntityState
 from data import DataLoader
-from numpy import ndarray
+from profiler import Profiler
+from scheduler import Scheduler
+from network import Network
 
 
 class Node():
@@ -14,31 +17,53 @@ class Node():
     The processed data will be then delivered to an external processing entity.
     """
     def __init__(self, env: object, node_id: str, dataloader: DataLoader,
-                model: Model, data_pipe: dict, result_storage_pipe: dict):
+                model: ModelGroup, data_pipe: dict, result_storage_pipe: dict,
+                profiler: Profiler, scheduler: Scheduler = None,
+                network: Network = None):
         self.env: object = env
         self.node_id: str = node_id
         self.dataloader: DataLoader = dataloader
-        self.model: Model = model
+        self.model: ModelGroup = model
         self.data_pipe = data_pipe
         self.result_storage_pipe = result_storage_pipe
+        self.profiler = profiler
+        self.scheduler = scheduler
+        self.network = network
 
-    def read_data(self) -> Tuple[EntityState, ndarray] :
+    def send(self, output: OutputSummary):
         """
-        Read data for current node at simulation tick
+        "Communicate" the output to the processor by storing it in the data_pipe,
+        or by sending it over the simulated network, which delivers it later.
         """
-        agent_state = self.dataloader.read_entity_state(self.node_id, self.env.now)
-        camera_image = self.dataloader.read_images(self.node_id, self.env.now)
-        return agent_state, camera_image
+        if self.network is not None:
+            self.network.send(output)
+        else:
+            self.data_pipe[self.node_id] = output
 
-    def summarize_output(self, raw_output: object,
+    def is_skipped(self) -> bool:
+        """
+        True if the scheduler does not run the node at the current tick. The
+        previous output of the node stays in the data_pipe and is reused.
+        """
+        return (self.scheduler is not None and
+                not self.scheduler.is_scheduled(self.node_id, self.env.now))
+
+    def read_state(self) -> EntityState:
+        """
+        Read state for current node at simulation tick. The camera image
+        is read by the model group, which detects the images of its nodes in a batch.
+        """
+        with self.profiler.measure("dataloader.read_entity_state", self.node_id):
+            agent_state = self.dataloader.read_entity_state(self.node_id, self.env.now)
+        return agent_state
+
+    def summarize_output(self, pandas_yolo_results: DataFrame,
                          im_shape, state: EntityState) -> OutputSummary:
         """
-        Convert raw model results into OutputSummary data class.
+        Convert model results into OutputSummary data class.
         Only accept results with class car or person.
         """
-        # Remove the .pandas() to get the data as a tensor. Might boost performance
         # Pandas offers columns xmin, ymin, xmax, ymax, confidence, class, name
-        pandas_yolo_results = raw_output.pandas().xyxy[0]
 
         # Convert yolo detections to OutputSummary
         # and exclude results for classes other than car and human.
@@ -85,13 +110,58 @@ class Node():
         camera is processed and sent to a centralized computer.
         """
         while True:
-            state, image = self.read_data()
-            raw_output = self.model.forward(image)
-            output = self.summarize_output(raw_output, image.shape, state)
+            if self.is_skipped():
+                yield self.env.timeout(1)
+                continue
+            state = self.read_state()
+            # The model group records the share of the batch of each node as model.forward.
+            yolo_results, im_shape = self.model.forward(self.node_id, self.env.now)
+            with self.profiler.measure("node.summarize_output", self.node_id):
+                output = self.summarize_output(yolo_results, im_shape, state)
             # Store the yolo bounding boxes. This is only needed for visualization purposes.
             self.result_storage_pipe['yolo_images'].extend(output.detections)
-            # "Communicate" the output to the processir by storing it in the data_pipe.
-            self.data_pipe[self.node_id] = output
+            self.send(output)
             # Progress the simulation for this node by 1 unit.
             yield self.env.timeout(1)
-            
\ No newline at end of file
+            
+
+class CongestionNode(Node):
+    """
+    Node for RSUs, which classifies the congestion of its intersection from the
+    camera image with the CongestionDetector instead of detecting objects with yolo.
+    The output has no detections, only the congested probability.
+    """
+    def __init__(self, env: object, node_id: str, dataloader: DataLoader,
+                model: CongestionModel, data_pipe: dict, result_storage_pipe: dict,
+                profiler: Profiler, scheduler: Scheduler = None,
+                network: Network = None):
+        super().__init__(env, node_id, dataloader, model, data_pipe,
+                         result_storage_pipe, profiler, scheduler, network)
+        self.model: CongestionModel = model
+
+    def run(self):
+        """
+        Generator for RSU nodes where at each simulation tick the camera image
+        is classified and the probability sent to a centralized computer.
+        """
+        while True:
+            if self.is_skipped():
+                yield self.env.timeout(1)
+                continue
+            state = self.read_state()
+            # The model reads the images of all RSUs and classifies them in one batch.
+            # It records the share of the batch of each node as congestion_model.forward.
+            congestion = self.model.forward(self.node_id, self.env.now)
+            output = OutputSummary(
+                node_id=self.node_id,
+                is_rsu=state.is_rsu,
+                agent_x=state.x,
+                agent_y=state.y,
+                direction=state.direction,
+                velocity=state.velocity,
+                detections=[],
+                timestep=self.env.now,
+                congestion=congestion
+            )
+            self.send(output)
+            yield self.env.timeout(1)
@@ -1,8 +1,13 @@
 import math
+import time
+from collections import defaultdict
 from typing import List, Tuple, Union
+import simpy
 from data_models.output_summary import OutputSummary, DetectionData
 from data_models.agent_state import DetectedEntityState
 from data_models.world import IntersectionStatus, World, Intersection
+from profiler import Profiler
+from service_time import ServiceTimeModel
 import numpy as np
 
 
@@ -12,13 +17,42 @@ class Processor():
     Each processor is responsible for processing the data of multiple vehicles and 
     RSUs. The processor will create the '3D world' and then analyze it, creating 
     the final object that will contain all data and analysis results for visualizing.
+
+    By default processing takes no simulated time. With cores, the processor is a
+    simpy Resource with the amount of cores, where each tick is a job queueing for
+    a core for a service time given by the ServiceTimeModel.
     """
     def __init__(self, env, data_pipe: dict, 
-                 result_storage_pipe: list, dataloader):
+                 result_storage_pipe: list, dataloader, profiler: Profiler,
+                 deadline: float = 0, processor_id: str = "processor_0",
+                 node_ids: List[str] = None, cores: int = None, speed: float = 1.0,
+                 intersection_ids: List[str] = None, merger: 'StatusMerger' = None):
         self.env = env
         self.data_pipe = data_pipe
         self.result_storage_pipe = result_storage_pipe
         self.dataloader = dataloader
+        self.profiler = profiler
+        # Ticks after the start of a tick, when the data which has arrived is processed.
+        self.deadline = deadline
+        self.processor_id = processor_id
+        # Nodes assigned to the processor, all if None.
+        self.node_ids = None if node_ids is None else set(node_ids)
+        # Intersections analyzed by the processor, all if None. See regions.py.
+        self.intersection_ids = None if intersection_ids is None else set(intersection_ids)
+        # Merges the results with those of the other processors, if the nodes are split.
+        self.merger = merger
+        # Outputs of the nodes and the tick being processed.
+        self.data = {}
+        self.timestep = 0
+
+        self.cores = cores
+        self.resource = simpy.Resource(env, cores) if cores is not None else None
+        self.service_time_model = ServiceTimeModel(speed)
+        self.fps = dataloader.get_metadata_summary()['fps']
+        self.queue_lengths = []
+        self.wait_times = [] # seconds
+        self.staleness = [] # seconds from the start of a tick to its processed result
+        self.busy_time = 0 # ticks
 
         image_width, image_height = dataloader.get_image_dimensions()
         self.image_width = image_width
@@ -34,8 +68,27 @@ class Processor():
         self.congestion_pedestrian_treshold = 0.3 # Min amount of pedestrians for intersection to be congested.
         # meters, how far away from intersection to be counted as part of intersection
         self.threshold_within_intersection_range = 50 # meters
+        # Weight of the CongestionDetector probability of RSUs when fusing it with the
+        # vehicle based status. With 0.7, a congested vehicle based status needs a
+        # probability of at least 0.29 and a low status a probability of at least 0.71.
+        self.congestion_classifier_weight = 0.7
         
 
+    def get_timestep(self) -> int:
+        """
+        The tick being processed. With queueing it may have started several ticks ago.
+        """
+        return self.timestep
+
+    def get_data(self) -> dict:
+        """
+        Snapshot of the latest outputs of the nodes assigned to the processor.
+        """
+        if self.node_ids is None:
+            return dict(self.data_pipe)
+        return {node_id: output for node_id, output in self.data_pipe.items()
+                if node_id in self.node_ids}
+
     def get_distance(self, agent: Union[OutputSummary, Tuple], target: Tuple[int, int]) -> float:
         """
         Calculate distance between agent and a target point (usually detection).
@@ -116,18 +169,31 @@ class Processor():
             processed_detections.append(detection_result)
         return processed_detections
 
+    def get_detection_position(self, state: OutputSummary,
+                               detection: DetectedEntityState) -> Tuple[float, float]:
+        """
+        Position of a processed detection in the world, from the distance
+        and the angle relative to the direction of the node.
+        """
+        # CARLA seems to handle direction according to unit circle.
+        # Therefore x=cos(angle), y=sin(angle)
+        target_angle = state.direction + detection.width_offset
+        target_x = state.agent_x + (detection.distance * np.cos(np.deg2rad(target_angle)))
+        target_y = state.agent_y + (detection.distance * np.sin(np.deg2rad(target_angle)))
+        return target_x, target_y
+
     def is_detection_another_agent(self, processed_agents, current_agent_name, 
                                    target_position, target_type):
         """
         See if detection matches an agent or earlier detection during this timestep.
-        If two are close enough, assume same detection.
+        If two are close enough, assume same detection. Returns True if a match is found.
         """
         # Loop through detections, see if match found
         for agent in processed_agents['agents']:
             # Only process detected agents, as agents from data
             # are always "real" and have not been detected multiple times.
             if not agent['detected']:
-                return False
+                continue
 
             # Assume car does not detect itself.
             if agent['id'] == current_agent_name:
@@ -144,8 +210,8 @@ class Processor():
             if distance <= threshold:
                 # Types are also same, assume object already detected.
                 if agent['type'] == target_type:
-                    return False
-        return True
+                    return True
+        return False
     
     def is_collision_warning(self, agent_state: OutputSummary, 
                     target: Tuple[float, float]) -> Tuple[float, float]:
@@ -183,7 +249,7 @@ class Processor():
         processed_agents = {'agents': []}
         # Detections is a dict of agents with value list of detections.
         for agent_name in detections:
-            state: OutputSummary = self.data_pipe[agent_name]
+            state: OutputSummary = self.data[agent_name]
             node_direction = state.direction
             intersection = self.get_closest_intersection(state)
             
@@ -194,13 +260,7 @@ class Processor():
                 #detected_agent_offset = detection.offset
 
                 # Calculate new agent position based on distance and width offset.
-                # CARLA seems to handle direction according to unit circle.
-                # Therefore x=cos(angle), y=sin(angle)
-                target_angle = node_direction + detection.width_offset
-                target_x = state.agent_x + (detection.distance *
-                                            np.cos(np.deg2rad(target_angle)))
-                target_y = state.agent_y + (detection.distance *
-                                            np.sin(np.deg2rad(target_angle)))
+                target_x, target_y = self.get_detection_position(state, detection)
         
                 distance_to_agent, crashing = self.is_collision_warning(state, (target_x, target_y))
 
@@ -225,7 +285,7 @@ class Processor():
                     'velocity': 0,
                     'detected': True, # Agent is detected. Properties not known.
                     'matches': matches_agent, # Does the detection match actual agent
-                    'timestep': self.env.now
+                    'timestep': self.get_timestep()
                 })
 
                 # Then add the original agent too.
@@ -243,26 +303,45 @@ class Processor():
                     'velocity': state.velocity,
                     'detected': False, # Is the agent detected or "known" from data.
                     'matches': False,
-                    'timestep': self.env.now
+                    'timestep': self.get_timestep()
                 })
         return processed_agents
 
+    def get_classifier_probabilities(self) -> dict:
+        """
+        Returns for each intersection the congested probabilities of the nodes
+        classifying their images with the CongestionDetector (see CongestionNode).
+        """
+        probabilities = {}
+        for state in self.data.values():
+            if state.congestion is None:
+                continue
+            intersection = self.get_closest_intersection(state)
+            if intersection is not None:
+                probabilities.setdefault(intersection['id'], []).append(state.congestion)
+        return probabilities
+
     def get_intersection_statuses(self, world: World, original_agent_count: int) -> List[IntersectionStatus]:
         """
         Analyze intersection and get intersection status data object.
+        If RSUs classify the intersection with the CongestionDetector, the
+        probability is fused with the status based on the vehicles.
         """
         statuses: List[IntersectionStatus] = []
 
         # Initialize the dict with all intersections.
         intersections = self.dataloader.get_intersections()
         for intersection in intersections:
+            if self.intersection_ids is not None and intersection['id'] not in self.intersection_ids:
+                continue
             intersection_stats = {
                 'id': intersection['id'],
                 'car_count': 0,
                 'human_count': 0,
                 'speeds': [], # in m/s
                 'status': "low",
-                "timestep": self.env.now
+                "timestep": self.get_timestep(),
+                "processor": self.processor_id
             }
 
             # Loop each agent in the scene (cars, RSUs...). Note agents also
@@ -293,66 +372,229 @@ class Processor():
                     intersection_stats['human_count'] = human_count
 
 
-            # Revise intersection status now that entities have been counted.
-
-            # Normalize detections due to inaccuracy.
-            intersection_stats['car_count_norm'] = car_count_norm = intersection_stats['car_count'] / original_agent_count
-            intersection_stats['human_count_norm'] = pedestrian_count_norm = (intersection_stats['human_count'] /
-                                                                         original_agent_count) # Normalize detections due to inaccuracy
-            # If car count is 0, the intersection status does not need to be updated.
-            if intersection_stats['car_count'] != 0:
-                # Calculate average speed and convert m/s to km/h
-                average_speed = (sum(intersection_stats['speeds']) /
-                                 len(intersection_stats['speeds'])) * 3.6
-                # Congestion is low by default. See if condition for high met.
-                if average_speed < self.threshold_congestigation_speed:
-                    # ALSO account for amount of vehicles and pedestrians. If there are two
-                    # slow cars in the intersection, it doesn't mean it is congested.
-                    # If total of entities in intersection is more than thresholds summed, congested.
-                    total_norm = car_count_norm + pedestrian_count_norm
-                    threshold = self.congestion_car_threshold + self.congestion_pedestrian_treshold
-                    if total_norm > threshold:
-                        intersection_stats['status'] = "congested"
-
+            self.evaluate_intersection(intersection_stats, original_agent_count,
+                                       world['classifier_probabilities'].get(intersection['id'], []))
             statuses.append(intersection_stats)
         return statuses
 
+    def evaluate_intersection(self, intersection_stats: dict, original_agent_count: int,
+                              probabilities: List[float]):
+        """
+        Revise intersection status now that entities have been counted.
+        """
+        # Normalize detections due to inaccuracy.
+        intersection_stats['car_count_norm'] = car_count_norm = intersection_stats['car_count'] / original_agent_count
+        intersection_stats['human_count_norm'] = pedestrian_count_norm = (intersection_stats['human_count'] /
+                                                                     original_agent_count) # Normalize detections due to inaccuracy
+        # If car count is 0, the intersection status does not need to be updated.
+        if intersection_stats['car_count'] != 0:
+            # Calculate average speed and convert m/s to km/h
+            average_speed = (sum(intersection_stats['speeds']) /
+                             len(intersection_stats['speeds'])) * 3.6
+            # Congestion is low by default. See if condition for high met.
+            if average_speed < self.threshold_congestigation_speed:
+                # ALSO account for amount of vehicles and pedestrians. If there are two
+                # slow cars in the intersection, it doesn't mean it is congested.
+                # If total of entities in intersection is more than thresholds summed, congested.
+                total_norm = car_count_norm + pedestrian_count_norm
+                threshold = self.congestion_car_threshold + self.congestion_pedestrian_treshold
+                if total_norm > threshold:
+                    intersection_stats['status'] = "congested"
+
+        probability = float(np.mean(probabilities)) if probabilities else None
+        intersection_stats['congestion_probability'] = probability
+        if probability is not None:
+            vehicle_score = 1.0 if intersection_stats['status'] == "congested" else 0.0
+            weight = self.congestion_classifier_weight
+            score = weight * probability + (1 - weight) * vehicle_score
+            intersection_stats['status'] = "congested" if score >= 0.5 else "low"
+
+    def merge_intersection_statuses(self, worlds: List[World],
+                                    original_agent_count: int) -> List[IntersectionStatus]:
+        """
+        Merge the intersection statuses of the same tick of processors having
+        a part of the nodes each. The counts and speeds are summed and the
+        status is evaluated again, so there is one status per intersection.
+        """
+        merged = []
+        for statuses in zip(*[world['intersection_statuses'] for world in worlds]):
+            intersection_stats = {
+                'id': statuses[0]['id'],
+                'car_count': sum(status['car_count'] for status in statuses),
+                'human_count': sum(status['human_count'] for status in statuses),
+                'speeds': [speed for status in statuses for speed in status['speeds']],
+                'status': "low",
+                "timestep": statuses[0]['timestep'],
+                "processor": ",".join(sorted(status['processor'] for status in statuses))
+            }
+            probabilities = [probability for world in worlds for probability in
+                             world['classifier_probabilities'].get(intersection_stats['id'], [])]
+            self.evaluate_intersection(intersection_stats, original_agent_count, probabilities)
+            merged.append(intersection_stats)
+        return merged
+
     def analyze(self, world: World, original_agent_count: int):
         """
         Perform analysis on the processed "world"
         """
+        world['classifier_probabilities'] = self.get_classifier_probabilities()
         world['intersection_statuses'] = self.get_intersection_statuses(world, original_agent_count)
         return world
 
-    def run(self):
+    @staticmethod
+    def get_record_node(record: dict) -> str:
         """
-        Dictionary to hold new detected 'agents' for each actual node.
-        Dictionary key corresponds to node that detected the agent.
+        Node of an agent record, detection ids are "<node id>-<detection id>".
         """
-        processed_detections = {}
-        while True:
-            # Convert all yolo detections to DetectedAgent. These are used 
-            # later to find possible new detected vehicles and convert them 
-            # into "agents".
-            original_agent_count = len(self.data_pipe)
-            for agent in self.data_pipe:
-                results = self.process_detections(self.data_pipe[agent])
-                processed_detections[agent] = results
+        if record['detected']:
+            return record['id'].rsplit('-', 1)[0]
+        return record['id']
 
-            # Processed_agents contains all agents and detections processed.
-            # This is essentially the "3D" world. This object is what will be
-            # used for final analysis and processing.
+    def process_world(self, data: dict, timestep: int, owned_node_ids: set = None,
+                      original_agent_count: int = None) -> Tuple[World, int]:
+        """
+        Process the outputs of the nodes at a tick. Returns the analyzed world and
+        the amount of processed detections. If owned_node_ids is given, the other
+        nodes are only used for finding duplicate detections and their records
+        are left out of the world.
+        """
+        self.data = data
+        self.timestep = timestep
+        # Convert all yolo detections to DetectedAgent. These are used 
+        # later to find possible new detected vehicles and convert them 
+        # into "agents".
+        # Dictionary to hold new detected 'agents' for each actual node.
+        # Dictionary key corresponds to node that detected the agent.
+        processed_detections = {}
+        if original_agent_count is None:
+            original_agent_count = len(data)
+        for agent in data:
+            with self.profiler.measure("processor.process_detections", agent):
+                results = self.process_detections(data[agent])
+            processed_detections[agent] = results
+
+        # Processed_agents contains all agents and detections processed.
+        # This is essentially the "3D" world. This object is what will be
+        # used for final analysis and processing.
+        with self.profiler.measure("processor.process_all"):
             processed_agents = self.process_all(processed_detections)
+        if owned_node_ids is not None:
+            processed_agents['agents'] = [
+                record for record in processed_agents['agents']
+                if self.get_record_node(record) in owned_node_ids]
 
-            # Most of the actual analysis happens here to understand the 3D world
+        # Most of the actual analysis happens here to understand the 3D world
+        with self.profiler.measure("processor.analyze"):
             world: World = self.analyze(processed_agents, original_agent_count)
+        n_detections = sum(len(detections) for detections in processed_detections.values())
+        return world, n_detections
+
+    def store_results(self, world: World, timestep: int, original_agent_count: int):
+        """
+        Store the results, which will be saved under results/results.json
+        """
+        if self.merger is not None:
+            self.merger.add(self, world, timestep, original_agent_count)
+            return
+        self.result_storage_pipe['processing_results'][
+            'agents'].extend(world['agents'])
+        self.result_storage_pipe['processing_results'][
+            'intersection_statuses'].extend(world['intersection_statuses'])
+
+    def process_tick(self, data: dict, timestep: int, original_agent_count: int) -> int:
+        """
+        Process the outputs of the nodes at a tick and store the results.
+        Returns the amount of processed detections.
+        """
+        world, n_detections = self.process_world(data, timestep,
+                                                 original_agent_count=original_agent_count)
+        self.store_results(world, timestep, original_agent_count)
+        return n_detections
+
+    def serve(self, data: dict, timestep: int, original_agent_count: int):
+        """
+        Job processing a tick, which waits for a free core and holds it
+        for the service time of the amount of detections. The results are
+        stored when the service time has passed.
+        """
+        arrival = self.env.now
+        self.queue_lengths.append(len(self.resource.queue))
+        with self.resource.request() as request:
+            yield request
+            self.wait_times.append((self.env.now - arrival) / self.fps)
+            start = time.perf_counter()
+            world, n_detections = self.process_world(data, timestep,
+                                                     original_agent_count=original_agent_count)
+            self.service_time_model.add_sample(n_detections, time.perf_counter() - start)
+            service_time = self.service_time_model.predict(n_detections) * self.fps
+            yield self.env.timeout(service_time)
+            self.busy_time += service_time
+        self.store_results(world, timestep, original_agent_count)
+        self.staleness.append((self.env.now - timestep) / self.fps)
 
-            # Store the results, which will be saved under results/results.json
-            self.result_storage_pipe['processing_results'][
-                'agents'].extend(world['agents'])
-            self.result_storage_pipe['processing_results'][
-                'intersection_statuses'].extend(world['intersection_statuses'])
+    def run(self):
+        """
+        Process the data of the nodes at each tick, after the deadline.
+        """
+        # Wait for the data sent during the tick, see network.py.
+        if self.deadline > 0:
+            yield self.env.timeout(self.deadline)
+        while True:
+            timestep = int(self.env.now)
+            # The counts are normalized with the agents of the whole town, also
+            # when the processor only has a part of the nodes.
+            original_agent_count = len(self.data_pipe)
+            if self.resource is None:
+                self.process_tick(self.get_data(), timestep, original_agent_count)
+            else:
+                self.env.process(self.serve(self.get_data(), timestep, original_agent_count))
 
             # Process the simulation by one step for this processor.
             yield self.env.timeout(1)
-        
\ No newline at end of file
+
+    def report(self) -> dict:
+        """
+        Queue length, utilization of the cores, waiting time and staleness
+        of the results (time from the start of a tick to its result).
+        """
+        elapsed = max(self.env.now - self.deadline, 1e-9)
+        report = {
+            "nodes": None if self.node_ids is None else sorted(self.node_ids),
+            "cores": self.cores,
+            "service_time_model": self.service_time_model.to_dict(),
+            "processed_ticks": len(self.staleness),
+            "queued_ticks": len(self.resource.queue) if self.resource is not None else 0,
+            "mean_queue_length": float(np.mean(self.queue_lengths)) if self.queue_lengths else 0.0,
+            "max_queue_length": int(np.max(self.queue_lengths)) if self.queue_lengths else 0,
+            "utilization": self.busy_time / (elapsed * self.cores) if self.cores else None
+        }
+        if self.wait_times:
+            report["wait"] = Profiler.summarize(self.wait_times)
+        if self.staleness:
+            report["staleness"] = Profiler.summarize(self.staleness)
+        return report
+
+
+class StatusMerger():
+    """
+    Collects the results of the processors when the nodes are split between them.
+    When all processors have processed a tick, its intersection statuses are merged
+    into one status per intersection and stored with the agents of the tick.
+    """
+    def __init__(self, result_storage_pipe: dict, n_processors: int):
+        self.result_storage_pipe = result_storage_pipe
+        self.n_processors = n_processors
+        # timestep -> worlds of the processors which have processed the tick
+        self.pending = defaultdict(list)
+
+    def add(self, processor: Processor, world: World, timestep: int, original_agent_count: int):
+        worlds = self.pending[timestep]
+        worlds.append(world)
+        if len(worlds) < self.n_processors:
+            return
+        del self.pending[timestep]
+        results = self.result_storage_pipe['processing_results']
+        for processor_world in worlds:
+            results['agents'].extend(processor_world['agents'])
+        results['intersection_statuses'].extend(
+            processor.merge_intersection_statuses(worlds, original_agent_count))
@@ -0,0 +1,227 @@
+"""
+Load harness for the Processor. The data_pipe is filled with generated
+OutputSummary streams instead of node outputs, so the cost of the processor
+can be measured at large agent counts without running the model.
+"""
+import os
+import sys
+import json
+import time
+import getopt
+import tracemalloc
+import numpy as np
+import simpy
+from data import DataLoader
+from processor import Processor
+from profiler import Profiler
+from data_models.output_summary import OutputSummary, DetectionData
+from utils.synthetic import generate_run
+
+
+class OutputStreamGenerator():
+    """
+    Generates OutputSummary objects for a large amount of agents. Agents are
+    clustered around the intersections, as in the real runs most agents
+    (and their detections) are near intersections.
+    """
+    def __init__(self, intersections: list, n_agents: int, detections_per_agent: float,
+                 image_width: int, image_height: int, rsu_share: float = 0.05,
+                 cluster_share: float = 0.8, cluster_radius: float = 40, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.n_agents = n_agents
+        self.detections_per_agent = detections_per_agent
+        self.image_width = image_width
+        self.image_height = image_height
+
+        centers = np.array([(i['location']['x'], i['location']['y'])
+                            for i in intersections])
+        low, high = centers.min(axis=0) - 100, centers.max(axis=0) + 100
+        # A share of the agents are near a random intersection, the rest anywhere.
+        clustered = self.rng.random(n_agents) < cluster_share
+        positions = self.rng.uniform(low, high, size=(n_agents, 2))
+        picked = centers[self.rng.integers(len(centers), size=n_agents)]
+        positions[clustered] = picked[clustered] + self.rng.normal(
+            0, cluster_radius, size=(clustered.sum(), 2))
+        self.positions = positions
+        self.directions = self.rng.uniform(-180, 180, n_agents)
+        self.velocities = self.rng.uniform(0, 14, n_agents)
+        self.is_rsu = self.rng.random(n_agents) < rsu_share
+        self.velocities[self.is_rsu] = 0
+        self.node_ids = [f"camera_{i+1}" for i in range(n_agents)]
+
+    def step(self, timestep: int) -> dict:
+        """
+        Move the agents and generate their outputs for a single timestep.
+        """
+        moving = ~self.is_rsu
+        radians = np.deg2rad(self.directions)
+        # One simulation step is one frame, 1/30 seconds.
+        self.positions[moving, 0] += np.cos(radians[moving]) * self.velocities[moving] / 30
+        self.positions[moving, 1] += np.sin(radians[moving]) * self.velocities[moving] / 30
+
+        outputs = {}
+        n_detections = self.rng.poisson(self.detections_per_agent, self.n_agents)
+        for i, node_id in enumerate(self.node_ids):
+            detections = []
+            for j in range(n_detections[i]):
+                detection_type = "person" if self.rng.random() < 0.2 else "car"
+                # Box height defines the distance estimate of the processor.
+                height = self.rng.uniform(10, 300)
+                width = height * (0.4 if detection_type == "person" else 1.4)
+                xmin = self.rng.uniform(0, self.image_width - width)
+                ymin = self.rng.uniform(0, self.image_height - height)
+                detections.append(DetectionData(
+                    parent_id=node_id, detection_id=str(j), type=detection_type,
+                    xmin=xmin, xmax=xmin + width, ymin=ymin, ymax=ymin + height,
+                    timestep=timestep))
+            outputs[node_id] = OutputSummary(
+                node_id=node_id,
+                is_rsu=bool(self.is_rsu[i]),
+                agent_x=float(self.positions[i, 0]),
+                agent_y=float(self.positions[i, 1]),
+                direction=float(self.directions[i]),
+                velocity=float(self.velocities[i]),
+                detections=detections,
+                timestep=timestep
+            )
+        return outputs
+
+
+def feed_data_pipe(env, generator: OutputStreamGenerator, data_pipe: dict):
+    """
+    Simpy process taking the place of the nodes.
+    """
+    while True:
+        data_pipe.update(generator.step(env.now))
+        yield env.timeout(1)
+
+
+def measure_ticks(process, profiler: Profiler):
+    """
+    Wrap the Processor.run generator to time each tick as a whole.
+    """
+    while True:
+        with profiler.measure("processor.tick"):
+            event = next(process)
+        yield event
+
+
+def sample_memory(env, samples: list):
+    while True:
+        current, _ = tracemalloc.get_traced_memory()
+        samples.append((env.now, current))
+        yield env.timeout(1)
+
+
+def run_load(n_agents: int, detections_per_agent: float, n_ticks: int,
+             n_intersections: int, trace_memory: bool) -> dict:
+    # The processor reads the intersections and the image size from a run file.
+    environment = f"processor_load_{n_intersections}_intersections.hdf5"
+    if not os.path.exists(os.path.join("runs", environment)):
+        generate_run(environment, n_vehicles=1, n_rsus=0, n_frames=1,
+                     n_intersections=n_intersections)
+    dataloader = DataLoader(environment)
+    image_width, image_height = dataloader.get_image_dimensions()
+    generator = OutputStreamGenerator(dataloader.get_intersections(), n_agents,
+                                      detections_per_agent, image_width, image_height)
+
+    env = simpy.Environment()
+    profiler = Profiler()
+    data_pipe = {}
+    result_storage_pipe = {
+        'processing_results': {
+            "agents": [],
+            "intersection_statuses": []
+        },
+        'yolo_images': []
+    }
+    # The feeder is added first, so it updates the data_pipe before the processor runs.
+    env.process(feed_data_pipe(env, generator, data_pipe))
+    processor = Processor(env, data_pipe, result_storage_pipe, dataloader, profiler)
+    env.process(measure_ticks(processor.run(), profiler))
+
+    memory_samples = []
+    if trace_memory:
+        tracemalloc.start()
+        env.process(sample_memory(env, memory_samples))
+
+    start = time.perf_counter()
+    env.run(until=n_ticks)
+    wall_seconds = time.perf_counter() - start
+    if trace_memory:
+        tracemalloc.stop()
+
+    report = profiler.report()
+    tick_seconds = report["processor.tick"]['total_ms'] / 1000
+    result = {
+        "agents": n_agents,
+        "detections_per_agent": detections_per_agent,
+        "ticks": n_ticks,
+        "wall_seconds": wall_seconds,
+        "processor_ticks_per_second": n_ticks / tick_seconds,
+        "stages": {stage: {key: data[key] for key in ("count", "total_ms", "p50_ms", "p95_ms")}
+                   for stage, data in report.items()},
+        "stored_agents": len(result_storage_pipe['processing_results']['agents'])
+    }
+    if memory_samples:
+        first, last = memory_samples[0][1], memory_samples[-1][1]
+        result['memory'] = {
+            "start_mb": first / 1e6,
+            "end_mb": last / 1e6,
+            "growth_per_tick_mb": (last - first) / 1e6 / max(len(memory_samples) - 1, 1)
+        }
+    return result
+
+
+def print_help():
+    help_text = "Load harness for the Processor with generated node outputs.\n" \
+        "Usage: python processor_load.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        "\t--agents <list> - Agent counts separated by comma.\n" \
+        "\t--detections <float> - Mean amount of detections per agent.\n" \
+        "\t--ticks <int> - Amount of processor ticks for each agent count.\n" \
+        "\t--intersections <int> - Amount of intersections the agents cluster around.\n" \
+        "\t--trace_memory - Measure memory growth with tracemalloc (slower).\n" \
+        "\n\tExample: python processor_load.py --agents 100,1000,10000 --ticks 5"
+    print(help_text)
+
+
+if __name__ == "__main__":
+    AGENTS = [100, 1000, 10000]
+    DETECTIONS = 3.0
+    TICKS = 5
+    INTERSECTIONS = 4
+    TRACE_MEMORY = False
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["agents=", "detections=", "ticks=",
+                                                   "intersections=", "trace_memory"])
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            sys.exit(0)
+        if opt == "--agents":
+            AGENTS = [int(count) for count in arg.split(',')]
+        if opt == "--detections":
+            DETECTIONS = float(arg)
+        if opt == "--ticks":
+            TICKS = int(arg)
+        if opt == "--intersections":
+            INTERSECTIONS = int(arg)
+        if opt == "--trace_memory":
+            TRACE_MEMORY = True
+
+    results = []
+    for agent_count in AGENTS:
+        print(f"Running processor with {agent_count} agents for {TICKS} ticks")
+        load_result = run_load(agent_count, DETECTIONS, TICKS, INTERSECTIONS, TRACE_MEMORY)
+        print(f"\t{load_result['processor_ticks_per_second']:.3f} ticks/s")
+        if 'memory' in load_result:
+            print(f"\tmemory growth {load_result['memory']['growth_per_tick_mb']:.2f} MB/tick")
+        results.append(load_result)
+
+    folder = "results/benchmarks"
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, f"processor_load-{int(time.time())}.json")
+    with open(path, 'w', encoding="utf-8") as file:
+        json.dump(results, file, indent=1)
+    print(f"Saved results to {path}")
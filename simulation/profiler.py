@@ -0,0 +1,117 @@
+"""
+Lightweight instrumentation for the hot path of the DES simulation.
+Each measured call stores a single float, so the profiler is cheap
+enough to be kept on for every run.
+"""
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
+import numpy as np
+
+
+class Profiler():
+    """
+    Collects per-call latencies for named simulation stages, such as
+    'model.forward' or 'processor.analyze'. Latencies are stored per stage
+    and per node, which allows reporting histograms for both.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # stage -> list of latencies in seconds
+        self.timings = defaultdict(list)
+        # stage -> node id -> list of latencies in seconds
+        self.node_timings = defaultdict(lambda: defaultdict(list))
+
+    @contextmanager
+    def measure(self, stage: str, node_id: Optional[str] = None):
+        """
+        Context manager for timing a block of code.
+        Usage: with profiler.measure("model.forward", node_id): ...
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, node_id)
+
+    def record(self, stage: str, duration: float, node_id: Optional[str] = None):
+        """
+        Store a single latency measurement (seconds) for a stage.
+        """
+        if not self.enabled:
+            return
+        self.timings[stage].append(duration)
+        if node_id is not None:
+            self.node_timings[stage][node_id].append(duration)
+
+    @staticmethod
+    def summarize(durations: list) -> dict:
+        """
+        Summary statistics of latencies. Values are in milliseconds.
+        """
+        values = np.asarray(durations) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            "count": len(values),
+            "total_ms": float(values.sum()),
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(values.max())
+        }
+
+    @staticmethod
+    def histogram(durations: list, bins: int = 20) -> dict:
+        """
+        Latency histogram with logarithmic bins (milliseconds), as stage
+        latencies are usually long tailed.
+        """
+        values = np.asarray(durations) * 1000
+        low, high = max(values.min(), 1e-3), max(values.max(), 1e-3)
+        if low == high:
+            high = low * 10
+        edges = np.geomspace(low, high, bins + 1)
+        counts, edges = np.histogram(np.clip(values, low, high), bins=edges)
+        return {"edges_ms": edges.tolist(), "counts": counts.tolist()}
+
+    def report(self) -> dict:
+        """
+        Build the full report with summaries, histograms and per-node breakdowns.
+        """
+        report = {}
+        for stage, durations in self.timings.items():
+            stage_report = self.summarize(durations)
+            stage_report['histogram'] = self.histogram(durations)
+            nodes = self.node_timings.get(stage, {})
+            stage_report['nodes'] = {
+                node_id: self.summarize(node_durations)
+                for node_id, node_durations in nodes.items()
+            }
+            report[stage] = stage_report
+        return report
+
+    def print_summary(self):
+        """
+        Print a short table of the stages ordered by total time spent.
+        """
+        report = self.report()
+        stages = sorted(report, key=lambda s: report[s]['total_ms'], reverse=True)
+        print(f"{'stage':<32}{'count':>8}{'total s':>10}{'p50 ms':>10}"
+              f"{'p95 ms':>10}{'p99 ms':>10}")
+        for stage in stages:
+            data = report[stage]
+            print(f"{stage:<32}{data['count']:>8}{data['total_ms'] / 1000:>10.2f}"
+                  f"{data['p50_ms']:>10.2f}{data['p95_ms']:>10.2f}{data['p99_ms']:>10.2f}")
+
+    def write(self, path: str):
+        """
+        Write the report as json, usually next to the simulation results.
+        """
+        with open(path, 'w', encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=1)
@@ -0,0 +1,201 @@
+"""
+Sharding of the processing into geographic regions. The intersections of the
+map are clustered into regions and each region has its own Processor, which
+only processes the nodes closest to its intersections. The processors can run
+in separate processes, so the processing cost grows with the local density
+instead of the agent count of the whole town.
+
+Nodes with a detection close to a detection of another region are also handed
+off to it, but only for finding duplicate detections near the border. Their
+records are kept by their own region.
+"""
+import math
+import time
+from multiprocessing import Pool
+from typing import List
+import numpy as np
+import simpy
+from data import DataLoader
+from processor import Processor
+from profiler import Profiler
+
+# Processors of the regions in a worker process, see init_region_worker.
+region_processors = {}
+
+
+def cluster_intersections(intersections: list, n_regions: int, iterations: int = 20) -> List[List[str]]:
+    """
+    Cluster the intersections into at most n_regions regions with k-means.
+    Returns the intersection ids of each region.
+    """
+    locations = np.array([(intersection['location']['x'], intersection['location']['y'])
+                          for intersection in intersections])
+    n_regions = min(n_regions, len(intersections))
+    # Farthest point initialization, which is deterministic.
+    centers = [locations[0]]
+    while len(centers) < n_regions:
+        distances = np.min([np.linalg.norm(locations - center, axis=1) for center in centers], axis=0)
+        centers.append(locations[np.argmax(distances)])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmin(np.linalg.norm(locations[:, None] - centers[None], axis=2), axis=1)
+        centers = np.array([locations[labels == i].mean(axis=0) if np.any(labels == i) else centers[i]
+                            for i in range(n_regions)])
+    return [[intersection['id'] for intersection, label in zip(intersections, labels) if label == i]
+            for i in range(n_regions) if np.any(labels == i)]
+
+
+def init_region_worker(environment: str, regions: List[List[str]]):
+    """
+    Create the processors of the regions in a worker process.
+    """
+    dataloader = DataLoader(environment)
+    env = simpy.Environment()
+    region_processors.clear()
+    for i, intersection_ids in enumerate(regions):
+        region_processors[i] = Processor(env, {}, None, dataloader, Profiler(enabled=False),
+                                         processor_id=f"region_{i}",
+                                         intersection_ids=intersection_ids)
+
+
+def process_region(job: tuple) -> tuple:
+    """
+    Process the outputs of a region at a tick. The job is the region index, the
+    outputs of the owned and handed off nodes, the owned node ids, the tick and
+    the agent count of the whole town. Returns the region index, the world and
+    the processing time in seconds.
+    """
+    region, data, owned_node_ids, timestep, original_agent_count = job
+    start = time.perf_counter()
+    world, _ = region_processors[region].process_world(data, timestep, owned_node_ids,
+                                                       original_agent_count)
+    return region, world, time.perf_counter() - start
+
+
+class RegionCoordinator():
+    """
+    Replaces the single processor of the simulation. At each tick it routes the
+    outputs of the nodes to the regions and collects the processed worlds.
+    """
+    def __init__(self, env, data_pipe: dict, result_storage_pipe: dict, dataloader: DataLoader,
+                 profiler: Profiler, environment: str, n_regions: int, n_workers: int = 0,
+                 deadline: float = 0):
+        self.env = env
+        self.data_pipe = data_pipe
+        self.result_storage_pipe = result_storage_pipe
+        self.dataloader = dataloader
+        self.profiler = profiler
+        self.deadline = deadline
+        # Processor for placing the detections of the nodes in the world.
+        self.processor = Processor(env, {}, None, dataloader, Profiler(enabled=False))
+        # Meters, detections are only matched as duplicates within this distance, so a
+        # node with a detection this close to a detection of a region is handed off to it.
+        self.handoff_range = max(self.processor.threshold_detection_radius_car,
+                                 self.processor.threshold_detection_radius_person)
+        self.intersections = dataloader.get_intersections()
+        self.regions = cluster_intersections(self.intersections, n_regions)
+        self.intersection_regions = {intersection_id: i for i, region in enumerate(self.regions)
+                                     for intersection_id in region}
+        self.pool = None
+        if n_workers > 0:
+            self.pool = Pool(n_workers, initializer=init_region_worker,
+                             initargs=(environment, self.regions))
+        else:
+            init_region_worker(environment, self.regions)
+        self.owned_counts = [[] for _ in self.regions]
+        self.handoff_counts = [[] for _ in self.regions]
+        self.seconds = [[] for _ in self.regions]
+
+    def get_region(self, x: float, y: float) -> int:
+        """
+        Region owning a position, which is the region of the closest intersection.
+        """
+        closest = min(self.intersections, key=lambda intersection: math.dist(
+            (x, y), (intersection['location']['x'], intersection['location']['y'])))
+        return self.intersection_regions[closest['id']]
+
+    def get_detection_positions(self, output) -> np.ndarray:
+        """
+        Positions of the detections of a node in the world, shape (n_detections, 2).
+        """
+        positions = [self.processor.get_detection_position(
+                         output, self.processor.process_detection(output.is_rsu, detection))
+                     for detection in output.detections]
+        return np.array(positions).reshape(-1, 2)
+
+    def is_near(self, positions: np.ndarray, region_positions: np.ndarray) -> bool:
+        """
+        Returns True if any of the positions is within the handoff range of the region.
+        """
+        if len(positions) == 0 or len(region_positions) == 0:
+            return False
+        distances = np.linalg.norm(positions[:, None] - region_positions[None], axis=2)
+        return bool(np.min(distances) <= self.handoff_range)
+
+    def get_jobs(self, data: dict, timestep: int) -> list:
+        owned = [set() for _ in self.regions]
+        positions = {}
+        for node_id, output in data.items():
+            owned[self.get_region(output.agent_x, output.agent_y)].add(node_id)
+            positions[node_id] = self.get_detection_positions(output)
+        jobs = []
+        for region in range(len(self.regions)):
+            region_positions = np.concatenate(
+                [positions[node_id] for node_id in owned[region]] + [np.empty((0, 2))])
+            # The order of the data pipe is kept, as the duplicate search depends on it.
+            region_data = {node_id: output for node_id, output in data.items()
+                           if node_id in owned[region] or
+                           self.is_near(positions[node_id], region_positions)}
+            self.owned_counts[region].append(len(owned[region]))
+            self.handoff_counts[region].append(len(region_data) - len(owned[region]))
+            jobs.append((region, region_data, owned[region], timestep, len(data)))
+        return jobs
+
+    def run(self):
+        """
+        Process the regions at each tick, after the deadline.
+        """
+        if self.deadline > 0:
+            yield self.env.timeout(self.deadline)
+        while True:
+            jobs = self.get_jobs(dict(self.data_pipe), int(self.env.now))
+            with self.profiler.measure("regions.process"):
+                if self.pool is not None:
+                    results = self.pool.map(process_region, jobs)
+                else:
+                    results = [process_region(job) for job in jobs]
+            for region, world, seconds in results:
+                self.seconds[region].append(seconds)
+                self.result_storage_pipe['processing_results'][
+                    'agents'].extend(world['agents'])
+                self.result_storage_pipe['processing_results'][
+                    'intersection_statuses'].extend(world['intersection_statuses'])
+            yield self.env.timeout(1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def report(self) -> dict:
+        """
+        Intersections, mean amount of owned and handed off nodes and the
+        processing time of each region.
+        """
+        report = {}
+        for i, intersection_ids in enumerate(self.regions):
+            report[f"region_{i}"] = {
+                "intersections": intersection_ids,
+                "mean_nodes": float(np.mean(self.owned_counts[i])) if self.owned_counts[i] else 0.0,
+                "mean_handoff_nodes": (float(np.mean(self.handoff_counts[i]))
+                                       if self.handoff_counts[i] else 0.0),
+                "processing": Profiler.summarize(self.seconds[i]) if self.seconds[i] else None
+            }
+        return report
+
+    def print_summary(self):
+        print(f"{'region':<10}{'intersections':>15}{'nodes':>8}{'handoff':>9}{'p95 ms':>9}")
+        for region, data in self.report().items():
+            p95 = data['processing']['p95_ms'] if data['processing'] else 0
+            print(f"{region:<10}{len(data['intersections']):>15}{data['mean_nodes']:>8.1f}"
+                  f"{data['mean_handoff_nodes']:>9.1f}{p95:>9.2f}")
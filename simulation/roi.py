@@ -0,0 +1,52 @@
+"""
+Regions of interest of the camera images. Only the region of interest of an
+image is given to yolo, which shrinks the input and the inference cost. The
+detections are then moved back to the coordinates of the full image.
+"""
+from typing import Tuple
+from numpy import ndarray, ascontiguousarray
+from pandas import DataFrame
+
+# Region of interest of each camera type as fractions of the image
+# (top, bottom, left, right). The sky and the hood of the vehicle
+# never contain useful targets. RSUs look down, so all of the image is used.
+DEFAULT_ROIS = {
+    "vehicle": (0.3, 0.85, 0.0, 1.0),
+    "rsu": None
+}
+
+
+def parse_roi(text: str) -> Tuple[float, float, float, float]:
+    """
+    Parse a region of interest from "top,bottom" or "top,bottom,left,right".
+    """
+    values = [float(value) for value in text.split(',')]
+    if len(values) == 2:
+        values += [0.0, 1.0]
+    return tuple(values)
+
+
+def crop_image(image: ndarray, roi: Tuple[float, float, float, float]) -> Tuple[ndarray, int, int]:
+    """
+    Crop the region of interest of the image. Returns the crop and
+    its x and y offset in pixels in the full image.
+    """
+    if roi is None:
+        return image, 0, 0
+    top, bottom, left, right = roi
+    height, width = image.shape[:2]
+    y_min, y_max = int(top * height), int(bottom * height)
+    x_min, x_max = int(left * width), int(right * width)
+    return ascontiguousarray(image[y_min:y_max, x_min:x_max]), x_min, y_min
+
+
+def offset_detections(detections: DataFrame, x_offset: int, y_offset: int) -> DataFrame:
+    """
+    Move the bounding boxes detected in a crop to the coordinates of the full image.
+    """
+    if x_offset == 0 and y_offset == 0:
+        return detections
+    detections = detections.copy()
+    detections[['xmin', 'xmax']] += x_offset
+    detections[['ymin', 'ymax']] += y_offset
+    return detections
@@ -0,0 +1,142 @@
+"""
+Scheduling of the node inference under a compute budget. Each simulation step
+only the most relevant nodes run their model, the rest keep their previous
+output in the data pipe, which the processor then reuses.
+"""
+import math
+from typing import List
+import numpy as np
+from data import DataLoader
+
+
+class Scheduler():
+    """
+    Decides at each simulation step which nodes run inference. The budget is
+    either an amount of frames or estimated inference milliseconds per step.
+    Nodes are prioritized by the proximity to an intersection, speed and the
+    amount of steps since their last update, so no node is starved forever.
+    """
+    def __init__(self, dataloader: DataLoader, node_ids: List[str],
+                 budget_frames: int = None, budget_ms: float = None,
+                 node_models: dict = None):
+        self.dataloader = dataloader
+        self.node_ids = node_ids
+        self.budget_frames = budget_frames
+        self.budget_ms = budget_ms
+        # node id -> model group, used for the estimated inference cost of the node.
+        self.node_models = node_models or {}
+
+        self.proximity_weight = 1.0
+        self.speed_weight = 0.5
+        self.staleness_weight = 1.0
+        self.intersection_range = 50 # meters, no proximity priority further away.
+        self.max_speed = 15 # m/s, speeds above have the full speed priority.
+        self.staleness_horizon = 10 # steps, staleness priority of a single update.
+
+        self.simulation_step = None
+        self.scheduled = set()
+        self.last_update = {}
+        self.n_updates = {node_id: 0 for node_id in node_ids}
+        self.staleness = {node_id: [] for node_id in node_ids}
+        self.n_steps = 0
+
+    def get_intersection_distance(self, x: float, y: float) -> float:
+        return min(math.dist((x, y), (intersection['location']['x'],
+                                      intersection['location']['y']))
+                   for intersection in self.dataloader.get_intersections())
+
+    def get_priority(self, node_id: str, simulation_step: int) -> float:
+        state = self.dataloader.read_entity_state(node_id, simulation_step)
+        distance = self.get_intersection_distance(state.x, state.y)
+        proximity = max(0.0, 1 - distance / self.intersection_range)
+        speed = min(state.velocity / self.max_speed, 1.0)
+        # Nodes which have never been updated are more stale than any updated node.
+        last_update = self.last_update.get(node_id, -self.staleness_horizon)
+        staleness = (simulation_step - last_update) / self.staleness_horizon
+        return (self.proximity_weight * proximity + self.speed_weight * speed +
+                self.staleness_weight * staleness)
+
+    def get_cost(self, node_id: str) -> float:
+        """
+        Estimated inference milliseconds of the node, measured by its model group.
+        Before the first measurement the cost is unknown and estimated as 0.
+        """
+        model = self.node_models.get(node_id)
+        if model is None:
+            return 0.0
+        return model.get_cost()['ms_per_image']
+
+    def schedule(self, simulation_step: int) -> set:
+        """
+        Choose the nodes updated at the step in the order of their priority.
+        The node with the highest priority is always updated.
+        """
+        priorities = {node_id: self.get_priority(node_id, simulation_step)
+                      for node_id in self.node_ids}
+        scheduled = set()
+        total_ms = 0.0
+        for node_id in sorted(self.node_ids, key=priorities.get, reverse=True):
+            cost = self.get_cost(node_id)
+            if scheduled:
+                if self.budget_frames is not None and len(scheduled) >= self.budget_frames:
+                    break
+                if self.budget_ms is not None and total_ms + cost > self.budget_ms:
+                    continue
+            scheduled.add(node_id)
+            total_ms += cost
+
+        for node_id in self.node_ids:
+            if node_id in scheduled:
+                self.last_update[node_id] = simulation_step
+                self.n_updates[node_id] += 1
+            if node_id in self.last_update:
+                self.staleness[node_id].append(simulation_step - self.last_update[node_id])
+        self.n_steps += 1
+        return scheduled
+
+    def is_scheduled(self, node_id: str, simulation_step: int) -> bool:
+        """
+        Returns True if the node runs inference at the step. The schedule is
+        made when the first node asks for it at the step.
+        """
+        if simulation_step != self.simulation_step:
+            self.scheduled = self.schedule(simulation_step)
+            self.simulation_step = simulation_step
+        return node_id in self.scheduled
+
+    def report(self) -> dict:
+        """
+        Update rate (share of steps the node ran inference) and the staleness
+        of the data of each node in steps.
+        """
+        nodes = {}
+        for node_id in self.node_ids:
+            staleness = self.staleness[node_id]
+            nodes[node_id] = {
+                "updates": self.n_updates[node_id],
+                "update_rate": self.n_updates[node_id] / max(self.n_steps, 1),
+                "mean_staleness": float(np.mean(staleness)) if staleness else None,
+                "max_staleness": int(np.max(staleness)) if staleness else None
+            }
+        all_staleness = [value for node_id in self.node_ids for value in self.staleness[node_id]]
+        return {
+            "budget_frames": self.budget_frames,
+            "budget_ms": self.budget_ms,
+            "steps": self.n_steps,
+            "mean_update_rate": float(np.mean([node['update_rate'] for node in nodes.values()])),
+            "mean_staleness": float(np.mean(all_staleness)) if all_staleness else None,
+            "p95_staleness": float(np.percentile(all_staleness, 95)) if all_staleness else None,
+            "nodes": nodes
+        }
+
+    def print_summary(self):
+        report = self.report()
+        print(f"Scheduled {report['mean_update_rate'] * 100:.1f}% of the node frames, "
+              f"staleness mean {report['mean_staleness']:.2f} steps, "
+              f"p95 {report['p95_staleness']:.1f} steps")
+        print(f"{'node':<20}{'updates':>9}{'rate':>8}{'mean stale':>12}{'max stale':>11}")
+        for node_id, node in report['nodes'].items():
+            mean_staleness = '-' if node['mean_staleness'] is None else f"{node['mean_staleness']:.2f}"
+            max_staleness = '-' if node['max_staleness'] is None else node['max_staleness']
+            print(f"{node_id:<20}{node['updates']:>9}{node['update_rate']:>8.2f}"
+                  f"{mean_staleness:>12}{max_staleness:>11}")
@@ -0,0 +1,58 @@
+"""
+Model of the service time of the processor, used for simulating the capacity
+of the edge servers. The cost of processing a tick grows with the amount of
+detections, so the measured wall clock cost is fitted as a linear function of it.
+"""
+
+
+class ServiceTimeModel():
+    """
+    Linear model seconds = intercept + slope * detections, fitted to the measured
+    cost of processing ticks on this machine. The speed is the speed of the
+    simulated server relative to this machine, e.g. 2 for twice as fast.
+    """
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        # Running sums of the samples for the closed form least squares fit.
+        self.n = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+        self.sum_xx = 0.0
+        self.intercept = 0.0
+        self.slope = 0.0
+
+    def add_sample(self, n_detections: int, seconds: float):
+        """
+        Add a measured cost and refit the model in constant time.
+        """
+        self.n += 1
+        self.sum_x += n_detections
+        self.sum_y += seconds
+        self.sum_xy += n_detections * seconds
+        self.sum_xx += n_detections * n_detections
+        mean = self.sum_y / self.n
+        denominator = self.n * self.sum_xx - self.sum_x ** 2
+        # All samples have the same amount of detections, the slope is unknown.
+        if denominator <= 0:
+            self.slope, self.intercept = 0.0, mean
+            return
+        self.slope = (self.n * self.sum_xy - self.sum_x * self.sum_y) / denominator
+        self.intercept = (self.sum_y - self.slope * self.sum_x) / self.n
+        # The cost cannot decrease with more detections.
+        if self.slope < 0:
+            self.slope, self.intercept = 0.0, mean
+
+    def predict(self, n_detections: int) -> float:
+        """
+        Service time in seconds on the simulated server.
+        """
+        return max(self.intercept + self.slope * n_detections, 0.0) / self.speed
+
+    def to_dict(self) -> dict:
+        return {
+            "speed": self.speed,
+            "samples": self.n,
+            "intercept_ms": float(self.intercept) * 1000,
+            "ms_per_detection": float(self.slope) * 1000
+        }
@@ -0,0 +1,7 @@
+"""
+The simulation modules use flat imports and are run from the simulation folder.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+"""
+The DataLoader reads the frames of the streamed Recorder layout and of
+the older runs, which stored the frames as fixed-length bytes.
+"""
+import h5py
+import numpy as np
+from data import DataLoader
+from utils.synthetic import generate_run
+
+FILENAME = "data_test.hdf5"
+
+
+def test_read_images_of_both_layouts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = generate_run(FILENAME, n_vehicles=2, n_rsus=0, n_frames=3, img_width=64,
+                        img_height=48, n_intersections=1, folder="runs")
+    with h5py.File(path, 'a') as h5file:
+        frames = h5file['sensors/camera_1']
+        assert h5py.check_vlen_dtype(frames.dtype) == np.uint8
+        # Layout written by the Recorder before the frames were streamed.
+        del h5file['sensors/camera_2']
+        h5file['sensors'].create_dataset(
+            'camera_2', data=[np.asarray(frame.tobytes()) for frame in frames])
+        assert h5file['sensors/camera_2'].dtype.kind == 'S'
+
+    dataloader = DataLoader(FILENAME)
+    for step in range(3):
+        streamed = dataloader.read_images('camera_1', step)
+        fixed = dataloader.read_images('camera_2', step)
+        assert streamed.shape == (48, 64, 3)
+        assert np.array_equal(streamed, fixed)
@@ -0,0 +1,82 @@
+"""
+Processors having a part of the nodes each store one merged status per
+intersection and tick.
+"""
+import pytest
+import simpy
+from data import DataLoader
+from data_models.output_summary import DetectionData, OutputSummary
+from processor import Processor, StatusMerger
+from profiler import Profiler
+from utils.synthetic import generate_run
+
+FILENAME = "processor_test.hdf5"
+
+
+@pytest.fixture
+def dataloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    generate_run(FILENAME, n_vehicles=12, n_rsus=4, n_frames=3, img_width=160,
+                 img_height=160, n_intersections=3, folder="runs")
+    return DataLoader(FILENAME)
+
+
+def get_result_storage_pipe() -> dict:
+    return {"processing_results": {"agents": [], "intersection_statuses": []}}
+
+
+def get_outputs(dataloader: DataLoader, step: int) -> dict:
+    """
+    Outputs with a person detected right in front of each node. The records of
+    a node are only added with its detections, see Processor.process_all.
+    """
+    width, height = dataloader.get_image_dimensions()
+    outputs = {}
+    for i, node_id in enumerate(dataloader.get_entity_ids()):
+        detection = DetectionData(node_id, "0", "person", width / 2 - 5, width / 2 + 5,
+                                  0, height, step)
+        state = dataloader.read_entity_state(node_id, step)
+        # Every third node classifies its image.
+        congestion = 0.2 * (i % 5) if i % 3 == 0 else None
+        outputs[node_id] = OutputSummary(node_id, state.is_rsu, state.x, state.y,
+                                         state.direction, state.velocity, [detection], step,
+                                         congestion)
+    return outputs
+
+
+def get_statuses(result_storage_pipe: dict) -> list:
+    return [(status['id'], status['timestep'], status['car_count'], status['human_count'],
+             status['car_count_norm'], status['congestion_probability'], status['status'])
+            for status in result_storage_pipe['processing_results']['intersection_statuses']]
+
+
+def test_split_processors_store_one_status_per_intersection(dataloader):
+    env = simpy.Environment()
+    single_pipe = get_result_storage_pipe()
+    single = Processor(env, {}, single_pipe, dataloader, Profiler(enabled=False))
+    node_ids = dataloader.get_entity_ids()
+    split_pipe = get_result_storage_pipe()
+    merger = StatusMerger(split_pipe, 2)
+    processors = [Processor(env, {}, split_pipe, dataloader, Profiler(enabled=False),
+                            processor_id=f"processor_{i}", node_ids=node_ids[i::2],
+                            merger=merger)
+                  for i in range(2)]
+
+    for step in range(dataloader.get_simulation_length()):
+        outputs = get_outputs(dataloader, step)
+        single.process_tick(outputs, step, len(outputs))
+        # No duplicates, which only the single processor could find.
+        assert not any(record['matches'] for record in
+                       single_pipe['processing_results']['agents'])
+        for processor in processors:
+            data = {node_id: output for node_id, output in outputs.items()
+                    if node_id in processor.node_ids}
+            processor.process_tick(data, step, len(outputs))
+
+    statuses = get_statuses(split_pipe)
+    keys = [(status[0], status[1]) for status in statuses]
+    assert len(keys) == len(set(keys)) == 3 * len(dataloader.get_intersections())
+    assert sum(status[2] for status in statuses) > 0
+    assert statuses == pytest.approx(get_statuses(single_pipe))
+    assert (len(split_pipe['processing_results']['agents']) ==
+            len(single_pipe['processing_results']['agents']))
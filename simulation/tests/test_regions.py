@@ -0,0 +1,136 @@
+"""
+The processing sharded into regions gives the same intersection statuses
+as a single processor.
+"""
+import numpy as np
+import pytest
+import simpy
+from data import DataLoader
+from data_models.output_summary import DetectionData, OutputSummary
+from processor import Processor
+from profiler import Profiler
+from regions import RegionCoordinator, process_region
+from utils.synthetic import generate_run
+
+FILENAME = "regions_test.hdf5"
+
+
+@pytest.fixture
+def dataloader(tmp_path, monkeypatch):
+    # The DataLoader and the region workers read the runs folder of the working directory.
+    monkeypatch.chdir(tmp_path)
+    generate_run(FILENAME, n_vehicles=12, n_rsus=4, n_frames=5, img_width=160,
+                 img_height=160, n_intersections=4, folder="runs")
+    return DataLoader(FILENAME)
+
+
+def get_outputs(dataloader: DataLoader, step: int, rng: np.random.Generator) -> dict:
+    """
+    Outputs of all nodes at the step with random car and person detections.
+    The distance of a detection is estimated from the height of its box, so
+    the low boxes are placed far away, often in another region.
+    """
+    width, height = dataloader.get_image_dimensions()
+    outputs = {}
+    for node_id in dataloader.get_entity_ids():
+        state = dataloader.read_entity_state(node_id, step)
+        detections = []
+        for i in range(rng.integers(2, 8)):
+            box_width, box_height = rng.uniform(5, 40), rng.uniform(2, 40)
+            xmin = rng.uniform(0, width - box_width)
+            ymin = rng.uniform(0, height / 2)
+            detections.append(DetectionData(node_id, str(i), str(rng.choice(["car", "person"])),
+                                            xmin, xmin + box_width, ymin, ymin + box_height,
+                                            step))
+        outputs[node_id] = OutputSummary(node_id, state.is_rsu, state.x, state.y,
+                                         state.direction, state.velocity, detections, step)
+    return outputs
+
+
+def get_counts(statuses: list) -> dict:
+    return {status['id']: (status['car_count'], status['human_count'], status['status'])
+            for status in statuses}
+
+
+def test_unique_detection_does_not_match(dataloader):
+    processor = Processor(simpy.Environment(), {}, None, dataloader, Profiler(enabled=False))
+    assert not processor.is_detection_another_agent({'agents': []}, "camera_1", (0, 0), "car")
+    agents = {'agents': [{'id': "camera_2-0", 'x': 5, 'y': 0, 'type': "car", 'detected': True}]}
+    assert processor.is_detection_another_agent(agents, "camera_1", (0, 0), "car")
+    assert not processor.is_detection_another_agent(agents, "camera_1", (85, 0), "car")
+
+
+def test_regions_match_single_processor(dataloader):
+    rng = np.random.default_rng(0)
+    processor = Processor(simpy.Environment(), {}, None, dataloader, Profiler(enabled=False))
+    coordinator = RegionCoordinator(simpy.Environment(), {}, {}, dataloader,
+                                    Profiler(enabled=False), FILENAME, n_regions=2)
+    assert len(coordinator.regions) == 2
+
+    n_matches = 0
+    n_crossing = 0
+    for step in range(dataloader.get_simulation_length()):
+        outputs = get_outputs(dataloader, step, rng)
+        world, _ = processor.process_world(outputs, step)
+        n_matches += sum(record['matches'] for record in world['agents'])
+        for output in outputs.values():
+            owner = coordinator.get_region(output.agent_x, output.agent_y)
+            n_crossing += sum(coordinator.get_region(x, y) != owner
+                              for x, y in coordinator.get_detection_positions(output))
+
+        statuses = []
+        for job in coordinator.get_jobs(outputs, step):
+            _, region_world, _ = process_region(job)
+            statuses.extend(region_world['intersection_statuses'])
+        assert get_counts(statuses) == get_counts(world['intersection_statuses'])
+    # Duplicate detections were found and detections crossed the region borders,
+    # so the filtering and the handoff were exercised.
+    assert n_matches > 0
+    assert n_crossing > 0
+    assert sum(map(sum, coordinator.handoff_counts)) > 0
+
+
+def detect_at(node_id: str, x: float, y: float, target: tuple, image_width: int,
+              step: int) -> OutputSummary:
+    """
+    Output of a vehicle at (x, y) facing the target, with a car detected at the
+    target. The height of the box gives the distance, see Processor.process_detection.
+    """
+    distance = np.hypot(target[0] - x, target[1] - y)
+    direction = np.degrees(np.arctan2(target[1] - y, target[0] - x))
+    box_height = 1500 * 30 / 100 / distance
+    center = image_width / 2
+    detection = DetectionData(node_id, "0", "car", center - 5, center + 5, 10,
+                              10 + box_height, step)
+    return OutputSummary(node_id, False, x, y, direction, 0.0, [detection], step)
+
+
+def test_duplicate_across_region_border(dataloader):
+    """
+    A car far in another region, seen by a node of each region. The node seeing
+    it first is far from the intersections of the other region.
+    """
+    processor = Processor(simpy.Environment(), {}, None, dataloader, Profiler(enabled=False))
+    coordinator = RegionCoordinator(simpy.Environment(), {}, {}, dataloader,
+                                    Profiler(enabled=False), FILENAME, n_regions=2)
+    locations = {intersection['id']: (intersection['location']['x'],
+                                      intersection['location']['y'])
+                 for intersection in dataloader.get_intersections()}
+    first = locations[coordinator.regions[0][0]]
+    second = locations[coordinator.regions[1][0]]
+    assert np.hypot(second[0] - first[0], second[1] - first[1]) > 100
+    image_width, _ = dataloader.get_image_dimensions()
+    outputs = {
+        "far": detect_at("far", first[0], first[1], second, image_width, 0),
+        "near": detect_at("near", second[0], second[1] - 15, second, image_width, 0)
+    }
+
+    world, _ = processor.process_world(outputs, 0)
+    near_detection = next(record for record in world['agents'] if record['id'] == "near-0")
+    assert near_detection['matches']
+
+    statuses = []
+    for job in coordinator.get_jobs(outputs, 0):
+        _, region_world, _ = process_region(job)
+        statuses.extend(region_world['intersection_statuses'])
+    assert get_counts(statuses) == get_counts(world['intersection_statuses'])
@@ -0,0 +1,78 @@
+"""
+Static road layer of the 2D map. The waypoints never change during a run,
+so they are rasterized once into an RGBA image, which is cached in memory
+and on disk, instead of drawing thousands of scatter points every frame.
+"""
+import os
+import hashlib
+from typing import List, Tuple
+import numpy as np
+
+
+# (map name, waypoint count, extent, resolution) -> RGBA raster
+background_cache = {}
+cache_folder = "visualization/cache"
+
+
+def decimate_waypoints(waypoints: np.ndarray, meters_per_pixel: float) -> np.ndarray:
+    """
+    Level of detail: waypoints are 1 meter apart, so when a pixel covers
+    several meters most of them would land on the same pixel.
+    """
+    step = int(meters_per_pixel)
+    if step <= 1:
+        return waypoints
+    return waypoints[::step]
+
+
+def rasterize_waypoints(waypoints: np.ndarray, extent: Tuple[float, float, float, float],
+                        resolution: Tuple[int, int], dot_size: int = 2) -> np.ndarray:
+    """
+    Draw the waypoints as black dots on a transparent RGBA image.
+    Extent is (min_x, max_x, min_y, max_y) and the first image row is min_y.
+    """
+    min_x, max_x, min_y, max_y = extent
+    width, height = resolution
+    raster = np.zeros((height, width, 4), dtype=np.uint8)
+    meters_per_pixel = (max_x - min_x) / width
+    points = decimate_waypoints(waypoints, meters_per_pixel)
+
+    columns = ((points[:, 0] - min_x) / (max_x - min_x) * width).astype(int)
+    rows = ((points[:, 1] - min_y) / (max_y - min_y) * height).astype(int)
+    inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+    columns, rows = columns[inside], rows[inside]
+    for offset_row in range(dot_size):
+        for offset_column in range(dot_size):
+            raster[np.clip(rows + offset_row, 0, height - 1),
+                   np.clip(columns + offset_column, 0, width - 1), 3] = 255
+    return raster
+
+
+def get_map_background(map_name: str, waypoints: List[Tuple[float, float]],
+                       extent: Tuple[float, float, float, float],
+                       resolution: Tuple[int, int], use_disk: bool = True) -> np.ndarray:
+    """
+    Return the rasterized road layer, rendering it only if it is not cached.
+    The disk cache lets separate processes (e.g. parallel rendering) and
+    later visualizations of the same map reuse the raster.
+    """
+    extent = tuple(round(float(value), 3) for value in extent)
+    key = (map_name, len(waypoints), extent, tuple(resolution))
+    if key in background_cache:
+        return background_cache[key]
+
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(cache_folder, f"map-{digest}.npy")
+    if use_disk and os.path.exists(path):
+        raster = np.load(path)
+    else:
+        raster = rasterize_waypoints(np.asarray(waypoints, dtype=float), extent, resolution)
+        if use_disk:
+            if not os.path.exists(cache_folder):
+                os.makedirs(cache_folder, exist_ok=True)
+            # Write to a temporary file first, other processes may read the cache.
+            temporary_path = f"{path}.{os.getpid()}.npy"
+            np.save(temporary_path, raster)
+            os.replace(temporary_path, path)
+    background_cache[key] = raster
+    return raster
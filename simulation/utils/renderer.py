@@ -0,0 +1,270 @@
+"""
+Renderer for the DES visualization that keeps a single figure alive.
+The layout and static artists (map waypoints, ground truth texts) are
+created once and each frame only updates the data of existing artists.
+"""
+import math
+from typing import List
+import numpy as np
+import matplotlib.patheffects as pe
+import matplotlib.patches as patches
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from data import DataLoader
+from utils.results_index import ResultsIndex
+from utils.map_background import get_map_background
+from utils.visualizations import (get_intersection_lines, get_detection_caption, get_label_y,
+                                  get_map_limits, get_agent_colors, group_map_agents,
+                                  get_positions, get_rotated_markers, get_car_marker,
+                                  get_rsu_marker, get_human_marker)
+
+
+LAYOUT = [["top left", "top centre", "top right"],
+          ["bottom row", "bottom row", "bottom row"]]
+VIEW_AXES = ["top left", "top right"]
+# Width of the camera images in the grid layout, when not given.
+GRID_THUMBNAIL_WIDTH = 160
+
+
+def get_grid_layout(n_views: int) -> tuple:
+    """
+    Layout for any number of car views: the views in a grid on the top left,
+    the analysis results on the top right and the map below them.
+    Returns the mosaic, the view axes and the height ratios.
+    """
+    columns = min(n_views, math.ceil(math.sqrt(n_views * 1.5)))
+    rows = math.ceil(n_views / columns)
+    view_axes = [f"view {i}" for i in range(n_views)]
+    mosaic = []
+    for row in range(rows):
+        cells = view_axes[row * columns:(row + 1) * columns]
+        cells += ["."] * (columns - len(cells))
+        mosaic.append(cells + ["top centre"] * 3)
+    mosaic.append(["bottom row"] * (columns + 3))
+    return mosaic, view_axes, [1] * rows + [rows * 0.8]
+
+
+class FrameRenderer():
+    """
+    Draws the car views, the analysis results and the 2D map for a timestep.
+    The figure is drawn off-screen with the Agg canvas, for saving the frames
+    or showing them in the Viewer.
+
+    Two car views use the original layout, any other number of views is
+    drawn as a compact grid of thumbnails without captions. If thumbnail_width
+    is given, the views show images decoded at that width.
+    """
+    def __init__(self, index: ResultsIndex, dataloader: DataLoader,
+                 view_car_indexes: List[int], thumbnail_width: int = None):
+        self.index = index
+        self.dataloader = dataloader
+        self.agent_names = dataloader.get_entity_ids()
+        self.view_names = [self.agent_names[i] for i in view_car_indexes]
+        self.compact = len(self.view_names) != len(VIEW_AXES)
+        if self.compact and thumbnail_width is None:
+            thumbnail_width = GRID_THUMBNAIL_WIDTH
+        self.thumbnail_width = thumbnail_width
+
+        self.fig = Figure(dpi=100)
+        FigureCanvasAgg(self.fig)
+        self.fig.set_size_inches(18, 11) # w, h
+        if self.compact:
+            layout, self.view_axes, height_ratios = get_grid_layout(len(self.view_names))
+            self.axes = self.fig.subplot_mosaic(layout, height_ratios=height_ratios)
+        else:
+            self.view_axes = VIEW_AXES
+            self.axes = self.fig.subplot_mosaic(
+                LAYOUT, height_ratios=[1, 1.5], width_ratios=[1, 1, 1])
+        self.title = self.fig.suptitle("", fontsize=26)
+
+        self.setup_car_views()
+        self.setup_information_view()
+        self.setup_map()
+
+    def setup_car_views(self):
+        img_width, img_height = self.dataloader.get_image_dimensions()
+        # Bounding boxes are in full resolution image coordinates.
+        self.image_scale = 1
+        if self.thumbnail_width is not None:
+            self.image_scale = self.thumbnail_width / img_width
+            img_width, img_height = self.thumbnail_width, round(img_height * self.image_scale)
+        self.views = []
+        for ax_id in self.view_axes:
+            ax = self.axes[ax_id]
+            ax.set_title(" \n ", fontsize=8 if self.compact else 16)
+            if self.compact:
+                ax.set_axis_off()
+            image = ax.imshow(np.zeros((img_height, img_width, 3), dtype=np.uint8))
+            self.views.append({
+                'ax': ax,
+                'title': ax.title,
+                'image': image,
+                'boxes': [],
+                'captions': []
+            })
+
+    def setup_information_view(self):
+        ax = self.axes["top centre"]
+        ax.set_title("Analysis results")
+        # Variables to keep track where text is placed currently
+        text_x, text_y = 0.01, 0.93
+        text_y_decrease = 0.08
+        text_color = "black"
+
+        # Ground truth does not change, so it is drawn only once.
+        metadata = self.dataloader.get_metadata_summary()
+        lines = ["Ground truth:",
+                 f"Total cars {metadata['n_vehicles']}:",
+                 f"Total pedestrians: {metadata['n_pedestrians']}",
+                 f"Total RSUs: {metadata['n_rsus']}"]
+        for i, line in enumerate(lines):
+            ax.text(text_x, text_y - (text_y_decrease * i), line,
+                    size=13 if i == 0 else 10, color=text_color)
+
+        # One block of texts for each intersection, updated every frame.
+        text_x += 0.4
+        self.intersection_texts = []
+        for block in range(len(self.dataloader.get_intersections())):
+            block_y = 0.93 - (text_y_decrease * 6 * block)
+            texts = []
+            for i in range(5):
+                text = ax.text(text_x, block_y - (text_y_decrease * i), "",
+                               size=13 if i == 0 else 10, color=text_color)
+                texts.append(text)
+            self.intersection_texts.append(texts)
+
+    def setup_map(self):
+        ax = self.axes["bottom row"]
+        ax.set_title("2D scene map")
+        x_limits, y_limits = get_map_limits(self.index.size)
+
+        # The roads are a cached raster at the pixel size of the map panel,
+        # drawn below the markers. The first raster row is the smallest y.
+        bbox = ax.get_window_extent()
+        resolution = (int(bbox.width), int(bbox.height))
+        background = get_map_background(
+            self.dataloader.get_metadata_summary()['map_name'], self.dataloader.get_map(),
+            (*x_limits, *y_limits), resolution)
+        ax.imshow(background, extent=(x_limits[0], x_limits[1], y_limits[1], y_limits[0]),
+                  aspect='auto', interpolation='nearest', zorder=0)
+
+        ax.set_xlim(x_limits)
+        # Rotate Y axis since CARLA Y axis is "upside down".
+        ax.set_ylim(y_limits[::-1])
+        ax.set_autoscale_on(False)
+
+        self.rsu_markers = ax.scatter([], [], marker=get_rsu_marker(), s=500)
+        self.detected_markers = ax.scatter([], [], edgecolors="red")
+        self.human_markers = ax.scatter([], [], marker=get_human_marker(),
+                                        edgecolors="red", s=200)
+        # Known agents have individually rotated markers, set as the paths of the collection.
+        self.known_markers = ax.scatter([], [], marker=get_car_marker(), s=100)
+
+    def update_car_views(self, timestep: int):
+        for view, agent_name in zip(self.views, self.view_names):
+            agent_data = self.index.agent(timestep, agent_name)
+            # Agent data may be missing, see draw_car_views.
+            velocity = -1 if agent_data is None else agent_data['velocity']
+            view['title'].set_text(f"Car ID: {agent_name}\nVelocity: {velocity:.1f}m/s")
+            if self.thumbnail_width is None:
+                view['image'].set_data(self.dataloader.read_images(agent_name, timestep))
+            else:
+                view['image'].set_data(self.dataloader.read_thumbnail(
+                    agent_name, timestep, self.thumbnail_width))
+
+            labels_y_coords = []
+            bounds = self.index.detections(timestep, agent_name)
+            scale = self.image_scale
+            for i, bound in enumerate(bounds):
+                box, caption = self.get_box_artists(view, i)
+                x_min, y_min = bound["xmin"] * scale, bound["ymin"] * scale
+                box.set_bounds(x_min, y_min, bound["xmax"] * scale - x_min,
+                               bound["ymax"] * scale - y_min)
+                box.set_visible(True)
+
+                if self.compact: # Captions do not fit the thumbnails.
+                    caption.set_visible(False)
+                    continue
+                detection_agent = self.index.detected_agent(
+                    timestep, bound['parent_id'], bound["detection_id"])
+                if detection_agent is None or agent_data is None:
+                    caption.set_visible(False)
+                    continue
+                # Caption spacing is in full resolution pixels.
+                label_y = get_label_y(bound["ymin"], labels_y_coords)
+                caption.set_position((x_min, label_y * scale))
+                caption.set_text(get_detection_caption(bound["type"], detection_agent,
+                                                       agent_data))
+                caption.set_visible(True)
+                labels_y_coords.append(label_y)
+
+            # Hide the artists not needed in this frame.
+            for i in range(len(bounds), len(view['boxes'])):
+                view['boxes'][i].set_visible(False)
+                view['captions'][i].set_visible(False)
+
+    def get_box_artists(self, view: dict, i: int) -> tuple:
+        """
+        Bounding box and caption artists are pooled, new ones are
+        only created when a frame has more detections than any before.
+        """
+        if i < len(view['boxes']):
+            return view['boxes'][i], view['captions'][i]
+        box = patches.Rectangle((0, 0), 0, 0, linewidth=1,
+                                edgecolor='r', facecolor='none')
+        view['ax'].add_patch(box)
+        caption = view['ax'].text(
+            0, 0, "", size=12, color='white',
+            path_effects=[pe.withStroke(linewidth=2, foreground="black")])
+        view['boxes'].append(box)
+        view['captions'].append(caption)
+        return box, caption
+
+    def update_information_view(self, timestep: int):
+        intersections = self.index.intersection_statuses(timestep)
+        for i, texts in enumerate(self.intersection_texts):
+            lines = get_intersection_lines(intersections[i]) \
+                if i < len(intersections) else [""] * len(texts)
+            for text, line in zip(texts, lines):
+                text.set_text(line)
+
+    def update_map(self, timestep: int):
+        agents = self.index.agents(timestep)
+        colors = get_agent_colors(len(agents))
+        groups = group_map_agents(agents)
+
+        for collection, group in ((self.rsu_markers, 'rsu'),
+                                  (self.detected_markers, 'detected'),
+                                  (self.human_markers, 'human'),
+                                  (self.known_markers, 'known')):
+            indexes = groups[group]
+            collection.set_offsets(get_positions(agents, indexes))
+            collection.set_facecolors(colors[indexes])
+        # Filled markers have the same edge color as the face.
+        for collection, group in ((self.rsu_markers, 'rsu'), (self.known_markers, 'known')):
+            collection.set_edgecolors(colors[groups[group]])
+        # + rsus are rotated + 90, as the marker points down by default
+        self.rsu_markers.set_paths(get_rotated_markers(agents, groups['rsu'], "rsu", 90))
+        self.known_markers.set_paths(get_rotated_markers(agents, groups['known'], "car"))
+
+    def render(self, timestep: int):
+        """
+        Update all artists to the timestep. The figure is drawn by save and to_rgb.
+        """
+        self.title.set_text(f"Simulation timestep {timestep}")
+        self.update_car_views(timestep)
+        self.update_information_view(timestep)
+        self.update_map(timestep)
+
+    def save(self, path: str):
+        self.fig.savefig(path, dpi=100)
+
+    def to_rgb(self) -> np.ndarray:
+        """
+        Draw the off-screen figure and return the canvas as an RGB array.
+        """
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba())[:, :, :3]
+
+    def close(self):
+        self.fig.clear()
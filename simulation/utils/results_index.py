@@ -0,0 +1,75 @@
+"""
+Index over the DES results for fast lookups in the visualization.
+The results are lists of records for all timesteps, which would otherwise
+be filtered again for every drawn panel of every frame.
+"""
+from collections import defaultdict
+
+
+class ResultsIndex():
+    """
+    Builds per-timestep and per-(timestep, id) indexes of the simulation
+    results and yolo detections once. All lookups are O(1).
+    """
+    def __init__(self, data_results: dict, data_yolo: list):
+        self.agents_by_timestep = defaultdict(list)
+        # (timestep, id) -> first record with the id. Agents are stored once for
+        # each of their detections, the first one is what the searches returned.
+        self.agent_records = {}
+        # (timestep, detection agent id) -> first detected record with the id.
+        self.detected_records = {}
+        for agent in data_results['agents']:
+            timestep = agent['timestep']
+            key = (timestep, agent['id'])
+            self.agents_by_timestep[timestep].append(agent)
+            self.agent_records.setdefault(key, agent)
+            if agent['detected']:
+                self.detected_records.setdefault(key, agent)
+
+        self.statuses_by_timestep = defaultdict(list)
+        for status in data_results['intersection_statuses']:
+            self.statuses_by_timestep[status['timestep']].append(status)
+
+        # (timestep, camera id) -> yolo bounding boxes
+        self.detections_by_camera = defaultdict(list)
+        for detection in data_yolo:
+            key = (detection['timestep'], detection['parent_id'])
+            self.detections_by_camera[key].append(detection)
+
+        self.size = self.compute_size(data_results)
+
+    @staticmethod
+    def compute_size(data_results: dict) -> tuple:
+        """
+        Min and max values of x and y for all agents and detected entities.
+        """
+        x_coords = [agent['x'] for agent in data_results['agents']]
+        y_coords = [agent['y'] for agent in data_results['agents']]
+        return (min(x_coords), max(x_coords), min(y_coords), max(y_coords))
+
+    def agents(self, timestep: int) -> list:
+        """
+        All agent and detection records at a timestep.
+        """
+        return self.agents_by_timestep.get(timestep, [])
+
+    def agent(self, timestep: int, agent_id: str):
+        """
+        Agent record with the id at a timestep, or None.
+        """
+        return self.agent_records.get((timestep, agent_id))
+
+    def detected_agent(self, timestep: int, parent_id: str, detection_id: str):
+        """
+        Processed record of a yolo detection, whose id is "<parent>-<detection>".
+        """
+        return self.detected_records.get((timestep, f"{parent_id}-{detection_id}"))
+
+    def detections(self, timestep: int, camera_id: str) -> list:
+        """
+        Yolo bounding boxes of a camera at a timestep.
+        """
+        return self.detections_by_camera.get((timestep, camera_id), [])
+
+    def intersection_statuses(self, timestep: int) -> list:
+        return self.statuses_by_timestep.get(timestep, [])
@@ -0,0 +1,294 @@
+"""
+Generator for synthetic CARLA-like HDF5 runs. The files use the same layout
+as carla/recorder.py (sensors, state, velocity and metadata), so they can be
+used by the DES, the visualization and the benchmarks without CARLA.
+
+Usage (from the simulation folder):
+    python utils/synthetic.py --vehicles 20 --rsus 4 --frames 200
+"""
+import io
+import os
+import sys
+import json
+import math
+import getopt
+from datetime import datetime
+import h5py
+import numpy as np
+from PIL import Image
+
+
+# Rows of a chunk, the default flush interval of the Recorder.
+CHUNK_ROWS = 30
+SKY_COLOR = (135, 170, 215)
+ROAD_COLOR = (90, 90, 90)
+
+
+def generate_waypoints(n_roads: int, block_size: float) -> list:
+    """
+    Waypoints of a grid shaped town with roads every `block_size` meters.
+    The spacing of the waypoints is 1 meter, as in CarlaEnv.generate_waypoints.
+    """
+    length = (n_roads - 1) * block_size
+    positions = np.arange(0, length + 1, 1.0)
+    waypoints = []
+    for i in range(n_roads):
+        road = i * block_size
+        waypoints.extend((float(p), float(road)) for p in positions)
+        waypoints.extend((float(road), float(p)) for p in positions)
+    return waypoints
+
+
+def generate_intersections(n_roads: int, block_size: float, n_intersections: int,
+                           rng: np.random.Generator) -> list:
+    """
+    Pick `n_intersections` road crossings of the grid as intersections.
+    """
+    crossings = [(i * block_size, j * block_size)
+                 for i in range(n_roads) for j in range(n_roads)]
+    n_intersections = min(n_intersections, len(crossings))
+    picked = rng.choice(len(crossings), size=n_intersections, replace=False)
+    intersections = []
+    for i, index in enumerate(sorted(picked)):
+        x, y = crossings[index]
+        intersections.append({'id': f'intersection_{i+1}', 'location': {'x': x, 'y': y}})
+    return intersections
+
+
+def simulate_vehicles(n_vehicles: int, n_frames: int, fps: int, n_roads: int,
+                      block_size: float, intersections: list,
+                      rng: np.random.Generator) -> tuple:
+    """
+    Move vehicles along the grid roads. Vehicles slow down near intersections,
+    which creates congestion similar to the CARLA runs.
+    Returns dicts of (x, y, yaw) and (vel_x, vel_y) tuples per vehicle.
+    """
+    length = (n_roads - 1) * block_size
+    intersection_points = np.array(
+        [(i['location']['x'], i['location']['y']) for i in intersections])
+    transforms, velocities = {}, {}
+    for i in range(n_vehicles):
+        vehicle_id = f'vehicle_{i+1}'
+        road = rng.integers(n_roads) * block_size
+        horizontal = bool(rng.integers(2))
+        forward = bool(rng.integers(2))
+        position = rng.uniform(0, length)
+        cruise_speed = rng.uniform(5, 14) # m/s
+        transforms[vehicle_id] = []
+        velocities[vehicle_id] = []
+        for _ in range(n_frames):
+            x, y = (position, road) if horizontal else (road, position)
+            speed = cruise_speed
+            if len(intersection_points) > 0:
+                closest = np.min(np.hypot(intersection_points[:, 0] - x,
+                                          intersection_points[:, 1] - y))
+                if closest < 30:
+                    speed = cruise_speed * 0.15
+            yaw = (0 if forward else 180) if horizontal else (90 if forward else -90)
+            vel_x = speed * math.cos(math.radians(yaw))
+            vel_y = speed * math.sin(math.radians(yaw))
+            transforms[vehicle_id].append((x, y, yaw))
+            velocities[vehicle_id].append((vel_x, vel_y))
+            direction = 1 if forward else -1
+            position = (position + direction * speed / fps) % length
+    return transforms, velocities
+
+
+def generate_rsus(n_rsus: int, n_vehicles: int, intersections: list,
+                  rng: np.random.Generator) -> list:
+    """
+    Place RSU cameras 20 meters in the air next to intersections, facing them.
+    """
+    sensors = []
+    for i in range(n_rsus):
+        intersection = intersections[i % len(intersections)]['location']
+        angle = rng.uniform(0, 2 * math.pi)
+        x = intersection['x'] + 20 * math.cos(angle)
+        y = intersection['y'] + 20 * math.sin(angle)
+        yaw = math.degrees(math.atan2(intersection['y'] - y, intersection['x'] - x))
+        sensors.append({
+            'id': f'camera_{n_vehicles + i + 1}',
+            'parent_id': None,
+            'location': {'x': x, 'y': y, 'z': 20},
+            'rotation': {'pitch': -40, 'yaw': yaw, 'roll': 0}
+        })
+    return sensors
+
+
+def draw_frame(img_width: int, img_height: int, n_objects: int,
+               rng: np.random.Generator) -> np.ndarray:
+    """
+    Procedurally draw a camera frame: sky, road and box shaped cars and
+    pedestrians. The objects give the frame a realistic JPEG size.
+    """
+    horizon = int(img_height * 0.45)
+    frame = np.empty((img_height, img_width, 3), dtype=np.uint8)
+    frame[:horizon] = SKY_COLOR
+    frame[horizon:] = ROAD_COLOR
+    # Noise makes the frame compress like a real photo instead of flat colors.
+    frame = np.clip(frame + rng.normal(0, 6, frame.shape), 0, 255).astype(np.uint8)
+    for _ in range(n_objects):
+        is_person = rng.random() < 0.25
+        width = int(rng.uniform(8, 30) if is_person else rng.uniform(30, 200))
+        height = int(width * (2.5 if is_person else rng.uniform(0.6, 0.9)))
+        ymax = int(rng.uniform(horizon + 5, img_height))
+        xmin = int(rng.uniform(0, max(img_width - width, 1)))
+        ymin = max(ymax - height, 0)
+        color = rng.integers(0, 255, size=3)
+        frame[ymin:ymax, xmin:xmin + width] = color
+        if not is_person:
+            # Windows
+            frame[ymin:ymin + height // 3, xmin + width // 6:xmin + 5 * width // 6] = 30
+    return frame
+
+
+def encode_frame(frame: np.ndarray) -> np.ndarray:
+    """
+    Encode frame as JPEG bytes in an uint8 array, the same way as Recorder.process_img.
+    """
+    buf = io.BytesIO()
+    Image.fromarray(frame).save(buf, format='JPEG')
+    return np.frombuffer(buf.getvalue(), dtype=np.uint8)
+
+
+def create_dataset(group: h5py.Group, name: str, rows: list, dtype: object) -> h5py.Dataset:
+    """
+    Create a resizable, chunked dataset of the rows, as Recorder.create_dataset does.
+    Variable length rows are given as an object array.
+    """
+    if dtype == 'f8':
+        data = np.asarray(rows, dtype=dtype)
+    else:
+        data = np.empty(len(rows), dtype=object)
+        for i, row in enumerate(rows):
+            data[i] = row
+    shape = data.shape[1:]
+    return group.create_dataset(name, data=data, dtype=dtype, maxshape=(None, *shape),
+                                chunks=(CHUNK_ROWS, *shape))
+
+
+def generate_run(filename: str, n_vehicles: int = 5, n_rsus: int = 4,
+                 n_frames: int = 100, img_width: int = 640, img_height: int = 640,
+                 detections_per_frame: float = 4, n_pedestrians: int = 20,
+                 n_intersections: int = 2, fps: int = 30, seed: int = 0,
+                 folder: str = "runs", training: bool = False) -> str:
+    """
+    Write a synthetic run to `folder`/`filename` and return the path.
+    `detections_per_frame` is the mean number of objects drawn into each frame.
+    The object count follows a per-timestep congestion level, which is also
+    stored as the `labels` dataset if `training` is True.
+    """
+    rng = np.random.default_rng(seed)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, filename)
+
+    # Town size grows with the vehicle count to keep a similar density.
+    n_roads = max(3, int(math.sqrt(n_vehicles)) + 2)
+    block_size = 100.0
+    intersections = generate_intersections(n_roads, block_size, n_intersections, rng)
+    transforms, velocities = simulate_vehicles(
+        n_vehicles, n_frames, fps, n_roads, block_size, intersections, rng)
+    rsus = generate_rsus(n_rsus, n_vehicles, intersections, rng)
+
+    # Smooth congestion level in range 0-1 for each timestep.
+    congestion = 0.5 + 0.5 * np.sin(np.linspace(0, 4 * math.pi, n_frames)
+                                    + rng.uniform(0, math.pi))
+
+    sensors = [{'id': f'camera_{i+1}', 'parent_id': f'vehicle_{i+1}'}
+               for i in range(n_vehicles)] + rsus
+    metadata = {
+        'timestamp': str(datetime.now()),
+        'map': 'Synthetic/Grid',
+        'waypoints': generate_waypoints(n_roads, block_size),
+        'img_width': img_width,
+        'img_height': img_height,
+        'n_frames': n_frames,
+        'fps': fps,
+        'n_vehicles': n_vehicles,
+        'n_sensors': len(sensors),
+        'n_pedestrians': n_pedestrians,
+        'vehicles': [{'id': f'vehicle_{i+1}', 'model': 'synthetic',
+                      'width': 2.0, 'length': 4.5, 'height': 1.5}
+                     for i in range(n_vehicles)],
+        'sensors': sensors,
+        'intersections': intersections,
+        'congestion_statistics': {
+            i['id']: int(np.sum(congestion > 0.5)) for i in intersections}
+    }
+
+    with h5py.File(path, 'w') as h5file:
+        sensors_group = h5file.create_group('sensors')
+        state_group = h5file.create_group('state')
+        velocity_group = h5file.create_group('velocity')
+        h5file.create_dataset('metadata', data=json.dumps(metadata))
+        if training:
+            labels = ['congested' if level > 0.5 else 'not_congested'
+                      for level in congestion]
+            create_dataset(h5file, 'labels', labels, h5py.string_dtype())
+        for i in range(n_vehicles):
+            vehicle_id = f'vehicle_{i+1}'
+            create_dataset(state_group, vehicle_id, transforms[vehicle_id], 'f8')
+            create_dataset(velocity_group, vehicle_id, velocities[vehicle_id], 'f8')
+        for sensor in sensors:
+            images = []
+            for step in range(n_frames):
+                n_objects = rng.poisson(detections_per_frame * 2 * congestion[step])
+                frame = draw_frame(img_width, img_height, n_objects, rng)
+                images.append(encode_frame(frame))
+            create_dataset(sensors_group, sensor['id'], images, h5py.vlen_dtype(np.uint8))
+    return path
+
+
+def print_help():
+    help_text = "Generate a synthetic HDF5 run without CARLA. The file is saved under runs/.\n" \
+        "Usage: python utils/synthetic.py. Possible arguments:\n" \
+        "\t-h - Help\n" \
+        "\t--vehicles <int> - Amount of vehicles, each has one camera.\n" \
+        "\t--rsus <int> - Amount of RSU cameras.\n" \
+        "\t--frames <int> - Amount of simulation steps.\n" \
+        "\t--resolution <width>x<height> - Camera resolution.\n" \
+        "\t--density <float> - Mean amount of objects drawn per frame.\n" \
+        "\t--intersections <int> - Amount of intersections.\n" \
+        "\t--seed <int> - Random seed.\n" \
+        "\t--training - Also store congestion labels.\n" \
+        "\t--name <string> - File name, by default derived from the settings.\n" \
+        "\n\tExample: python utils/synthetic.py --vehicles 50 --rsus 8 --frames 300"
+    print(help_text)
+
+
+if __name__ == "__main__":
+    opts, args = getopt.getopt(sys.argv[1:], "h", [
+        "vehicles=", "rsus=", "frames=", "resolution=", "density=",
+        "intersections=", "seed=", "training", "name="])
+    settings = {}
+    NAME = None
+    for opt, arg in opts:
+        if opt == "-h":
+            print_help()
+            sys.exit(0)
+        if opt == "--vehicles":
+            settings['n_vehicles'] = int(arg)
+        if opt == "--rsus":
+            settings['n_rsus'] = int(arg)
+        if opt == "--frames":
+            settings['n_frames'] = int(arg)
+        if opt == "--resolution":
+            width, height = arg.split('x')
+            settings['img_width'], settings['img_height'] = int(width), int(height)
+        if opt == "--density":
+            settings['detections_per_frame'] = float(arg)
+        if opt == "--intersections":
+            settings['n_intersections'] = int(arg)
+        if opt == "--seed":
+            settings['seed'] = int(arg)
+        if opt == "--training":
+            settings['training'] = True
+        if opt == "--name":
+            NAME = arg
+
+    if NAME is None:
+        NAME = f"synthetic_{settings.get('n_vehicles', 5)}_vehicles_" \
+               f"{settings.get('n_frames', 100)}_frames.hdf5"
+    saved_path = generate_run(NAME, **settings)
+    print(f"Saved synthetic run to {saved_path}")
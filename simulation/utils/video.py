@@ -1,28 +1,113 @@
+"""
+Video encoding for the visualization. Frames are streamed to the encoder
+one at a time, so memory use does not grow with the length of the video.
+ffmpeg is used through a pipe if it is installed, otherwise OpenCV.
+
+As a script, converts earlier saved figures (visualize.py --save_figures)
+to a video: python utils/video.py
+"""
+import os
+import re
+import glob
+import shutil
+import subprocess
 import cv2
 import numpy as np
-import glob
-import re
- 
+
+
+class VideoEncoder():
+    """
+    Encodes RGB frames of equal size into a mp4 file.
+    """
+    def __init__(self, path: str, fps: int, backend: str = None):
+        self.path = path
+        self.fps = fps
+        if backend is None:
+            backend = "ffmpeg" if shutil.which("ffmpeg") else "cv2"
+        self.backend = backend
+        self.writer = None
+
+    def open(self, width: int, height: int):
+        if self.backend == "ffmpeg":
+            command = ["ffmpeg", "-y", "-loglevel", "error",
+                       "-f", "rawvideo", "-pix_fmt", "rgb24",
+                       "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+                       "-c:v", "libx264", "-pix_fmt", "yuv420p", self.path]
+            self.writer = subprocess.Popen(command, stdin=subprocess.PIPE)
+        else:
+            self.writer = cv2.VideoWriter(
+                self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+
+    def write(self, frame: np.ndarray):
+        """
+        Write a single RGB frame with shape (height, width, 3).
+        """
+        if self.writer is None:
+            self.open(frame.shape[1], frame.shape[0])
+        if self.backend == "ffmpeg":
+            self.writer.stdin.write(np.ascontiguousarray(frame).tobytes())
+        else:
+            self.writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if self.writer is None:
+            return
+        if self.backend == "ffmpeg":
+            self.writer.stdin.close()
+            self.writer.wait()
+        else:
+            self.writer.release()
+        self.writer = None
+
+
+def concatenate_segments(segment_paths: list, path: str, backend: str = None):
+    """
+    Join video segments encoded in parallel into a single video. With ffmpeg
+    the streams are copied without re-encoding, OpenCV re-encodes frame by frame.
+    """
+    if backend is None:
+        backend = "ffmpeg" if shutil.which("ffmpeg") else "cv2"
+    if backend == "ffmpeg":
+        list_path = f"{path}.segments.txt"
+        with open(list_path, 'w', encoding="utf-8") as file:
+            for segment_path in segment_paths:
+                file.write(f"file '{os.path.abspath(segment_path)}'\n")
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                        "-i", list_path, "-c", "copy", path], check=True)
+        os.remove(list_path)
+        return
+
+    writer = None
+    for segment_path in segment_paths:
+        capture = cv2.VideoCapture(segment_path)
+        if writer is None:
+            fps = capture.get(cv2.CAP_PROP_FPS)
+            size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            writer.write(frame)
+        capture.release()
+    if writer is not None:
+        writer.release()
+
+
 # helper function to perform sort
 def num_sort(test_string):
     return list(map(int, re.findall(r'\d+', test_string)))[0]
 
-img_array = []
-filenames = glob.glob('visualization/figures/*.png')
-filenames.sort(key=num_sort)
-
-for filename in filenames:
-    img = cv2.imread(filename)
-    height, width, layers = img.shape
-    size = (width, height)
-    img_array.append(img)
-
-print("processed filenames")
-#out = cv2.VideoWriter('project.avi', cv2.VideoWriter_fourcc(*'DIVX'), 15, size)
-video_path = "visualization/video.mp4"
-out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MP4V'), 15, size)
-
-for image in img_array:
-    out.write(image)
-out.release()
-print(f"\nDone, saved video {video_path}")
+
+if __name__ == "__main__":
+    filenames = glob.glob('visualization/figures/*.png')
+    filenames.sort(key=num_sort)
+
+    video_path = "visualization/video.mp4"
+    encoder = VideoEncoder(video_path, fps=15)
+    for filename in filenames:
+        # Images are read one at a time and written directly to the encoder.
+        encoder.write(cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB))
+    encoder.close()
+    print(f"\nDone, saved video {video_path}")
@@ -0,0 +1,191 @@
+"""
+Interactive viewer of the DES visualization with random access. Frames are
+rendered off-screen and kept in an LRU cache, so returning to a seen frame
+is instant. A background thread pre-renders the frames around the current
+one, in both directions, while the user is looking at it.
+
+Controls: the timeline slider, left/right arrow keys to step back and forward,
+page up/down to move ten steps and home/end to jump to the first/last frame.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider
+from data import DataLoader
+from utils.results_index import ResultsIndex
+from utils.renderer import FrameRenderer
+
+
+class FrameCache():
+    """
+    Least recently used cache of rendered RGB frames, shared between threads.
+    """
+    def __init__(self, max_frames: int):
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, timestep: int):
+        with self.lock:
+            frame = self.frames.get(timestep)
+            if frame is not None:
+                self.frames.move_to_end(timestep)
+            return frame
+
+    def put(self, timestep: int, frame: np.ndarray):
+        with self.lock:
+            self.frames[timestep] = frame
+            self.frames.move_to_end(timestep)
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+
+    def __contains__(self, timestep: int) -> bool:
+        with self.lock:
+            return timestep in self.frames
+
+
+class Prefetcher(threading.Thread):
+    """
+    Renders the neighbours of the requested timestep into the cache, nearest
+    first and forward before backward. A new request interrupts the current
+    one. The thread has its own renderer, as figures and HDF5 file handles
+    cannot be shared between threads.
+    """
+    def __init__(self, cache: FrameCache, create_renderer: Callable[[], FrameRenderer],
+                 max_timesteps: int, radius: int, step: int = 1):
+        super().__init__(daemon=True)
+        self.cache = cache
+        self.create_renderer = create_renderer
+        self.max_timesteps = max_timesteps
+        self.radius = radius
+        self.step = step
+        self.condition = threading.Condition()
+        self.requested = None
+        self.stopped = False
+
+    def request(self, timestep: int):
+        with self.condition:
+            self.requested = timestep
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def get_neighbours(self, timestep: int) -> List[int]:
+        neighbours = []
+        for distance in range(1, self.radius + 1):
+            for neighbour in (timestep + distance * self.step, timestep - distance * self.step):
+                if 0 <= neighbour < self.max_timesteps:
+                    neighbours.append(neighbour)
+        return neighbours
+
+    def is_interrupted(self) -> bool:
+        with self.condition:
+            return self.stopped or self.requested is not None
+
+    def run(self):
+        renderer = self.create_renderer()
+        while True:
+            with self.condition:
+                while self.requested is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                timestep, self.requested = self.requested, None
+
+            for neighbour in self.get_neighbours(timestep):
+                if self.is_interrupted():
+                    break
+                if neighbour not in self.cache:
+                    renderer.render(neighbour)
+                    self.cache.put(neighbour, renderer.to_rgb().copy())
+        renderer.close()
+
+
+class Viewer():
+    """
+    Shows pre-rendered frames of a run with a timeline slider and keyboard seek.
+    step is the number of timesteps moved with the arrow keys.
+    """
+    def __init__(self, index: ResultsIndex, carla_environment: str,
+                 view_car_indexes: List[int], step: int = 1,
+                 cache_frames: int = 32, prefetch_frames: int = 8,
+                 thumbnail_width: int = None):
+        def create_renderer():
+            return FrameRenderer(index, DataLoader(carla_environment), view_car_indexes,
+                                 thumbnail_width=thumbnail_width)
+
+        self.renderer = create_renderer()
+        self.max_timesteps = self.renderer.dataloader.get_simulation_length()
+        self.step = step
+        self.timestep = 0
+        self.cache = FrameCache(cache_frames)
+        # Pre-rendered frames must not evict the frame being viewed.
+        radius = min(prefetch_frames, (cache_frames - 1) // 2)
+        self.prefetcher = Prefetcher(self.cache, create_renderer, self.max_timesteps,
+                                     radius, step)
+
+        # The arrow and home keys would otherwise also move the figure view.
+        for keymap in ("keymap.back", "keymap.forward", "keymap.home"):
+            plt.rcParams[keymap] = []
+        self.fig = plt.figure(figsize=(18, 11))
+        ax = self.fig.add_axes([0, 0.06, 1, 0.94])
+        ax.set_axis_off()
+        self.image = ax.imshow(self.get_frame(self.timestep))
+        slider_ax = self.fig.add_axes([0.1, 0.015, 0.8, 0.03])
+        self.slider = Slider(slider_ax, "Timestep", 0, max(self.max_timesteps - 1, 1),
+                             valinit=0, valstep=1)
+        self.slider.on_changed(self.on_slider_changed)
+        self.fig.canvas.mpl_connect("key_press_event", self.on_key_press)
+        self.fig.canvas.mpl_connect("close_event", self.on_close)
+
+    def get_frame(self, timestep: int) -> np.ndarray:
+        frame = self.cache.get(timestep)
+        if frame is None:
+            self.renderer.render(timestep)
+            # The canvas buffer is reused by the next render.
+            frame = self.renderer.to_rgb().copy()
+            self.cache.put(timestep, frame)
+        return frame
+
+    def show(self, timestep: int):
+        self.timestep = timestep
+        self.image.set_data(self.get_frame(timestep))
+        self.fig.canvas.draw_idle()
+        self.prefetcher.request(timestep)
+
+    def seek(self, timestep: int):
+        timestep = min(max(timestep, 0), self.max_timesteps - 1)
+        if timestep != self.timestep:
+            # The slider callback shows the frame.
+            self.slider.set_val(timestep)
+
+    def on_slider_changed(self, value):
+        self.show(int(value))
+
+    def on_key_press(self, event):
+        moves = {"right": self.step, "left": -self.step,
+                 "pageup": 10 * self.step, "pagedown": -10 * self.step}
+        if event.key in moves:
+            self.seek(self.timestep + moves[event.key])
+        elif event.key == "home":
+            self.seek(0)
+        elif event.key == "end":
+            self.seek(self.max_timesteps - 1)
+
+    def on_close(self, event):
+        self.prefetcher.stop()
+
+    def run(self):
+        """
+        Show the viewer until its window is closed.
+        """
+        self.prefetcher.start()
+        self.prefetcher.request(self.timestep)
+        plt.show()
+        self.prefetcher.stop()
+        self.prefetcher.join()
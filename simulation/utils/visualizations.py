@@ -1,5 +1,8 @@
 import math
+from functools import lru_cache
+import numpy as np
 from matplotlib.path import Path
+from matplotlib.markers import MarkerStyle
 from matplotlib.pyplot import Axes
 from typing import List, Tuple
 import matplotlib as mpl
@@ -8,15 +11,17 @@ import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 from data_models.world import World
 from data import DataLoader
+from utils.results_index import ResultsIndex
 
 
 COLOR_MAP = plt.get_cmap('viridis')
 
 
 def draw_information_view(ax: Axes, agent_count, data: World, timestep: int, 
-                          dataloader: DataLoader):
-    intersections = [
-        d for d in data['intersection_statuses'] if d['timestep'] == timestep]
+                          dataloader: DataLoader, index: ResultsIndex = None):
+    if index is None:
+        index = ResultsIndex(data, [])
+    intersections = index.intersection_statuses(timestep)
 
     ax.set_title("Analysis results")
 
@@ -44,43 +49,52 @@ def draw_information_view(ax: Axes, agent_count, data: World, timestep: int,
 
     # Loop over intersections
     for intersection in intersections:
-        intersection_id = intersection['id']
-        status = intersection['status']
-        car_count = intersection['car_count']
-        car_count_norm = intersection['car_count_norm']
-        human_count = intersection['human_count']
-        human_count_norm = intersection['human_count_norm']
-        speeds = intersection['speeds']
-        # TODO: Same calculation performed in processor.py
-        # just store result there?
-        if len(speeds) == 0:
-            average_speed = 0
-        else:
-            average_speed = (sum(speeds) / len(speeds)) * 3.6 # km/h
-        
         # ax.text(x,y) where 0,0 is 0,1 is top left corner.
-        intersection_id_number = intersection_id.split('_')[1]
-        ax.text(text_x, text_y, f"Intersection {intersection_id_number} result:", 
-                size=13, color=text_color)
-        ax.text(text_x, text_y - text_y_decrease, 
-                f"Total cars: {car_count}, norm: {round(car_count_norm, 2)}", 
-                size=10, color=text_color)
-        ax.text(text_x, text_y - (text_y_decrease * 2), 
-                f"Total humans: {human_count}, norm: {round(human_count_norm, 2)}", 
-                size=10, color=text_color)
-        ax.text(text_x, text_y - (text_y_decrease * 3), 
-                f"Average speed: {round(average_speed, 1)} km/h", 
-                size=10, color=text_color)
-        ax.text(text_x, text_y - (text_y_decrease * 4),
-                f"Congestion status: {status}", 
-                size=10, color=text_color)
+        for i, line in enumerate(get_intersection_lines(intersection)):
+            # First line is the header
+            ax.text(text_x, text_y - (text_y_decrease * i), line,
+                    size=13 if i == 0 else 10, color=text_color)
 
         text_y -= (text_y_decrease * 6)
 
 
+def get_intersection_lines(intersection: dict) -> List[str]:
+    """
+    Text lines describing the analysis result of an intersection.
+    """
+    intersection_id = intersection['id']
+    status = intersection['status']
+    car_count = intersection['car_count']
+    car_count_norm = intersection['car_count_norm']
+    human_count = intersection['human_count']
+    human_count_norm = intersection['human_count_norm']
+    speeds = intersection['speeds']
+    # TODO: Same calculation performed in processor.py
+    # just store result there?
+    if len(speeds) == 0:
+        average_speed = 0
+    else:
+        average_speed = (sum(speeds) / len(speeds)) * 3.6 # km/h
+
+    intersection_id_number = intersection_id.split('_')[1]
+    return [
+        f"Intersection {intersection_id_number} result:",
+        f"Total cars: {car_count}, norm: {round(car_count_norm, 2)}",
+        f"Total humans: {human_count}, norm: {round(human_count_norm, 2)}",
+        f"Average speed: {round(average_speed, 1)} km/h",
+        f"Congestion status: {status}"
+    ]
+
+
 def draw_car_views(car_indexes, ax_ids, axes: Axes, agent_names, 
                    data_results, data_yolo, timestep, dataloader,
-                   draw_caption=True):
+                   draw_caption=True, index: ResultsIndex = None, thumbnail_width=None):
+    if index is None:
+        index = ResultsIndex(data_results, data_yolo)
+    # Bounding boxes are in full resolution image coordinates.
+    scale = 1
+    if thumbnail_width is not None:
+        scale = thumbnail_width / dataloader.get_image_dimensions()[0]
     for i, car_index in enumerate(car_indexes):
         # List to keep count of label y coordinates.
         # This is an attempt to have less overlapping of labels.
@@ -88,13 +102,11 @@ def draw_car_views(car_indexes, ax_ids, axes: Axes, agent_names,
 
         agent_name = agent_names[car_index]
     
-        all_agents_timestep = [
-            d for d in data_results['agents'] if d['timestep'] == timestep]
-        #all_agent_ids = [
-        #    d['id'] for d in data_results['agents'] if d['timestep'] == timestep]
-        agent_data = next((d for d in all_agents_timestep if d['id'] == 
-                      agent_name and d.get('timestep') == timestep), None)
-        images = dataloader.read_images(agent_name, timestep)
+        agent_data = index.agent(timestep, agent_name)
+        if thumbnail_width is None:
+            images = dataloader.read_images(agent_name, timestep)
+        else:
+            images = dataloader.read_thumbnail(agent_name, timestep, thumbnail_width)
         # TODO: Error: Sometimes the agent data seems to disappear??
         # thus velocity is not available only in this part. The other parts 
         # work. This is a silent fix.
@@ -116,19 +128,17 @@ def draw_car_views(car_indexes, ax_ids, axes: Axes, agent_names,
         ax_current.imshow(images)
 
         # Draw the yolo detections
-        yolo_bounds = [
-            d for d in data_yolo if d['parent_id'] == agent_name and
-            d['timestep'] == timestep]
+        yolo_bounds = index.detections(timestep, agent_name)
 
         for bound in yolo_bounds:                
             # Draw the border
             detection_id = bound["detection_id"]
             parent_id = bound['parent_id']
             type = bound["type"]
-            x_min = bound["xmin"]
-            x_max = bound["xmax"]
-            y_min = bound["ymin"]
-            y_max = bound["ymax"]
+            x_min = bound["xmin"] * scale
+            x_max = bound["xmax"] * scale
+            y_min = bound["ymin"] * scale
+            y_max = bound["ymax"] * scale
             height = y_max - y_min
             width = x_max - x_min
 
@@ -141,113 +151,165 @@ def draw_car_views(car_indexes, ax_ids, axes: Axes, agent_names,
                 continue
 
             # Find the parent of the detection (ie the agent itself)
-            detection_agent = None          
-            for agent in all_agents_timestep:
-                # Only process detected agents.
-                if not agent['detected']:
-                    continue
-
-                det_id = agent['id']
-                detection_parent_id = f"{parent_id}-{detection_id}"
-                if det_id == detection_parent_id:
-                    detection_agent = agent
-                    break
-
-            parent_position = (detection_agent['x'], 
-                               detection_agent['y'])
-            agent_position = (agent_data['x'], agent_data['y'])
-            distance = math.dist(agent_position, parent_position) # meters
-            text = f"C: {type}, D: {distance:.1f}m"
-            # if crashing
-            if detection_agent['crashing']: 
-                text += " - COLLISION WARNING"
-
-            label_y = y_min - 10
-            # If label with y coordinate close enough to current label_y
-            tolerance = 20
-            while True:
-                if any(abs(x - label_y) <= tolerance for x in labels_y_coords):
-                    label_y -= 40
-                    if label_y <= 0:
-                        label_y = 0
-                        break
-                else:
-                    break
+            detection_agent = index.detected_agent(timestep, parent_id, detection_id)
+            text = get_detection_caption(type, detection_agent, agent_data)
+            label_y = get_label_y(y_min, labels_y_coords)
             ax_current.text(
                 x_min, label_y, text, size=12, color='white',
                 path_effects=[pe.withStroke(linewidth=2, foreground="black")])
             
             labels_y_coords.append(label_y)
 
-def draw_map(ax: Axes, waypoints: List[Tuple], data, timestep, size, map_auto=True):
+
+def get_detection_caption(detection_type: str, detection_agent: dict,
+                          agent_data: dict) -> str:
+    """
+    Caption of a bounding box with the class and the estimated distance.
+    """
+    parent_position = (detection_agent['x'], 
+                       detection_agent['y'])
+    agent_position = (agent_data['x'], agent_data['y'])
+    distance = math.dist(agent_position, parent_position) # meters
+    text = f"C: {detection_type}, D: {distance:.1f}m"
+    # if crashing
+    if detection_agent['crashing']: 
+        text += " - COLLISION WARNING"
+    return text
+
+
+def get_label_y(y_min: float, labels_y_coords: List[float]) -> float:
+    """
+    Place a caption above the bounding box, moving it up while it
+    overlaps with earlier captions.
+    """
+    label_y = y_min - 10
+    # If label with y coordinate close enough to current label_y
+    tolerance = 20
+    while True:
+        if any(abs(x - label_y) <= tolerance for x in labels_y_coords):
+            label_y -= 40
+            if label_y <= 0:
+                label_y = 0
+                break
+        else:
+            break
+    return label_y
+
+
+def draw_map(ax: Axes, waypoints: List[Tuple], data, timestep, size, map_auto=True,
+             index: ResultsIndex = None):
     """
     Draw the top-view map visualization and markers for cars and humans.
     """
+    if index is None:
+        index = ResultsIndex(data, [])
     x_waypoints, y_waypoints = waypoints
     human_marker, car_marker, rsu_marker = get_human_marker(), get_car_marker(), get_rsu_marker()
-    min_x, max_x, min_y, max_y = size
 
     ax.set_title("2D scene map")
     ax.scatter(x_waypoints, y_waypoints, c='k', s=1, zorder=0)
-    if map_auto:
-        min_x -= 60
-        max_y += 60
-        min_y -= 60
-        max_y += 60
+    x_limits, y_limits = get_map_limits(size, map_auto)
+    ax.set_xlim(x_limits)
+    ax.set_ylim(y_limits)
+
+    timestep_agents = index.agents(timestep)
+    # Draw markers on the map, one collection for each type of marker.
+    colors = get_agent_colors(len(timestep_agents))
+    groups = group_map_agents(timestep_agents)
+
+    if groups['rsu']: # + rsus are rotated + 90, as the marker points down by default
+        markers = ax.scatter(*get_positions(timestep_agents, groups['rsu']).T,
+                             color=colors[groups['rsu']], marker=rsu_marker, s=500)
+        markers.set_paths(get_rotated_markers(timestep_agents, groups['rsu'], "rsu", 90))
+    if groups['human']: # Agent is pedestrian
+        ax.scatter(*get_positions(timestep_agents, groups['human']).T, marker=human_marker,
+                   color=colors[groups['human']], edgecolors="red", s=200)
+    if groups['detected']: # The vehicle was detected, draw circle.
+        ax.scatter(*get_positions(timestep_agents, groups['detected']).T,
+                   color=colors[groups['detected']], edgecolors="red")
+    if groups['known']: # Agent is "known".
+        markers = ax.scatter(*get_positions(timestep_agents, groups['known']).T,
+                             color=colors[groups['known']], marker=car_marker, s=100)
+        markers.set_paths(get_rotated_markers(timestep_agents, groups['known'], "car"))
 
-    ax.set_xlim([min_x, max_x])
-    ax.set_ylim([min_y, max_y])
+    # Rotate Y axis since CARLA Y axis is "upside down".
+    ax.set_ylim(ax.get_ylim()[::-1])
 
-    timestep_agents = [
-        d for d in data['agents'] if d['timestep'] == timestep]
 
-    total_agents = len(timestep_agents)
-    for i, agent in enumerate(timestep_agents):
-        # Rotation difference between CARLA (unit circle -> right = angle 0)
-        # Matplotlib 0 angle = up. -90 to compensate. Additionally since the
-        # y-axis is flipped, need to account for that too with calculate_angle_y_flip.
-        rotation_adjusted = calculate_angle_y_flip(agent['direction'])
-        agent_marker = car_marker.transformed(
-            mpl.transforms.Affine2D().rotate_deg(rotation_adjusted))
-        
-        # + rsus are rotated + 90, as the marker points down by default
-        rsu_marker_2 = rsu_marker.transformed(
-            mpl.transforms.Affine2D().rotate_deg(rotation_adjusted + 90))
+def get_agent_colors(total_agents: int) -> np.ndarray:
+    """
+    RGBA color of each agent of a timestep, computed once for all agents.
+    """
+    return COLOR_MAP(np.arange(total_agents) / max(total_agents, 1))
 
-        # Draw markers on the map
-        colors = [COLOR_MAP(1.*i/total_agents) for i in range(total_agents)]
 
+def group_map_agents(agents: List[dict]) -> dict:
+    """
+    Indexes of the agents drawn with each type of map marker. RSUs
+    are drawn with the RSU marker in addition to the vehicle marker.
+    """
+    groups = {'rsu': [], 'human': [], 'detected': [], 'known': []}
+    for i, agent in enumerate(agents):
         if agent["type"] == 'is_rsu': # Agent is RSU
-            ax.scatter(
-                agent['x'], agent['y'], color=colors[i], marker=rsu_marker_2, s=500)
+            groups['rsu'].append(i)
         if agent["type"] == 'person': # Agent is pedestrian
-             ax.scatter(agent['x'], agent['y'], marker=human_marker,
-                                color=colors[i], edgecolors="red", s=200)
-        else: # Agent is vehicle
-            if agent['detected']: # The vehicle was detected, draw circle.
-                ax.scatter(agent['x'], agent['y'], color=colors[i], 
-                           edgecolors="red")
-            else: # Agent is "known".
-                ax.scatter(agent['x'], agent['y'], color=colors[i], 
-                           marker=agent_marker, s=100)
-    
-    # Rotate Y axis since CARLA Y axis is "upside down".
-    ax.set_ylim(ax.get_ylim()[::-1])
+            groups['human'].append(i)
+        elif agent['detected']: # The vehicle was detected, draw circle.
+            groups['detected'].append(i)
+        else: # Agent is "known".
+            groups['known'].append(i)
+    return groups
+
+
+def get_positions(agents: List[dict], indexes: List[int]) -> np.ndarray:
+    return np.reshape([(agents[i]['x'], agents[i]['y']) for i in indexes], (-1, 2))
+
+
+def get_rotated_markers(agents: List[dict], indexes: List[int], marker: str,
+                        rotation_offset: float = 0) -> List[Path]:
+    """
+    Marker paths of the agents rotated to their direction, to be set
+    as the paths of a single collection.
+    """
+    # Rotation difference between CARLA (unit circle -> right = angle 0)
+    # Matplotlib 0 angle = up. -90 to compensate. Additionally since the
+    # y-axis is flipped, need to account for that too with calculate_angle_y_flip.
+    return [get_rotated_marker(marker, round(calculate_angle_y_flip(agents[i]['direction'])
+                                             + rotation_offset))
+            for i in indexes]
+
+
+@lru_cache(maxsize=None)
+def get_rotated_marker(marker: str, degrees: int) -> Path:
+    """
+    Marker path rotated to whole degrees, normalized the same way as a
+    scatter marker. Computed once per marker and angle.
+    """
+    path = get_rsu_marker() if marker == "rsu" else get_car_marker()
+    style = MarkerStyle(path.transformed(mpl.transforms.Affine2D().rotate_deg(degrees)))
+    return style.get_path().transformed(style.get_transform())
+
+
+def get_map_limits(size: Tuple, map_auto=True) -> Tuple[List, List]:
+    """
+    Axis limits of the map before the y axis is flipped.
+    """
+    min_x, max_x, min_y, max_y = size
+    if map_auto:
+        min_x -= 60
+        max_y += 60
+        min_y -= 60
+        max_y += 60
+    return [min_x, max_x], [min_y, max_y]
 
 
 def get_relevant_coordinates(processed: object):
     """
     Find min and max values for both x and y coordinates for each agent
     and detected entity. Used for scaling the visualization.
+    ResultsIndex.size has the same value precomputed.
     """
-    agent_states = processed['agents']
-    x_coords = []
-    y_coords = []
-    for agent in agent_states: 
-        x_coords.append(agent['x'])
-        y_coords.append(agent['y'])
-
-    return (min(x_coords), max(x_coords), min(y_coords), max(y_coords))
+    return ResultsIndex.compute_size(processed)
 
 
 def calculate_angle_y_flip(rotation: float) -> float:
@@ -2,12 +2,26 @@ import os
 import sys
 import json
 import getopt
+import multiprocessing
+import matplotlib
 import matplotlib.pyplot as plt
 from data import DataLoader
 from utils.visualizations import *
+from utils.results_index import ResultsIndex
+from utils.renderer import FrameRenderer
+from utils.viewer import Viewer
+from utils.video import VideoEncoder, concatenate_segments
 
 
 folder = "visualization/figures"
+video_path = "visualization/video.mp4"
+video_fps = 15
+# Cameras of the car views by default, see --cameras.
+view_car_indexes = [3, 6]
+
+# Per worker process state of the parallel rendering.
+worker_renderer = None
+worker_figures_folder = None
 
 
 def read_data(results_path, yolo_path):
@@ -23,69 +37,140 @@ def read_data(results_path, yolo_path):
     return data_results, data_yolo
 
 
-def render_visualization(run_folder, carla_environment, interactive=False,
-                         skip_timesteps=0):
-    
+def load_results_index(run_folder) -> ResultsIndex:
     results_path = os.path.join("results", run_folder)
     simulation_results_path = os.path.join(results_path, "results.json")
     yolo_results_path = os.path.join(results_path, "yolo_results.json")
-    # NOTE: Currently data searches to find corresponding timestep data is done 
-    # many many times inside the visualization loop. If faster required, 
-    # pre-process the data to the form data['agents'][timestep].
     data_results, data_yolo = read_data(simulation_results_path, yolo_results_path)
+    # Index the results once, so that each frame can find its data in O(1).
+    return ResultsIndex(data_results, data_yolo)
+
 
+def init_render_worker(run_folder, carla_environment, figures_folder, car_indexes,
+                       thumbnail_width):
+    """
+    Each worker process loads its own read-only copy of the results and
+    opens its own handle to the HDF5 file, as neither can be shared.
+    """
+    global worker_renderer, worker_figures_folder
+    matplotlib.use("Agg")
+    index = load_results_index(run_folder)
     dataloader = DataLoader(carla_environment)
-    max_timesteps = dataloader.get_simulation_length()
-    metadata_summary = dataloader.get_metadata_summary()
-    agents = dataloader.get_entity_ids()
-    size = get_relevant_coordinates(data_results)
-    x_waypoints, y_waypoints = zip(*dataloader.get_map()) # List of (x,y).
-    waypoints = (x_waypoints, y_waypoints)
-
-    agent_count = metadata_summary['n_vehicles']
-    # NOTE Currently only two cars supported!
-    view_car_indexes = [3, 6]
-        
-    if interactive:
-        plt.ion()
+    worker_renderer = FrameRenderer(index, dataloader, car_indexes,
+                                    thumbnail_width=thumbnail_width)
+    worker_figures_folder = figures_folder
+
+
+def render_timesteps(timesteps):
+    for timestep in timesteps:
+        worker_renderer.render(timestep)
+        worker_renderer.save(f'{worker_figures_folder}/fig-{timestep}.png')
+    return len(timesteps)
+
+
+def render_segment(segment):
+    """
+    Encode a contiguous range of timesteps into its own video file.
+    """
+    timesteps, segment_path = segment
+    encoder = VideoEncoder(segment_path, video_fps)
+    for timestep in timesteps:
+        worker_renderer.render(timestep)
+        encoder.write(worker_renderer.to_rgb())
+    encoder.close()
+    return len(timesteps)
+
+
+def render_parallel(run_folder, carla_environment, figures_folder, workers,
+                    video_file=None, chunk_size=10, car_indexes=view_car_indexes,
+                    thumbnail_width=None):
+    """
+    Render the frames using a pool of processes. Frames are independent, so
+    the timesteps are split into chunks for the workers. Figures have the same
+    file names as when rendering in a single process. Videos are encoded in
+    one contiguous segment per worker and the segments are then concatenated.
+    """
+    max_timesteps = DataLoader(carla_environment).get_simulation_length()
+    timesteps = list(range(max_timesteps))
+    if video_file is None:
+        tasks = [timesteps[i:i + chunk_size] for i in range(0, max_timesteps, chunk_size)]
+        task_function = render_timesteps
     else:
-        # Ensure figures folder is created if interactive = False
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+        segment_length = -(-max_timesteps // workers) # Ceiling division
+        tasks = [(timesteps[i:i + segment_length], f"{video_file}.segment-{i}.mp4")
+                 for i in range(0, max_timesteps, segment_length)]
+        task_function = render_segment
+
+    rendered = 0
+    with multiprocessing.Pool(workers, initializer=init_render_worker,
+                              initargs=(run_folder, carla_environment, figures_folder,
+                                        car_indexes, thumbnail_width)) as pool:
+        for count in pool.imap_unordered(task_function, tasks):
+            rendered += count
+            print(f"Rendered frame {rendered} / {max_timesteps}", end='\r')
 
+    if video_file is not None:
+        segment_paths = [segment_path for _, segment_path in tasks]
+        concatenate_segments(segment_paths, video_file)
+        for segment_path in segment_paths:
+            os.remove(segment_path)
+
+
+def render_visualization(run_folder, carla_environment, interactive=False,
+                         skip_timesteps=0, figures_folder=folder, workers=1,
+                         video_file=None, cache_frames=32, car_indexes=view_car_indexes,
+                         thumbnail_width=None):
+    """
+    Show the results interactively, or save them. If video_file is given,
+    the frames are encoded directly into the video instead of png figures.
+    car_indexes are the entities shown in the car views, any number of
+    them is drawn as a grid of thumbnails.
+    """
+    if not interactive:
+        # Ensure output folder is created if interactive = False
+        output_folder = figures_folder if video_file is None else os.path.dirname(video_file)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        if workers > 1:
+            render_parallel(run_folder, carla_environment, figures_folder, workers,
+                            video_file, car_indexes=car_indexes,
+                            thumbnail_width=thumbnail_width)
+            print("done")
+            return
+
+    index = load_results_index(run_folder)
+    if interactive:
+        # Skipped timesteps apply to the step of the arrow keys.
+        viewer = Viewer(index, carla_environment, car_indexes,
+                        step=skip_timesteps + 1, cache_frames=cache_frames,
+                        thumbnail_width=thumbnail_width)
+        viewer.run()
+        print("done")
+        return
+
+    dataloader = DataLoader(carla_environment)
+    # The figure is created once and only updated for each timestep.
+    renderer = FrameRenderer(index, dataloader, car_indexes,
+                             thumbnail_width=thumbnail_width)
+    encoder = None
+    if video_file is not None:
+        encoder = VideoEncoder(video_file, video_fps)
     timestep = 0
     max_timesteps = dataloader.get_simulation_length()
     while timestep <= max_timesteps - 1:
-        # TODO: Would it be possible to create the figure outside the loop?
-        fig, axes = plt.subplot_mosaic(
-            [["top left", "top centre", "top right"],
-            ["bottom row", "bottom row", "bottom row"]], 
-            height_ratios=[1, 1.5], width_ratios=[1, 1, 1]
-        )
-        fig.suptitle(f"Simulation timestep {timestep}", fontsize=26)
-
-        #axes[1,1].legend()
-        view_axes = ["top left", "top right"]
-        draw_car_views(view_car_indexes, view_axes, axes, agents, data_results,
-                       data_yolo, timestep, dataloader)
-        draw_information_view(axes["top centre"], agent_count, data_results, 
-                              timestep, dataloader)
-        draw_map(axes["bottom row"], waypoints, data_results, timestep, size)
-
-        mng = plt.get_current_fig_manager()
-        mng.full_screen_toggle()
-        if interactive:
-            plt.waitforbuttonpress()
+        renderer.render(timestep)
+        if encoder is not None:
+            encoder.write(renderer.to_rgb())
+            print(f"Encoded frame {timestep + 1} / {max_timesteps}", end='\r')
         else:
             # save figure if not interactive
-            fig.set_size_inches(18, 11) # w, h
-            fig.savefig(f'{folder}/fig-{timestep}.png', dpi = 100)
+            renderer.save(f'{figures_folder}/fig-{timestep}.png')
             # Specify no new line ending to replace this line constantly
             print(f"Saved figure {timestep + 1} / {max_timesteps}", end='\r')
-        plt.close()
         timestep += 1
-        if interactive: # If recording video, timestep skips not applied!
-            timestep += skip_timesteps
+    if encoder is not None:
+        encoder.close()
+    renderer.close()
     print("done")
 
 
@@ -93,27 +178,43 @@ def print_help():
     help_text = "Ensure main.py has been run before this. If not, read the README.\n" \
         "Usage: python main.py. Possible arguments:\n" \
         "\t-h - Help\n" \
-        "\t--save_video - Disables interactive mode and saves each figure.\n" \
+        f"\t--save_video - Disables interactive mode and encodes the video to {video_path}.\n" \
+        "\t--save_figures - Disables interactive mode and saves each figure as png.\n" \
         "\t\tUse utils/video.py to convert them to a video.\n" \
-        "\t--skip <integer> - In interactive mode when advancing skip <integer> frames.\n" \
+        "\t--skip <integer> - In interactive mode the arrow keys skip <integer> frames.\n" \
+        "\t--cache_frames <integer> - Number of rendered frames the interactive mode keeps\n" \
+        "\t\tin memory, about 6 MB each. Default 32.\n" \
         "\t--environment <string> - The CARLA environment file name, stored under runs/.\n" \
         "\t--run_folder <string> - Path of simulation results\n" \
+        "\t--workers <integer> - When saving, render using <integer> processes.\n" \
+        f"\t--cameras <list> - Comma separated indexes of the shown cameras, default {view_car_indexes}.\n" \
+        "\t\tUse all to show every camera. Other than two cameras are shown as a grid.\n" \
+        "\t--thumbnail <integer> - Width in pixels the camera images are decoded at.\n" \
         "\n" \
         "Example:\n" \
         "python visualize.py --environment intersection_5_vehicles.hdf5 --run_folder " \
         "medium-intersection_5_vehicles.hdf5-rsu_used_True-1681047827 --skip 20\n" \
         "python visualize.py --environment intersection_5_vehicles.hdf5 --run_folder " \
-        "medium-intersection_5_vehicles.hdf5-rsu_used_True-1681047827 --save_video"
+        "medium-intersection_5_vehicles.hdf5-rsu_used_True-1681047827 --save_video --workers 8\n" \
+        "python visualize.py --environment intersection_5_vehicles.hdf5 --run_folder " \
+        "medium-intersection_5_vehicles.hdf5-rsu_used_True-1681047827 --cameras all"
         
     print(help_text)
 
 
 if __name__ == "__main__":
-    opts, args = getopt.getopt(sys.argv[1:], "h", ["save_video", "skip=",
-                                                   "environment=", "run_folder="])
+    opts, args = getopt.getopt(sys.argv[1:], "h", ["save_video", "save_figures", "skip=",
+                                                   "environment=", "run_folder=",
+                                                   "workers=", "cache_frames=", "cameras=",
+                                                   "thumbnail="])
     RUN = True
     IS_INTERACTIVE = True
+    VIDEO_FILE = None
     SKIP_TIMESTEPS = 0
+    WORKERS = 1
+    CACHE_FRAMES = 32
+    CAMERAS = ",".join(str(i) for i in view_car_indexes)
+    THUMBNAIL_WIDTH = None
     RUN_FOLDER = ""
     CARLA_DATA_NAME = ""
     for opt, arg in opts:
@@ -122,12 +223,23 @@ if __name__ == "__main__":
             RUN = False
         if opt == "--save_video":
             IS_INTERACTIVE = False
+            VIDEO_FILE = video_path
+        if opt == "--save_figures":
+            IS_INTERACTIVE = False
         if opt == "--skip":
             SKIP_TIMESTEPS = int(arg)
         if opt == "--environment":
             CARLA_DATA_NAME = arg
         if opt == "--run_folder":
             RUN_FOLDER = arg
+        if opt == "--workers":
+            WORKERS = int(arg)
+        if opt == "--cache_frames":
+            CACHE_FRAMES = int(arg)
+        if opt == "--cameras":
+            CAMERAS = arg
+        if opt == "--thumbnail":
+            THUMBNAIL_WIDTH = int(arg)
 
     if RUN:
         if RUN_FOLDER == "" or CARLA_DATA_NAME == "":
@@ -138,12 +250,28 @@ if __name__ == "__main__":
             print("Cannot add skip argument if not interactive!")
             sys.exit(2)
 
+        if IS_INTERACTIVE and WORKERS > 1:
+            print("Cannot add workers argument if interactive!")
+            sys.exit(2)
+
+        if CAMERAS == "all":
+            CAR_INDEXES = list(range(len(DataLoader(CARLA_DATA_NAME).get_entity_ids())))
+        else:
+            CAR_INDEXES = [int(i) for i in CAMERAS.split(",")]
+
         render_visualization(run_folder=RUN_FOLDER,
                              carla_environment=CARLA_DATA_NAME,
                              interactive=IS_INTERACTIVE, 
-                             skip_timesteps=SKIP_TIMESTEPS)
+                             skip_timesteps=SKIP_TIMESTEPS,
+                             workers=WORKERS,
+                             video_file=VIDEO_FILE,
+                             cache_frames=CACHE_FRAMES,
+                             car_indexes=CAR_INDEXES,
+                             thumbnail_width=THUMBNAIL_WIDTH)
         
-        if not IS_INTERACTIVE:
+        if VIDEO_FILE is not None:
+            print(f"Video saved to {VIDEO_FILE}.")
+        elif not IS_INTERACTIVE:
             print(f"Video saved as figures to folder {folder}.\n" \
                 "Use utils/video.py to convert them to a video if necessary.")
         print("Done.")